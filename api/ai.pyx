@@ -1,4 +1,7 @@
 import time
+from collections import OrderedDict
+
+import util
 
 IDLE = 0
 RUNNING = 1
@@ -8,9 +11,15 @@ CONTINUE = 3
 END = 4
 SKIP = 5
 
+# The valid return values of the task execution checks
+START_STATES = frozenset([START, SKIP])
+CONTINUE_STATES = frozenset([CONTINUE, SKIP, END])
+
 class AIHandler:
     def __init__(self):
         self.registeredAI = [[] for a in range(10)]
+        # The registered tasks, flattened into the order they run in
+        self.tasks = []
         self.time = time.time()
 
     def registerAITask(self, task, weight):
@@ -25,45 +34,66 @@ class AIHandler:
         else:
             raise ValueError('AI Task weighting is not between 0 and 9')
 
-    def runAITick(self, game):
+        # Rebuild the run order, skipping the empty layers
+        self.tasks = [t for l in range(9, -1, -1) for t in self.registeredAI[l]]
+
+    def runAITick(self, game, now=None, stats=None):
         '''
         Run the registered AI tasks for a tick
+        now is a timestamp shared by every entity in the tick
+        If given, the time taken by each task class is added to stats
         '''
+        if now is None:
+            now = time.time()
         # Calculate the change in time, but clip it to half a second
-        deltaTime = min(time.time()-self.time, 500)
-        self.time = time.time()
-
-        # Loop each layer and task in order
-        for l in range(9, -1, -1):
-            for t, task in enumerate(self.registeredAI[l]):
-                # Check if the task should run, and run if able
-                if task.status == IDLE:
-                    shouldRun = self.registeredAI[l][t].shouldStartExecute(game)
-                    if shouldRun not in [START, SKIP]:
-                        raise TypeError('Returned value is not a valid execution state')
-
-                    if shouldRun == START:
-                        self.registeredAI[l][t].startExecution(game)
-                        self.registeredAI[l][t].status = RUNNING
-
-                # Check if the task should continue, and run if able
-                elif task.status == RUNNING:
-                    shouldRun = self.registeredAI[l][t].shouldContinueExecute(game)
-                    if shouldRun not in [CONTINUE, SKIP, END]:
-                        raise TypeError('Returned value is not a valid execution state')
-
-                    if shouldRun == CONTINUE:
-                        self.registeredAI[l][t].continueExecution(game, deltaTime)
-                    elif shouldRun == END:
-                        self.registeredAI[l][t].endExecution(game)
-                        self.registeredAI[l][t].status = IDLE
-
-                else:
-                    raise TypeError('Task status is not a valid execution state')
-
-                # Skip the task if it should
-                if shouldRun == SKIP:
-                    self.registeredAI[l][t].skipExecution(game, deltaTime)
+        deltaTime = min(now-self.time, 500)
+        self.time = now
+
+        lastTime = time.perf_counter() if stats is not None else 0
+        # Loop each task in order
+        for task in self.tasks:
+            # Check if the task should run, and run if able
+            if task.status == IDLE:
+                shouldRun = task.shouldStartExecute(game)
+                if shouldRun not in START_STATES:
+                    raise TypeError('Returned value is not a valid execution state')
+
+                if shouldRun == START:
+                    task.startExecution(game)
+                    task.status = RUNNING
+
+            # Check if the task should continue, and run if able
+            elif task.status == RUNNING:
+                shouldRun = task.shouldContinueExecute(game)
+                if shouldRun not in CONTINUE_STATES:
+                    raise TypeError('Returned value is not a valid execution state')
+
+                if shouldRun == CONTINUE:
+                    task.continueExecution(game, deltaTime)
+                elif shouldRun == END:
+                    task.endExecution(game)
+                    task.status = IDLE
+
+            else:
+                raise TypeError('Task status is not a valid execution state')
+
+            # Skip the task if it should
+            if shouldRun == SKIP:
+                task.skipExecution(game, deltaTime)
+
+            # Add the time taken to the task class's statistics
+            if stats is not None:
+                taskTime = time.perf_counter()
+                record = stats.setdefault(task.__class__.__name__, [0, 0])
+                record[0] += 1
+                record[1] += taskTime-lastTime
+                lastTime = taskTime
+
+    def skipAITick(self, now=None):
+        '''
+        Skip a tick without running any tasks or building up time, for dormant entities
+        '''
+        self.time = time.time() if now is None else now
 
     def hasAttribute(self, name):
         '''
@@ -75,6 +105,56 @@ class AIHandler:
         except AttributeError:
             return False
 
+class AIScheduler:
+    '''
+    Runs the AI of every entity in a world under a time budget for each tick (SERVER-SIDE)
+    Entities which don't fit in a tick are run first in the next one
+    '''
+    def __init__(self, budget=util.AI_BUDGET):
+        # The number of seconds of AI to run per tick
+        self.budget = budget
+        # The entities waiting for an AI tick, by uuid, in the order they will run
+        self.pending = OrderedDict()
+        # The number of calls and total time of each task class
+        self.stats = {}
+        self.carried = 0
+
+    def queueEntity(self, entity):
+        '''
+        Queue an entity to run its AI, unless it is still waiting from a previous tick
+        '''
+        if entity.uuid not in self.pending:
+            self.pending[entity.uuid] = entity
+
+    def removeEntity(self, entity):
+        '''
+        Forget an entity which has left the world
+        '''
+        self.pending.pop(entity.uuid, None)
+
+    def run(self, game):
+        '''
+        Run the queued entity AI until the budget for this tick is used up
+        '''
+        now = time.time()
+        start = time.perf_counter()
+        while self.pending:
+            uuid, entity = self.pending.popitem(last=False)
+            entity.aiHandler.runAITick(game, now, self.stats)
+
+            # Always run at least one entity, so the queue drains even when over budget
+            if time.perf_counter()-start >= self.budget:
+                break
+
+        # Anything left over carries to the next tick
+        self.carried = len(self.pending)
+
+    def getStats(self):
+        '''
+        Return the number of calls and total seconds spent in each task class, with the most expensive first
+        '''
+        return sorted([(name, calls, total) for name, (calls, total) in self.stats.items()], key=lambda a: -a[2])
+
 class AITask:
     def __init__(self, entity):
         self.status = IDLE
@@ -116,6 +196,14 @@ class AITask:
         '''
         pass
 
+    def findPath(self, game, goal):
+        '''
+        Return a list of waypoints from the entity to a goal position, avoiding obstacles
+        Return None if there is no path, or the world has run out of path searches this tick
+        '''
+        pathFinder = game.getDimension(self.entity.dimension).getPathFinder(game.modLoader.gameRegistry)
+        return pathFinder.findPath(self.entity.pos, goal, game.tick)
+
     def hasAttribute(self, name):
         '''
         Return whether the class (and classes which extend this) has a given attribute
@@ -28,6 +28,12 @@ class Tile:
         '''
         return 'resources/textures/mods/tiles/{}.png'.format(self.getTileName())
 
+    def isWalkable(self):
+        '''
+        Return whether entities can walk through this tile
+        '''
+        return True
+
 class Plant(Tile):
     pass
 
@@ -83,6 +89,15 @@ class Biome:
             # Then instantiate the detail object
             self.plantTypes[i] = self.plantTypes[i]()
 
+    def isWalkable(self):
+        '''
+        Return whether entities can walk through both the tile and the plant chosen for this tile
+        '''
+        for types, index in [(self.tileTypes, self.tileIndex), (self.plantTypes, self.plantIndex)]:
+            if types and index >= 0 and isinstance(types[index], Tile) and not types[index].isWalkable():
+                return False
+        return True
+
 class TileMap:
     def __init__(self, width, height):
         self.map = [[0 for column in range(width)] for row in range(height)]
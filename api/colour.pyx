@@ -1,7 +1,5 @@
 from math import sqrt,cos,sin,radians
 
-import pygame
-
 def clamp(v):
     '''
     Clamp the pixel colour to between 0 and 255
@@ -53,6 +51,9 @@ def hueShiftImage(imgValues, imageName, image, fullPath="resources/other/", attr
     '''
     Shift the hue of an image using an array of hue shift values
     '''
+    # Only the client renders images, so pygame is imported here rather than at the top
+    import pygame
+
     fullPath += imageName
     pixArray = pygame.PixelArray(image)
 
@@ -4,15 +4,35 @@ import random
 import time
 import noise
 
+# NumPy is optional, and only needed by the EntityStore
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 # Import the mod files
 from api.packets import *
 from api.biome import *
 from api.entity import *
+from api.interest import *
+from api.priority import UpdatePrioritiser, getObjectKey
+from api.lod import SimulationScheduler, DORMANT
+from api.ai import AIScheduler
+from api.pathfinding import PathFinder
+from api.steering import GroupSteering
+
+import util
+
+import struct
+
+# The chunk the update's positions are relative to, then the number of players, entities, vehicles and removed keys
+UPDATE_HEADER = struct.Struct('>iiHHHH')
 
 class DimensionHandler:
     def __init__(self, chunkProvider, world):
         self.chunkProvider = chunkProvider
         self.worldObj = world
+        self.pathFinder = None
 
     def getName(self):
         '''
@@ -39,6 +59,14 @@ class DimensionHandler:
         tileMap = self.chunkProvider.generate(pos, gameRegistry)
         self.worldObj.setTileMap(tileMap)
 
+    def getPathFinder(self, gameRegistry):
+        '''
+        Return the PathFinder for this dimension, creating it if required
+        '''
+        if self.pathFinder is None:
+            self.pathFinder = PathFinder(self.chunkProvider, gameRegistry)
+        return self.pathFinder
+
 class ChunkProvider:
     def __init__(self, biomes, biomeSize):
         self.biomes = biomes
@@ -50,6 +78,156 @@ class ChunkProvider:
         '''
         raise NotImplementedError('ChunkProvider has no generate method.')
 
+    def getTileAt(self, pos, gameRegistry, centre=None):
+        '''
+        Return the tile (as a Biome with its tile type set) at a given world position
+        This must match the tile in a TileMap generated around the centre, if one is given
+        Return None if the provider can't tell, in which case the tile is treated as walkable
+        '''
+        return None
+
+class EntityStore:
+    '''
+    A columnar store of the entity values that change every tick (SERVER-SIDE)
+    Each spawned entity is given a slot, and its values are kept in NumPy arrays at that index,
+    so the AI movement of every entity can be applied at once with array operations
+    '''
+    def __init__(self, capacity=256):
+        self.entities = []
+        self.freeSlots = []
+        self.allocate(capacity)
+
+    def allocate(self, capacity):
+        '''
+        Create (or grow) the arrays to hold the given number of entities
+        '''
+        columns = {'pos' : (2, float), 'vel' : (2, float), 'speed' : (None, float),
+                   'health' : (None, float), 'dimension' : (None, int),
+                   'wandering' : (None, bool), 'wanderTarget' : (2, float), 'wanderTime' : (None, float),
+                   'pursuing' : (None, bool), 'pursuitTarget' : (2, float),
+                   'steering' : (None, bool), 'steerDirection' : (2, float),
+                   'moveDelta' : (None, float)}
+        for name, (width, dtype) in columns.items():
+            shape = (capacity, width) if width else (capacity,)
+            column = numpy.zeros(shape, dtype)
+            if hasattr(self, name):
+                old = getattr(self, name)
+                column[:len(old)] = old
+            setattr(self, name, column)
+        self.capacity = capacity
+
+    def addEntity(self, entity):
+        '''
+        Move an entity's values into the store, and point the entity at its slot
+        '''
+        if entity.entityStore is not None:
+            return
+        values = [entity.pos, entity.speed, entity.health, entity.dimension]
+
+        # Reuse a free slot, or append to the end
+        if self.freeSlots:
+            slot = self.freeSlots.pop()
+            self.entities[slot] = entity
+        else:
+            slot = len(self.entities)
+            if slot == self.capacity:
+                self.allocate(self.capacity*2)
+            self.entities.append(entity)
+
+        entity.entityStore, entity.storeSlot = self, slot
+        entity.pos, entity.speed, entity.health, entity.dimension = values
+        self.vel[slot] = 0
+        self.clearMovement(slot)
+
+    def removeEntity(self, entity):
+        '''
+        Copy an entity's values back onto the object, and free its slot
+        '''
+        if entity.entityStore is not self:
+            return
+        slot = entity.storeSlot
+        values = [entity.pos, entity.speed, entity.health, entity.dimension]
+        entity.entityStore, entity.storeSlot = None, None
+        entity.pos, entity.speed, entity.health, entity.dimension = values
+
+        self.entities[slot] = None
+        self.clearMovement(slot)
+        self.freeSlots.append(slot)
+
+    def clearMovement(self, slot):
+        self.wandering[slot] = self.pursuing[slot] = self.steering[slot] = False
+        self.moveDelta[slot] = 0
+
+    def queueWander(self, slot, target, timeLeft, deltaTime):
+        '''
+        Queue a walk towards a target, arriving in the given number of seconds
+        '''
+        self.wandering[slot] = True
+        self.wanderTarget[slot] = target
+        self.wanderTime[slot] = timeLeft
+        self.moveDelta[slot] = deltaTime
+
+    def queuePursuit(self, slot, target, deltaTime):
+        '''
+        Queue a full speed run towards a target
+        '''
+        self.pursuing[slot] = True
+        self.pursuitTarget[slot] = target
+        self.moveDelta[slot] = deltaTime
+
+    def queueSteer(self, slot, direction, deltaTime):
+        '''
+        Queue a full speed move in the direction of a vector
+        '''
+        self.steering[slot] = True
+        self.steerDirection[slot] = direction
+        self.moveDelta[slot] = deltaTime
+
+    def applyMovement(self):
+        '''
+        Move every entity by the displacement of all of its queued movements, then clear the queues
+        '''
+        n = len(self.entities)
+        pos = self.pos[:n]
+        speed = self.speed[:n, None]
+        deltaTime = self.moveDelta[:n, None]
+        displacement = numpy.zeros((n, 2))
+
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            # Walk towards the wander target, capped at the entity's speed
+            mask = self.wandering[:n]
+            if mask.any():
+                timeLeft = numpy.maximum(self.wanderTime[:n, None], deltaTime)[mask]
+                velocity = numpy.minimum((self.wanderTarget[:n][mask]-pos[mask])/timeLeft, speed[mask])
+                displacement[mask] += velocity*deltaTime[mask]
+
+            # Run straight at the pursuit target, without overshooting it
+            mask = self.pursuing[:n]
+            if mask.any():
+                vector = self.pursuitTarget[:n][mask]-pos[mask]
+                distance = numpy.hypot(vector[:, 0], vector[:, 1])[:, None]
+                ratio = numpy.where(distance > 0, numpy.minimum(1, speed[mask]*deltaTime[mask]/distance), 0)
+                displacement[mask] += vector*ratio
+
+            # Move along the normalised steering direction
+            mask = self.steering[:n]
+            if mask.any():
+                direction = self.steerDirection[:n][mask]
+                mag = numpy.hypot(direction[:, 0], direction[:, 1])[:, None]
+                displacement[mask] += numpy.where(mag > 0, direction/mag, 0)*speed[mask]*deltaTime[mask]
+
+            moving = self.wandering[:n] | self.pursuing[:n] | self.steering[:n]
+            self.vel[:n] = numpy.where(deltaTime > 0, displacement/deltaTime, 0)
+            self.vel[:n][~moving] = 0
+        pos += displacement
+
+        # The moved entities need encoding again
+        for slot in numpy.flatnonzero(displacement.any(axis=1)):
+            self.entities[slot].clearRecordCache()
+
+        self.wandering[:n] = self.pursuing[:n] = self.steering[:n] = False
+        self.moveDelta[:n] = 0
+
 class WorldMP:
     def __init__(self):
         self.entities = []
@@ -60,6 +238,26 @@ class WorldMP:
 
         self._world = None
 
+        # Initialise the spatial grids and player interest areas (SERVER-SIDE)
+        self.playerGrid = SpatialGrid()
+        self.entityGrid = SpatialGrid()
+        self.vehicleGrid = SpatialGrid()
+        self.interest = InterestManager(self.playerGrid)
+        self.interestActive = False
+
+        # Initialise the per-client update rate and bandwidth handling (SERVER-SIDE)
+        self.prioritiser = UpdatePrioritiser()
+
+        # Initialise the entity simulation detail levels (SERVER-SIDE)
+        self.scheduler = SimulationScheduler()
+        self.aiScheduler = AIScheduler()
+        self.groupSteering = GroupSteering()
+
+        # Initialise the columnar entity values, if enabled and NumPy is installed (SERVER-SIDE)
+        self.entityStore = None
+        if util.ENTITY_STORE and numpy is not None:
+            self.entityStore = EntityStore()
+
     def setTileMap(self, tileMap):
         '''
         Set the tile map of the world
@@ -91,10 +289,26 @@ class WorldMP:
             return False
         if isinstance(entity, Vehicle):
             self.vehicles.append(entity)
+            self.vehicleGrid.updateObject(entity.uuid, entity)
         else:
+            if self.entityStore and isinstance(entity, Entity):
+                self.entityStore.addEntity(entity)
             self.entities.append(entity)
+            self.entityGrid.updateObject(entity.uuid, entity)
         return True
 
+    def updateInterest(self):
+        '''
+        Move objects between grid cells and update the player subscriptions (SERVER-SIDE UPDATE)
+        '''
+        self.playerGrid.sync(self.players, 'name')
+        self.entityGrid.sync(self.entities, 'uuid')
+        self.vehicleGrid.sync(self.vehicles, 'uuid')
+        self.interest.sync(self.players)
+        self.prioritiser.sync(self.players)
+        self.prioritiser.clearCombat()
+        self.interestActive = True
+
     def tickUpdate(self, game):
         '''
         Run one tick of updates on the world and everything in it (SERVER-SIDE UPDATE)
@@ -102,12 +316,35 @@ class WorldMP:
         # Separate the Game Registry
         gameRegistry = game.modLoader.gameRegistry
 
-        # Loop through the entities and update them
+        # Bring the spatial grids up to date before anything queries them
+        self.updateInterest()
+
+        # Sort the entities into simulation tiers by their distance to the nearest player
+        self.scheduler.update(self.entityGrid, self.players)
+
+        # Queue the entities due an AI tick, as often as their tier allows
+        now = time.time()
+        for entity in self.entities:
+            tier = self.scheduler.getTier(self.entityGrid.objectCells.get(entity.uuid))
+            if self.scheduler.shouldTick(tier, entity.uuid, game.tick):
+                self.aiScheduler.queueEntity(entity)
+            elif tier == DORMANT:
+                entity.aiHandler.skipAITick(now)
+
+        # Run as much AI as fits in the budget. Skipped and left over time is built up for the next run
+        self.aiScheduler.run(game)
+
+        # Steer the grouping entities together, then apply the queued AI movement of every entity at once
+        self.groupSteering.apply(self.entities)
+        if self.entityStore:
+            self.entityStore.applyMovement()
+
+        # Loop through the entities and handle updates, damage and death, whatever their tier
         toRemove = []
         for e in range(len(self.entities)):
-            self.entities[e].aiHandler.runAITick(game)
             game.fireEvent('onEntityUpdate', self.entities[e])
             if self.entities[e].tickDamage:
+                self.recordCombat(self.entities[e])
                 # Trigger on Entity Damaged events
                 game.fireEvent('onEntityDamage', self.entities[e], self.entities[e].tickDamage)
             # If they die, delete them, and trigger events
@@ -120,7 +357,11 @@ class WorldMP:
                 self.entities[e].tickDamage = None
         # Remove the vehicles afterwards to prevent issues with list iteration
         for a in toRemove[::-1]:
-            self.entities.pop(a)
+            entity = self.entities.pop(a)
+            self.entityGrid.removeObject(entity.uuid)
+            self.aiScheduler.removeEntity(entity)
+            if self.entityStore:
+                self.entityStore.removeEntity(entity)
 
         # Loop through the vehicles and update them
         toRemove = []
@@ -135,12 +376,13 @@ class WorldMP:
                 game.fireEvent('onVehicleDestroyed', vehicleBackup)
         # Remove the vehicles afterwards to prevent issues with list iteration
         for a in toRemove[::-1]:
-            self.vehicles.pop(a)
+            self.vehicleGrid.removeObject(self.vehicles.pop(a).uuid)
 
         # Loop through the players and update them
         toRemove = []
         for p in range(len(self.players)):
             if self.players[p].tickDamage:
+                self.recordCombat(self.players[p])
                 # Trigger on Player Damaged events
                 game.fireEvent('onPlayerDamage', self.players[p], self.players[p].tickDamage)
             if self.players[p].isDead:
@@ -152,27 +394,48 @@ class WorldMP:
                 self.players[p].tickDamage = None
         # Remove the players afterwards to prevent issues with list iteration
         for a in toRemove[::-1]:
-            self.players.pop(a)
+            player = self.players.pop(a)
+            self.playerGrid.removeObject(player.name)
+            self.interest.removeSubscriber(player.name)
+
+    def getAIStats(self):
+        '''
+        Return the calls and total time of each AI task class, and the number of entities carried to the next tick (SERVER-SIDE)
+        '''
+        return self.aiScheduler.getStats(), self.aiScheduler.carried
+
+    def getSimulationTierCounts(self):
+        '''
+        Return the number of entities in each simulation tier, keyed by the tier's maximum distance (SERVER-SIDE)
+        '''
+        return self.scheduler.getTierCounts()
+
+    def recordCombat(self, obj):
+        '''
+        Remember who damaged an object, so the pair are updated at full rate for a while
+        '''
+        if obj.tickDamage.source:
+            self.prioritiser.recordCombat(getObjectKey(obj), obj.tickDamage.source)
 
     def getEntitiesNear(self, pos, distance):
         '''
         Return a list of entities within a given distance from a given position
         '''
-        return self.getObjectsNear(pos, distance, self.entities)
+        return self.getObjectsNear(pos, distance, self.entities, self.entityGrid)
 
     def getVehiclesNear(self, pos, distance):
         '''
         Return a list of vehicles within a given distance from a given position
         '''
-        return self.getObjectsNear(pos, distance, self.vehicles)
+        return self.getObjectsNear(pos, distance, self.vehicles, self.vehicleGrid)
 
     def getPlayersNear(self, pos, distance):
         '''
         Return a list of players within a given distance from a given position
         '''
-        return self.getObjectsNear(pos, distance, self.players)
+        return self.getObjectsNear(pos, distance, self.players, self.playerGrid)
 
-    def getObjectsNear(self, pos, distance, objects):
+    def getObjectsNear(self, pos, distance, objects, grid=None):
         '''
         Return a a subset of the given objects within a given distance from a given position
         '''
@@ -180,6 +443,10 @@ class WorldMP:
         if distance == 0:
             return objects
 
+        # Only search the nearby cells if the grids are being kept up to date
+        if grid and self.interestActive:
+            return grid.getObjectsNear(pos, distance)
+
         closeObjects = []
         for e in objects:
             x, y = [e.pos[0]-pos[0], e.pos[1]-pos[1]]
@@ -189,63 +456,83 @@ class WorldMP:
 
         return closeObjects
 
-    def getUpdateData(self, player):
+    def getSubscribers(self, pos):
         '''
-        Collate the update data into a bytes object
+        Return the usernames of the players which can see a given position
         '''
-        playerData = str([p.toBytes() for p in self.getPlayersNear(player.pos, 30)])
-        entityData = str([e.toBytes() for e in self.getEntitiesNear(player.pos, 30)])
-        vehicleData = str([v.toBytes() for v in self.getVehiclesNear(player.pos, 30)])
-        return '{}$$${}$$${}'.format(playerData, entityData, vehicleData).encode()
+        if self.interestActive:
+            return self.interest.getSubscribers(pos)
+        return set([p.name for p in self.getPlayersNear(pos, VIEW_RADIUS)])
+
+    def getUpdateData(self, player, relevanceFunctions=None):
+        '''
+        Collate the update data into a bytes object
+        Only the objects due an update which fit in the client's budget are included,
+        followed by the keys of the objects which the client should remove
+        '''
+        cells = self.interest.getSubscriptions(player.name)
+        if self.interestActive and cells is not None:
+            # Only send the objects in the cells the player is subscribed to, which are close enough to see
+            cellObjects = [grid.getObjectsInCells(cells) for grid in (self.playerGrid, self.entityGrid, self.vehicleGrid)]
+            players, entities, vehicles = [[a for a in objects if isWithinDistance(a.pos, player.pos, self.interest.viewRadius)]
+                                           for objects in cellObjects]
+        else:
+            players = self.getPlayersNear(player.pos, VIEW_RADIUS)
+            entities = self.getEntitiesNear(player.pos, VIEW_RADIUS)
+            vehicles = self.getVehiclesNear(player.pos, VIEW_RADIUS)
+
+        # Send every position relative to the player's chunk
+        chunk = getPositionChunk(player.pos)
+        objectLists = [('Player', players), ('Entity', entities), ('Vehicle', vehicles)]
+        records, removed = self.prioritiser.selectUpdates(player, objectLists, relevanceFunctions, chunk)
+
+        data = [UPDATE_HEADER.pack(chunk[0], chunk[1], *[len(r) for r in records], len(removed))]
+        for recordList in records:
+            data += [len(r).to_bytes(2, 'big') + r for r in recordList]
+        data += [packKey(key) for key in removed]
+        return b''.join(data)
 
     def handleUpdate(self, updateBytes, game):
         '''
         Use the binary data to update the world
         '''
-        # Split the data up for parsing separately
-        players, entities, vehicles = updateBytes.decode().split('$$$')
+        data = memoryview(updateBytes)
+        chunkX, chunkY, *counts = UPDATE_HEADER.unpack_from(data)
+        chunk = (chunkX, chunkY)
+        index = UPDATE_HEADER.size
+
+        # Split the records up for parsing separately
+        records = []
+        for count in counts[:3]:
+            recordList = []
+            for a in range(count):
+                length = int.from_bytes(data[index:index+2], 'big')
+                recordList.append(data[index+2:index+2+length])
+                index += 2+length
+            records.append(recordList)
+        removed = set()
+        for a in range(counts[3]):
+            key, index = unpackKey(data, index)
+            removed.add(key)
+
+        # Only remove the objects the server says are gone, as the rest may just not be due an update
+        self.players = [p for p in self.players if p.name not in removed]
+        self.entities = [e for e in self.entities if e.uuid not in removed]
+        self.vehicles = [v for v in self.vehicles if v.uuid not in removed]
 
         # Loop the transferred players
-        players = eval(players)
-        players = [Player.fromBytes(p) for p in players]
-
-        p = 0
-        while p < len(self.players):
-            toKeep = self.players[p] in players
-            if not toKeep:
-                self.players.pop(p)
-            p += int(toKeep)
-
-        for player in players:
-            game.fireEvent("onPlayerSync", player, self.players)
+        for record in records[0]:
+            game.fireEvent("onPlayerSync", Player.fromBytes(record, chunk), self.players)
 
         # Loop the transferred entities
-        entities = eval(entities)
-        entities = [Entity.fromBytes(e, game.modLoader.gameRegistry.entities) for e in entities]
-
-        e = 0
-        while e < len(self.entities):
-            toKeep = self.entities[e] in entities
-            if not toKeep:
-                self.entities.pop(e)
-            e += int(toKeep)
-
-        for entity in entities:
-            game.fireEvent('onEntitySync', entity, self.entities)
-
-        # Loop the transferred entities
-        vehicles = eval(vehicles)
-        vehicles = [Vehicle.fromBytes(v, game.modLoader.gameRegistry.vehicles) for v in vehicles]
-
-        v = 0
-        while v < len(self.vehicles):
-            toKeep = self.vehicles[v] in vehicles
-            if not toKeep:
-                self.vehicles.pop(v)
-            v += int(toKeep)
+        entityClasses = game.modLoader.gameRegistry.entities
+        for record in records[1]:
+            game.fireEvent('onEntitySync', Entity.fromBytes(record, entityClasses, chunk), self.entities)
 
-        for vehicle in vehicles:
-            game.fireEvent('onVehicleSync', vehicle, self.vehicles)
+        # Loop the transferred vehicles
+        vehicleClasses = game.modLoader.gameRegistry.vehicles
+        for record in records[2]:
+            game.fireEvent('onVehicleSync', Vehicle.fromBytes(record, vehicleClasses, chunk), self.vehicles)
 
     def addPlayer(self, game, player):
         '''
@@ -256,5 +543,7 @@ class WorldMP:
                 return p
         player.pos = [0, 0]
         self.players.append(player)
+        self.playerGrid.updateObject(player.name, player)
+        self.interest.updateSubscriber(player.name, player.pos)
         game.fireEvent('onPlayerCreated', player)
         return player
@@ -3,8 +3,112 @@ from api.ai import AIHandler, PickupAITask
 
 import util
 
+import math
+import struct
+from threading import Lock, Condition
+
+# The fraction of a tile that positions are rounded to when they are sent
+POSITION_QUANTUM = 1/1024
+# The distance the client's predicted position may be from the server's before it is corrected
+CORRECTION_THRESHOLD = 1/32
+
+# Positions in records are sent relative to the corner of a chunk shared by the whole update,
+# as 16-bit fixed point offsets with this many fractional bits
+POSITION_CHUNK_SIZE = 32
+POSITION_FRACTION_BITS = 8
+POSITION_OFFSET = struct.Struct('>hh')
+# An offset marking that the full position follows, for anything too far from the chunk
+POSITION_ESCAPE = -32768
+POSITION_ABSOLUTE = struct.Struct('>dd')
+
+# The record headers of each object, following the name
+PLAYER_RECORD = struct.Struct('>IIH')
+ENTITY_RECORD = struct.Struct('>IH')
+# The attributes written in an object's record, which make its cached records out of date when changed
+RECORD_ATTRIBUTES = frozenset(['name', 'uuid', 'pos', 'health', 'exp', 'dimension', 'tickDamage', 'riders'])
+
+def isNewerSequence(sequence, other):
+    '''
+    Return whether one sequence number comes after another, allowing for them wrapping around
+    '''
+    return 0 < (sequence-other)%2**32 < 2**31
+
+def getPositionChunk(pos):
+    '''
+    Return the chunk containing a position, which positions near it are sent relative to
+    '''
+    return (math.floor(pos[0]/POSITION_CHUNK_SIZE), math.floor(pos[1]/POSITION_CHUNK_SIZE))
+
+def packPos(pos, chunk=(0, 0)):
+    '''
+    Return the byte representation of a position, relative to the corner of a chunk
+    '''
+    scale = 1 << POSITION_FRACTION_BITS
+    offset = [round((pos[a]-chunk[a]*POSITION_CHUNK_SIZE)*scale) for a in (0, 1)]
+    if POSITION_ESCAPE < offset[0] <= 32767 and POSITION_ESCAPE < offset[1] <= 32767:
+        return POSITION_OFFSET.pack(*offset)
+    return POSITION_OFFSET.pack(POSITION_ESCAPE, 0) + POSITION_ABSOLUTE.pack(*pos)
+
+def unpackPos(data, index, chunk=(0, 0)):
+    '''
+    Read a position from its byte representation at an index in the data
+    Return the position and the index after it
+    '''
+    x, y = POSITION_OFFSET.unpack_from(data, index)
+    index += POSITION_OFFSET.size
+    if x == POSITION_ESCAPE:
+        return list(POSITION_ABSOLUTE.unpack_from(data, index)), index+POSITION_ABSOLUTE.size
+    scale = 1 << POSITION_FRACTION_BITS
+    return [chunk[0]*POSITION_CHUNK_SIZE + x/scale, chunk[1]*POSITION_CHUNK_SIZE + y/scale], index
+
+def packKey(key):
+    '''
+    Return the byte representation of an object key, which is a player's name or any other object's uuid
+    '''
+    if isinstance(key, int):
+        return b'u' + key.to_bytes(8, 'big')
+    key = key.encode()
+    return b'n' + len(key).to_bytes(1, 'big') + key
+
+def unpackKey(data, index):
+    '''
+    Read an object key at an index in the data
+    Return the key and the index after it
+    '''
+    if data[index] == ord('u'):
+        return int.from_bytes(data[index+1:index+9], 'big'), index+9
+    length = data[index+1]
+    return bytes(data[index+2:index+2+length]).decode(), index+2+length
+
+def packName(name):
+    '''
+    Return the byte representation of a short name
+    '''
+    name = name.encode()
+    return len(name).to_bytes(1, 'big') + name
+
+def unpackName(data, index):
+    '''
+    Read a short name at an index in the data
+    Return the name and the index after it
+    '''
+    length = data[index]
+    return bytes(data[index+1:index+1+length]).decode().strip(), index+1+length
+
+def unpackDamage(data, index):
+    '''
+    Read a damage record at an index in the data
+    Return the damage and the index after it
+    '''
+    sourceLength = data[index+4]
+    damage = Damage.fromBytes(data[index+3], bytes(data[index+5:index+5+sourceLength]), data[index:index+3])
+    return damage, index+5+sourceLength
+
 class EntityBase:
     def __init__(self):
+        # The encoded records of this object, by the chunk they are relative to
+        self.recordCache = {}
+
         self.name = ''
         self.uuid = 0
         self.health = 100
@@ -21,6 +125,29 @@ class EntityBase:
 
         self.ridingEntity = None
 
+    def __setattr__(self, name, value):
+        # Forget the cached records if something written in them changes
+        if name in RECORD_ATTRIBUTES and self.__dict__.get('recordCache') and getattr(self, name, None) != value:
+            self.__dict__['recordCache'] = {}
+        object.__setattr__(self, name, value)
+
+    def clearRecordCache(self):
+        '''
+        Forget the cached records, for changes made in place rather than by setting an attribute
+        '''
+        if self.recordCache:
+            self.recordCache = {}
+
+    def getRecord(self, chunk=(0, 0)):
+        '''
+        Return the byte representation of this object relative to a chunk,
+        only encoding it again if it has changed since it was last encoded
+        '''
+        record = self.recordCache.get(chunk)
+        if record is None:
+            record = self.recordCache[chunk] = self.toBytes(chunk)
+        return record
+
     def getPos(self):
         '''
         Get the position of the entity, rounded to 2 decimal places
@@ -69,12 +196,105 @@ class EntityBase:
 class Entity(EntityBase):
     '''
     A base class for new entities
+    While spawned in a server world with an EntityStore, the position, speed, health and dimension
+    are kept in the store's arrays, and these attributes read and write the store
     '''
     def __init__(self):
+        self.entityStore = None
+        self.storeSlot = None
         super().__init__()
         self.aiHandler = AIHandler()
         self.image = None
 
+    @property
+    def pos(self):
+        if self.entityStore is None:
+            return self._pos
+        return self.entityStore.pos[self.storeSlot].tolist()
+
+    @pos.setter
+    def pos(self, pos):
+        if self.entityStore is None:
+            self._pos = pos
+        else:
+            self.entityStore.pos[self.storeSlot] = pos
+
+    @property
+    def speed(self):
+        if self.entityStore is None:
+            return self._speed
+        return float(self.entityStore.speed[self.storeSlot])
+
+    @speed.setter
+    def speed(self, speed):
+        if self.entityStore is None:
+            self._speed = speed
+        else:
+            self.entityStore.speed[self.storeSlot] = speed
+
+    @property
+    def health(self):
+        if self.entityStore is None:
+            return self._health
+        return float(self.entityStore.health[self.storeSlot])
+
+    @health.setter
+    def health(self, health):
+        if self.entityStore is None:
+            self._health = health
+        else:
+            self.entityStore.health[self.storeSlot] = health
+
+    @property
+    def dimension(self):
+        if self.entityStore is None:
+            return self._dimension
+        return int(self.entityStore.dimension[self.storeSlot])
+
+    @dimension.setter
+    def dimension(self, dimension):
+        if self.entityStore is None:
+            self._dimension = dimension
+        else:
+            self.entityStore.dimension[self.storeSlot] = dimension
+
+    def wanderTo(self, target, timeLeft, deltaTime):
+        '''
+        Walk towards a target, to arrive in the given number of seconds
+        '''
+        if self.entityStore is not None:
+            self.entityStore.queueWander(self.storeSlot, target, timeLeft, deltaTime)
+            return
+        timeLeft = max(timeLeft, deltaTime)
+        velocity = [min((target[a]-self.pos[a])/timeLeft, self.speed) for a in (0, 1)]
+        self.pos = [self.pos[a]+velocity[a]*deltaTime for a in (0, 1)]
+
+    def pursue(self, target, deltaTime):
+        '''
+        Run in a straight line towards a target at full speed
+        '''
+        if self.entityStore is not None:
+            self.entityStore.queuePursuit(self.storeSlot, target, deltaTime)
+            return
+        distance = ((target[0] - self.pos[0])**2 + (target[1] - self.pos[1])**2)**0.5
+        try:
+            ratio = min(1, (self.speed*deltaTime)/distance)
+        except ZeroDivisionError:
+            ratio = 0
+        self.pos = [self.pos[a] * (1 - ratio) + ratio * target[a] for a in (0, 1)]
+
+    def steer(self, direction, deltaTime):
+        '''
+        Move at full speed in the direction of a (non-normalised) vector
+        '''
+        if self.entityStore is not None:
+            self.entityStore.queueSteer(self.storeSlot, direction, deltaTime)
+            return
+        mag = (direction[0]**2 + direction[1]**2)**0.5
+        if mag == 0:
+            return
+        self.pos = [self.pos[a] + direction[a]/mag * deltaTime * self.speed for a in (0, 1)]
+
     def __eq__(self, other):
         return isinstance(other, Entity) and self.uuid == other.uuid
 
@@ -101,48 +321,27 @@ class Entity(EntityBase):
     def setImage(self, image):
         self.image = image
 
-    def toBytes(self):
-        name = len(self.name).to_bytes(1, 'big') + self.name.encode()
-        uuid = self.uuid.to_bytes(8, 'big')
-        pos = str(self.getPos()).encode()
-        hp = max(0, int(self.health)).to_bytes(4, 'big')
-        dimension = self.dimension.to_bytes(2, 'big')
-
+    def toBytes(self, chunk=(0, 0)):
+        '''
+        Get a byte representation of the entity, with its position relative to the given chunk
+        '''
         damage = self.tickDamage.toBytes() if isinstance(self.tickDamage, Damage) else NullDamage().toBytes()
-
-        return name + uuid + pos + hp + dimension + damage + self.__class__.__name__.encode()
+        return (packName(self.name) + self.uuid.to_bytes(8, 'big') + packPos(self.pos, chunk) +
+                ENTITY_RECORD.pack(max(0, int(self.health)), self.dimension) + damage +
+                self.__class__.__name__.encode())
 
     @staticmethod
-    def fromBytes(data, entityClassList):
-        nameLength = data[0]
-        name = data[1:nameLength+1].decode().strip()
-        data = data[nameLength+1:]
-
-        uuid = int.from_bytes(data[:8], 'big')
-        data = data[8:]
-
-        # Walk the string to find the position value, because we can't just dump float data into the stream -_-
-        posBuf = ''
-        for character in data:
-            posBuf += chr(character)
-            if character == ord(']'):
-                break
-        # Eval it into an array
-        pos = eval(posBuf)
-        data = data[len(posBuf):]
-
-        health = int.from_bytes(data[:4], 'big')
-        dimension = int.from_bytes(data[4:6], 'big')
-        data = data[6:]
-
-        damAmount = data[:3]
-        damType = data[3]
-        damLength = data[4]
-        damSource = data[5:5+damLength]
-        data = data[5+damLength:]
-        damage = Damage.fromBytes(damType, damSource, damAmount)
-
-        entityClass = data.decode().strip()
+    def fromBytes(data, entityClassList, chunk=(0, 0)):
+        '''
+        Get an entity object from its byte representation
+        '''
+        name, index = unpackName(data, 0)
+        uuid = int.from_bytes(data[index:index+8], 'big')
+        pos, index = unpackPos(data, index+8, chunk)
+        health, dimension = ENTITY_RECORD.unpack_from(data, index)
+        damage, index = unpackDamage(data, index+ENTITY_RECORD.size)
+
+        entityClass = bytes(data[index:]).decode().strip()
 
         # Create the entity and fill in its information
         finalEntity = entityClassList.get(entityClass, Entity)()
@@ -167,6 +366,20 @@ class Player(EntityBase):
         # Boolean for synchronisation status on client
         # Timestamp for last synchronisation on server
         self.synced = False
+        # The sequence number of the last movement sent (CLIENT-SIDE) or received (SERVER-SIDE)
+        self.syncSequence = 0
+        # The velocity, and the distance that can be moved before the next update (SERVER-SIDE)
+        self.velocity = [0, 0]
+        self.moveAllowance = 0
+        # Held while applying moves, as movement packets can be handled on several threads at once (SERVER-SIDE)
+        self.moveLock = Lock()
+        # Notified when an inventory delta is applied, so later deltas handled early can wait their turn (SERVER-SIDE)
+        self.inventoryChanged = Condition()
+        # The moves not yet acknowledged by the server, and the position they lead to (CLIENT-SIDE)
+        self.pendingMoves = []
+        self.sentPos = None
+        # The sequence number of the last move the server acknowledged (CLIENT-SIDE)
+        self.lastAck = 0
 
     def __eq__(self, other):
         return isinstance(other, Player) and self.name == other.name
@@ -177,6 +390,45 @@ class Player(EntityBase):
         '''
         return True
 
+    def takeMove(self):
+        '''
+        Return the sequence number and displacement of the movement since the last move was taken,
+        and keep it until the server acknowledges it (CLIENT-SIDE)
+        The displacement is rounded as it is sent, so the server ends up at exactly the sent position
+        '''
+        if self.sentPos is None:
+            self.sentPos = list(self.pos)
+        displacement = [round((self.pos[a]-self.sentPos[a])/POSITION_QUANTUM)*POSITION_QUANTUM for a in (0, 1)]
+        self.sentPos = [self.sentPos[a]+displacement[a] for a in (0, 1)]
+
+        self.syncSequence = (self.syncSequence+1)%2**32
+        self.pendingMoves.append((self.syncSequence, displacement))
+        return self.syncSequence, displacement
+
+    def reconcileMoves(self, sequence, pos):
+        '''
+        Replay the moves the server hasn't processed yet on top of its position for the player,
+        and correct the player's position if it has strayed from that (CLIENT-SIDE)
+        An acknowledgement no newer than the last is ignored, as its position is out of date
+        '''
+        if self.sentPos is None or not isNewerSequence(sequence, self.lastAck):
+            return
+        self.lastAck = sequence
+        self.pendingMoves = [a for a in self.pendingMoves if isNewerSequence(a[0], sequence)]
+        predicted = [pos[a] + sum([move[1][a] for move in self.pendingMoves]) for a in (0, 1)]
+
+        if max([abs(predicted[a]-self.sentPos[a]) for a in (0, 1)]) > CORRECTION_THRESHOLD:
+            # Move by the correction, keeping any movement that hasn't been sent yet
+            self.pos = [self.pos[a]+predicted[a]-self.sentPos[a] for a in (0, 1)]
+            self.sentPos = predicted
+
+    def resetMoves(self):
+        '''
+        Forget the unacknowledged moves, as the server has set the player's position outright (CLIENT-SIDE)
+        '''
+        self.pendingMoves = []
+        self.sentPos = list(self.pos)
+
     def setInventory(self, inv):
         self.inventory = inv
 
@@ -203,50 +455,23 @@ class Player(EntityBase):
         '''
         self.name = name
 
-    def toBytes(self):
+    def toBytes(self, chunk=(0, 0)):
         '''
-        Get a string representation of the player object
+        Get a byte representation of the player object, with its position relative to the given chunk
         '''
-        name = len(self.name).to_bytes(1, 'big')+self.name.encode()
-        pos = str(self.getPos()).encode()
-        hp = max(0, int(self.health)).to_bytes(4, 'big')
-        exp = max(0, int(self.exp)).to_bytes(4, 'big')
-        dimension = self.dimension.to_bytes(2, 'big')
-
         damage = self.tickDamage.toBytes() if isinstance(self.tickDamage, Damage) else NullDamage().toBytes()
-
-        return name + pos + hp + exp + dimension + damage
+        return (packName(self.name) + packPos(self.pos, chunk) +
+                PLAYER_RECORD.pack(max(0, int(self.health)), max(0, int(self.exp)), self.dimension) + damage)
 
     @staticmethod
-    def fromBytes(data):
-        '''
-        Get a player object from a string representation
-        '''
-        nameLength = data[0]
-        name = data[1:nameLength+1].decode().strip()
-        data = data[1+nameLength:]
-
-        # Walk the string to find the position value, because we can't just dump float data into the stream -_-
-        posBuf = ''
-        for character in data:
-            posBuf += chr(character)
-            if character == ord(']'):
-                break
-        # Eval it into an array
-        pos = eval(posBuf)
-        data = data[len(posBuf):]
-
-        health = int.from_bytes(data[:4], 'big')
-        exp = int.from_bytes(data[4:8], 'big')
-        dimension = int.from_bytes(data[8:10], 'big')
-        data = data[6:]
-
-        damAmount = data[:3]
-        damType = data[3]
-        damLength = data[4]
-        damSource = data[5:5+damLength]
-        data = data[5+damLength:]
-        damage = Damage.fromBytes(damType, damSource, damAmount)
+    def fromBytes(data, chunk=(0, 0)):
+        '''
+        Get a player object from its byte representation
+        '''
+        name, index = unpackName(data, 0)
+        pos, index = unpackPos(data, index, chunk)
+        health, exp, dimension = PLAYER_RECORD.unpack_from(data, index)
+        damage, index = unpackDamage(data, index+PLAYER_RECORD.size)
 
         # Restore all the sent values into a new player object
         p = Player()
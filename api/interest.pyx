@@ -0,0 +1,194 @@
+'''
+interest.py
+A module for tracking which parts of a world each player is interested in.
+'''
+# Import the Python standard libraries
+import math
+
+# The side length of a grid cell, in tiles
+CELL_SIZE = 16
+# The distance a player can see, in tiles
+VIEW_RADIUS = 30
+
+def isWithinDistance(pos1, pos2, distance):
+    '''
+    Return whether two positions are no further apart than a given distance
+    '''
+    return math.hypot(pos1[0]-pos2[0], pos1[1]-pos2[1]) <= distance
+
+class SpatialGrid:
+    def __init__(self, cellSize=CELL_SIZE):
+        self.cellSize = cellSize
+
+        # Map cells to the objects inside them, and objects back to their cells
+        self.cells = {}
+        self.objectCells = {}
+
+    def getCell(self, pos):
+        '''
+        Return the grid cell containing a given position
+        '''
+        return (math.floor(pos[0]/self.cellSize), math.floor(pos[1]/self.cellSize))
+
+    def getCellsAround(self, cell, cellRadius):
+        '''
+        Return the square of cells within a number of cells of a given cell
+        '''
+        x, y = cell
+        return [(x+a, y+b) for a in range(-cellRadius, cellRadius+1) for b in range(-cellRadius, cellRadius+1)]
+
+    def getCellsInRange(self, pos, distance):
+        '''
+        Return all cells which overlap the square surrounding a given distance from a position
+        '''
+        minX, minY = self.getCell([pos[0]-distance, pos[1]-distance])
+        maxX, maxY = self.getCell([pos[0]+distance, pos[1]+distance])
+        return [(x, y) for x in range(minX, maxX+1) for y in range(minY, maxY+1)]
+
+    def updateObject(self, key, obj):
+        '''
+        Add an object to the grid, or move it to its current cell
+        '''
+        cell = self.getCell(obj.pos)
+        oldCell = self.objectCells.get(key)
+
+        if oldCell != cell:
+            # Remove the object from its previous cell
+            if oldCell is not None:
+                self.removeObject(key)
+            self.objectCells[key] = cell
+
+        # Always store the object, in case the instance has been replaced
+        self.cells.setdefault(cell, {})[key] = obj
+
+    def removeObject(self, key):
+        '''
+        Remove an object from the grid
+        '''
+        cell = self.objectCells.pop(key, None)
+        if cell is None:
+            return
+
+        objects = self.cells.get(cell, {})
+        objects.pop(key, None)
+        # Delete empty cells to keep the grid small
+        if not objects:
+            self.cells.pop(cell, None)
+
+    def sync(self, objects, keyAttribute):
+        '''
+        Bring the grid up to date with a list of objects, keyed by the given attribute
+        Only objects which have changed cells are moved
+        '''
+        present = set()
+        for obj in objects:
+            key = getattr(obj, keyAttribute)
+            present.add(key)
+            self.updateObject(key, obj)
+
+        # Drop any objects that are no longer in the list
+        for key in list(self.objectCells):
+            if key not in present:
+                self.removeObject(key)
+
+    def getObjectsInCells(self, cells):
+        '''
+        Return a list of every object inside the given cells
+        '''
+        objects = []
+        for cell in cells:
+            objects += list(self.cells.get(cell, {}).values())
+        return objects
+
+    def getObjectsNear(self, pos, distance):
+        '''
+        Return a list of objects within a given distance from a given position
+        '''
+        # Search one cell further, as objects may have moved since the last sync
+        cells = self.getCellsInRange(pos, distance+self.cellSize)
+
+        closeObjects = []
+        for e in self.getObjectsInCells(cells):
+            x, y = [e.pos[0]-pos[0], e.pos[1]-pos[1]]
+            if (x**2 + y**2)**0.5 <= distance:
+                closeObjects.append(e)
+
+        return closeObjects
+
+class InterestManager:
+    def __init__(self, grid, viewRadius=VIEW_RADIUS):
+        self.grid = grid
+        self.viewRadius = viewRadius
+        # The number of cells needed in each direction to cover the view radius
+        # These cover a larger square than the view, so anything sent is filtered by its true distance
+        self.cellRadius = math.ceil(viewRadius/grid.cellSize)
+
+        # Map usernames to their subscribed cells, and cells to their subscribed usernames
+        self.subscriptions = {}
+        self.subscribers = {}
+        self.centreCells = {}
+        # The position of each subscriber at the last update
+        self.positions = {}
+
+    def updateSubscriber(self, username, pos):
+        '''
+        Subscribe a player to the cells around them
+        Subscriptions only change when the player moves into a new cell
+        '''
+        self.positions[username] = pos
+        cell = self.grid.getCell(pos)
+        if self.centreCells.get(username) == cell:
+            return
+        self.centreCells[username] = cell
+
+        oldCells = self.subscriptions.get(username, set())
+        newCells = set(self.grid.getCellsAround(cell, self.cellRadius))
+
+        # Unsubscribe from the cells that are now out of view
+        for c in oldCells - newCells:
+            self.subscribers[c].discard(username)
+            if not self.subscribers[c]:
+                del self.subscribers[c]
+
+        # Subscribe to the cells that have come into view
+        for c in newCells - oldCells:
+            self.subscribers.setdefault(c, set()).add(username)
+
+        self.subscriptions[username] = newCells
+
+    def removeSubscriber(self, username):
+        '''
+        Remove all of a player's subscriptions
+        '''
+        for c in self.subscriptions.pop(username, set()):
+            self.subscribers[c].discard(username)
+            if not self.subscribers[c]:
+                del self.subscribers[c]
+        self.centreCells.pop(username, None)
+        self.positions.pop(username, None)
+
+    def sync(self, players):
+        '''
+        Update the subscriptions of every player in a list, and drop any that have left
+        '''
+        present = set()
+        for player in players:
+            present.add(player.name)
+            self.updateSubscriber(player.name, player.pos)
+
+        for username in list(self.subscriptions):
+            if username not in present:
+                self.removeSubscriber(username)
+
+    def getSubscriptions(self, username):
+        '''
+        Return the set of cells a player is subscribed to, or None if they aren't tracked
+        '''
+        return self.subscriptions.get(username)
+
+    def getSubscribers(self, pos):
+        '''
+        Return the set of usernames which can see a given position
+        '''
+        subscribers = self.subscribers.get(self.grid.getCell(pos), ())
+        return set([a for a in subscribers if isWithinDistance(self.positions[a], pos, self.viewRadius)])
@@ -3,33 +3,326 @@ item.pyx
 A module to hold all the api stuff related to items
 '''
 import random
-from copy import deepcopy
+import struct
+import hashlib
 
 from api import combat
 
+# The inventory groups which hold a list of itemstacks, rather than a single one
+SECTIONS = ('hotbar', 'main')
+# The equipped stacks, in the order their slots are numbered after the main section
+EQUIPPED = ('left', 'right', 'armour')
+
+# The encoded inventory size and number of distinct items, then the slot number, item and count of each occupied slot
+INVENTORY_HEADER = struct.Struct('>HH')
+INVENTORY_SLOT = struct.Struct('>HHI')
+# Encoded slot numbers hold the group (main, equipped or hotbar) in the top bits and the index in the rest
+SLOT_GROUP_SHIFT = 14
+SLOT_INDEX_MASK = (1 << SLOT_GROUP_SHIFT)-1
+
+def getCountHash(name, count):
+    '''
+    Return a stable 64-bit hash of an item name and the total count of it in an inventory
+    '''
+    return int.from_bytes(hashlib.blake2b('{}|{}'.format(name, count).encode(), digest_size=8).digest(), 'big')
+
+class InventoryContents:
+    '''
+    The total count of each item in an inventory, and an order-independent digest of those totals
+    Itemstacks are never changed once made, so the totals only change when stacks are placed or removed
+    '''
+    def __init__(self, counts=None):
+        self.counts = {}
+        self.digest = 0
+        for name, count in (counts or {}).items():
+            self.addCount(name, count)
+
+    def addCount(self, name, count):
+        '''
+        Change the total count of an item, and update the digest to match
+        '''
+        if not count or name == 'null_item':
+            return
+        oldCount = self.counts.get(name, 0)
+        newCount = oldCount + count
+        # Swap the hash of the old total for the hash of the new one
+        if oldCount:
+            self.digest -= getCountHash(name, oldCount)
+        if newCount:
+            self.digest += getCountHash(name, newCount)
+            self.counts[name] = newCount
+        else:
+            del self.counts[name]
+        self.digest &= 0xffffffffffffffff
+
+    def addStack(self, stack):
+        '''
+        Count an itemstack placed in the inventory
+        '''
+        if isinstance(stack, ItemStack):
+            self.addCount(stack.getRegistryName(), stack.stackSize)
+
+    def removeStack(self, stack):
+        '''
+        Stop counting an itemstack taken out of the inventory
+        '''
+        if isinstance(stack, ItemStack):
+            self.addCount(stack.getRegistryName(), -stack.stackSize)
+
+    def addStacks(self, stacks, sign=1):
+        '''
+        Count (or with a sign of -1, stop counting) many itemstacks at once
+        The stacks are totalled first, so the digest is only updated once per item
+        '''
+        totals = {}
+        for stack in stacks:
+            if isinstance(stack, ItemStack):
+                name = stack.item.name
+                totals[name] = totals.get(name, 0) + stack.stackSize
+        for name, count in totals.items():
+            self.addCount(name, sign*count)
+
+    def copy(self):
+        '''
+        Return a copy of these contents, without recalculating the digest
+        '''
+        contents = InventoryContents()
+        contents.counts = dict(self.counts)
+        contents.digest = self.digest
+        return contents
+
+class InventorySection(list):
+    '''
+    A list of itemstacks which keeps the contents of its inventory up to date as it is changed
+    A section may be shared by several inventories, until one of them takes it to be changed
+    '''
+    def __init__(self, contents, stacks=(), counted=False):
+        super().__init__(stacks)
+        self.contents = contents
+        # The number of inventories holding this section
+        self.holders = 1
+        if not counted:
+            contents.addStacks(self)
+
+    def __reduce__(self):
+        # Copy as a plain list, as the copy belongs to no inventory until it is placed in one
+        return (list, (list(self),))
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            value = list(value)
+            self.contents.addStacks(super().__getitem__(index), -1)
+            self.contents.addStacks(value)
+        else:
+            self.contents.removeStack(super().__getitem__(index))
+            self.contents.addStack(value)
+        super().__setitem__(index, value)
+
+    def __delitem__(self, index):
+        stacks = super().__getitem__(index)
+        self.contents.addStacks(stacks if isinstance(index, slice) else [stacks], -1)
+        super().__delitem__(index)
+
+    def __iadd__(self, stacks):
+        self.extend(stacks)
+        return self
+
+    def __imul__(self, times):
+        stacks = list(self)*max(times, 0)
+        self.clear()
+        self.extend(stacks)
+        return self
+
+    def append(self, stack):
+        self.contents.addStack(stack)
+        super().append(stack)
+
+    def extend(self, stacks):
+        stacks = list(stacks)
+        self.contents.addStacks(stacks)
+        super().extend(stacks)
+
+    def insert(self, index, stack):
+        self.contents.addStack(stack)
+        super().insert(index, stack)
+
+    def pop(self, index=-1):
+        stack = super().pop(index)
+        self.contents.removeStack(stack)
+        return stack
+
+    def remove(self, stack):
+        super().remove(stack)
+        self.contents.removeStack(stack)
+
+    def clear(self):
+        self.contents.addStacks(self, -1)
+        super().clear()
+
+class InventoryItems(dict):
+    '''
+    The groups of itemstacks in an inventory, which keeps the contents up to date as groups are replaced
+    '''
+    def __init__(self, items=None):
+        super().__init__()
+        self.contents = InventoryContents()
+        # The sections which are shared with another inventory, and must be copied before they are changed
+        self.shared = set()
+        for key, value in (items or {}).items():
+            self[key] = value
+
+    def __reduce__(self):
+        return (InventoryItems, (), None, None, iter(self.items()))
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        if key in self.shared:
+            # Take the section for this inventory alone, as it may be changed
+            self.shared.discard(key)
+            if value.holders > 1:
+                value.holders -= 1
+                value = InventorySection(self.contents, value, counted=True)
+                super().__setitem__(key, value)
+            else:
+                value.contents = self.contents
+        return value
+
+    def peek(self, key):
+        '''
+        Return a group without taking a shared section, for reading only
+        '''
+        return super().__getitem__(key)
+
+    def share(self):
+        '''
+        Return a copy of these groups which shares every section, so a section is only copied if it is changed
+        '''
+        items = InventoryItems()
+        items.contents = self.contents.copy()
+        for key, value in self.items():
+            if isinstance(value, InventorySection):
+                value.holders += 1
+                self.shared.add(key)
+                items.shared.add(key)
+            dict.__setitem__(items, key, value)
+        return items
+
+    def __setitem__(self, key, value):
+        oldValue = self.get(key)
+        # A section changed in place (such as by +=) is already counted
+        if value is oldValue and isinstance(value, InventorySection):
+            return
+
+        if key in self.shared:
+            # Let go of the shared section, leaving it to the other inventories holding it
+            self.shared.discard(key)
+            oldValue.holders -= 1
+            self.contents.addStacks(oldValue, -1)
+        elif isinstance(oldValue, InventorySection):
+            # Detach the old section, so changes to it no longer count towards this inventory
+            self.contents.addStacks(oldValue, -1)
+            oldValue.contents = InventoryContents()
+            oldValue.contents.addStacks(oldValue)
+        else:
+            self.contents.removeStack(oldValue)
+
+        if key in SECTIONS:
+            value = InventorySection(self.contents, value)
+        else:
+            self.contents.addStack(value)
+        super().__setitem__(key, value)
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
 class Inventory:
     def __init__(self):
         #Hotbar might be used in the future, but for now is useless
         self.items = {'left' : ItemStack(NullItem(), 0), 'right' : ItemStack(NullItem(), 0),
                       'armour' : ItemStack(NullItem(), 0), 'hotbar' : [], 'main' : []}
         self.maxSize = 999
+        # The number of changes made to the inventory, used to keep the client and server copies in step
+        self.version = 0
+
+    @property
+    def items(self):
+        return self._items
+
+    @items.setter
+    def items(self, items):
+        # Keep the groups in a dictionary which tracks the inventory contents
+        self._items = items if isinstance(items, InventoryItems) else InventoryItems(items)
 
     def getEquipped(self):
         return [self.items['left'], self.items['right'], self.items['armour']]
 
     def getItem(self, index):
         try:
-            return self.items['main'][index]
+            return self.items.peek('main')[index]
         except IndexError:
             return ItemStack(NullItem(), 0)
 
+    def getSlot(self, slot):
+        '''
+        Return the itemstack in a numbered slot
+        The slots of the main section are numbered first, followed by the equipped stacks
+        '''
+        if slot < self.maxSize:
+            return self.getItem(slot)
+        return self.items[EQUIPPED[slot-self.maxSize]]
+
+    def setSlot(self, slot, stack):
+        '''
+        Place an itemstack in a numbered slot
+        '''
+        if slot < self.maxSize:
+            main = self.items['main']
+            # Fill in any empty slots before it
+            if slot >= len(main):
+                main += [ItemStack(NullItem(), 0) for a in range(slot+1-len(main))]
+            main[slot] = stack
+        else:
+            self.items[EQUIPPED[slot-self.maxSize]] = stack
+
+    def applyDelta(self, changes):
+        '''
+        Apply a list of (slot, itemstack) changes if they only move items between slots,
+        without adding, removing or altering any item, or overfilling a stack
+        Return whether the changes were applied
+        '''
+        changes = dict(changes)
+        counts = {}
+        for slot, stack in changes.items():
+            if not 0 <= slot < self.maxSize+len(EQUIPPED):
+                return False
+            if stack.getRegistryName() != 'null_item' and stack.stackSize > stack.getMaxStackSize():
+                return False
+            # Only armour may be worn
+            if slot == self.maxSize+EQUIPPED.index('armour') and stack.getRegistryName() != 'null_item' and not isinstance(stack.getItem(), Armour):
+                return False
+
+            # Total up the items taken out and put in, keyed by their full description so weapon stats can't be changed
+            for sign, change in ((-1, self.getSlot(slot)), (1, stack)):
+                if change.getRegistryName() != 'null_item' and change.stackSize:
+                    key = change.getItem().toBytes()
+                    counts[key] = counts.get(key, 0) + sign*change.stackSize
+
+        if any(counts.values()):
+            return False
+
+        for slot, stack in changes.items():
+            self.setSlot(slot, stack)
+        self.version += 1
+        return True
+
     def toList(self):
         '''
         Return a list of every distinct itemstack in the inventory
         '''
         stacks = []
-        stacks += self.items['main']
-        stacks += self.items['hotbar']
+        stacks += self.items.peek('main')
+        stacks += self.items.peek('hotbar')
         stacks.append(self.items['left'])
         stacks.append(self.items['right'])
         stacks.append(self.items['armour'])
@@ -37,88 +330,85 @@ class Inventory:
         return stacks
 
     @staticmethod
-    def fromBytes(game, bytes):
+    def fromBytes(game, data):
         '''
         Convert a transmitted byte string to an inventory object
         '''
-        # Pull the inventory size of the top of the packet
-        invSize = int.from_bytes(bytes[:2], 'big')
-        bytes = bytes[2:]
-
-        # Walk the bytestring and get the items
-        armourLen = int.from_bytes(bytes[:2], 'big')
-        armour = ItemStack.fromBytes(game, bytes[:armourLen+4])
-        bytes = bytes[armourLen+4:]
-
-        leftLen = int.from_bytes(bytes[:2], 'big')
-        left = ItemStack.fromBytes(game, bytes[:leftLen+4])
-        bytes = bytes[leftLen+4:]
-
-        rightLen = int.from_bytes(bytes[:2], 'big')
-        right = ItemStack.fromBytes(game, bytes[:rightLen+4])
-        bytes = bytes[rightLen+4:]
-
-        hotbar = []
-        for a in range(10):
-            itemLen = int.from_bytes(bytes[:2], 'big')
-            hotbar.append(ItemStack.fromBytes(game, bytes[:itemLen+4]))
-            bytes = bytes[itemLen+4:]
-
-        main = []
-        for a in range(invSize):
-            itemLen = int.from_bytes(bytes[:2], 'big')
-            main.append(ItemStack.fromBytes(game, bytes[:itemLen+4]))
-            bytes = bytes[itemLen+4:]
+        data = memoryview(data)
+        invSize, typeCount = INVENTORY_HEADER.unpack_from(data)
+        offset = INVENTORY_HEADER.size
+
+        # Decode each distinct item once
+        gameRegistry = game.modLoader.gameRegistry
+        itemTypes = []
+        for a in range(typeCount):
+            itemLen = int.from_bytes(data[offset:offset+2], 'big')
+            itemTypes.append(Item.fromBytes(gameRegistry, data[offset+2:offset+2+itemLen]))
+            offset += 2+itemLen
+
+        # Start with every slot empty, sharing a single empty stack, as itemstacks are never changed once made
+        empty = ItemStack(NullItem(), 0)
+        groups = [[empty]*invSize, [empty]*len(EQUIPPED), [empty]*10]
+
+        # Then fill in the occupied slots, growing a group if it holds more stacks than usual
+        slotCount = int.from_bytes(data[offset:offset+2], 'big')
+        offset += 2
+        for slot, itemType, count in INVENTORY_SLOT.iter_unpack(data[offset:offset+slotCount*INVENTORY_SLOT.size]):
+            group = groups[slot >> SLOT_GROUP_SHIFT]
+            index = slot & SLOT_INDEX_MASK
+            if index >= len(group):
+                group += [empty]*(index+1-len(group))
+            group[index] = ItemStack(itemTypes[itemType], count)
 
         # Instantiate the inventory
         i = Inventory()
         # Set the values of the inventory
         i.maxSize = invSize
-        i.items['armour'] = armour
-        i.items['left'] = left
-        i.items['right'] = right
-        i.items['hotbar'] = hotbar
-        i.items['main'] = main
+        for e, name in enumerate(EQUIPPED):
+            i.items[name] = groups[1][e]
+        i.items['hotbar'] = groups[2]
+        i.items['main'] = groups[0]
 
         return i
 
     def toBytes(self):
         '''
         Convert the inventory to a byte string for transmission
-        '''
-        # Convert the equipped stacks
-        armour, left, right = [self.items[a].toBytes() for a in ('armour', 'left', 'right')]
-
-        # Then convert the hotbar and main sections
-        hotbar = self.items['hotbar']
-        hotbar += [ItemStack(NullItem(), 0)]*(10-len(hotbar))
-        main = self.items['main']
-        main += [ItemStack(NullItem(), 0)]*(self.maxSize-len(main))
-
-        hotbar = b''.join([a.toBytes() for a in hotbar])
-        main = b''.join([a.toBytes() for a in main])
-
-        # Write it all out to a byte string
-        return self.maxSize.to_bytes(2, 'big') + armour + left + right + hotbar + main
+        Only the occupied slots are written, referring to a table of the distinct items in the inventory
+        '''
+        groups = [self.items.peek('main'), [self.items[a] for a in EQUIPPED], self.items.peek('hotbar')]
+        itemTypes = {}
+        slots = []
+        for g, group in enumerate(groups):
+            for index, stack in enumerate(group):
+                if not stack.stackSize or stack.item.name == 'null_item':
+                    continue
+                # Number the slot by its group and its index within the group
+                itemType = itemTypes.setdefault(stack.item.toBytes(), len(itemTypes))
+                slots.append(INVENTORY_SLOT.pack(g << SLOT_GROUP_SHIFT | index, itemType, stack.stackSize))
+
+        table = b''.join([len(a).to_bytes(2, 'big') + a for a in itemTypes])
+        return (INVENTORY_HEADER.pack(self.maxSize, len(itemTypes)) + table +
+                len(slots).to_bytes(2, 'big') + b''.join(slots))
 
     def hashInv(self):
         '''
-        Generate a hash of the contents of this inventory.
+        Return a hash of the contents of this inventory.
         Works regardless of the order and split of itemstacks
         '''
-        # Duplicate the inventory
-        newInv = self.duplicate()
+        return hash((self.items.contents.digest, self.maxSize))
 
-        # Compress everything into a single list and sort
-        newInv.items['main'] = newInv.toList()
-        newInv.sortGroup('main', compress=True)
-
-        # Separate the list
-        itemlist = newInv.items['main']
-        itemlist = ['{}|{}'.format(a.getRegistryName(), a.stackSize) for a in itemlist]
-
-        # Hash the list
-        return hash(str(itemlist) + str(self.maxSize))
+    @staticmethod
+    def hashInventories(*inventories):
+        '''
+        Return a hash of the combined contents of some inventories
+        Works regardless of which inventory holds each item
+        '''
+        counts = {}
+        for inventory in inventories:
+            for name, count in inventory.items.contents.counts.items():
+                counts[name] = counts.get(name, 0) + count
+        return InventoryContents(counts).digest
 
     def duplicate(self):
         '''
@@ -127,12 +417,9 @@ class Inventory:
         # Initialise the empty inventory
         newInv = Inventory()
 
-        # Copy the each group into a new inventory
-        newInv.items['main'] = deepcopy(self.items['main'])
-        newInv.items['hotbar'] = deepcopy(self.items['hotbar'])
-        newInv.items['left'] = deepcopy(self.items['left'])
-        newInv.items['right'] = deepcopy(self.items['right'])
-        newInv.items['armour'] = deepcopy(self.items['armour'])
+        # Share each group with the new inventory, as itemstacks are never changed once made,
+        # and a section is only copied once either inventory changes it
+        newInv.items = self.items.share()
 
         return newInv
 
@@ -147,29 +434,31 @@ class Inventory:
     def sortGroup(self, name, compress=False):
         '''
         Collect and sort the given group in the inventory
-        '''
-        # VVV This is essentially a dodgy version of insertion sort :) VVV
+        The stacks of each item are totalled, then split into as few full stacks as possible, sorted by item name
+        '''
+        # Total up each distinct item, keeping weapons with different stats apart
+        totals = {}
+        items = {}
+        for stack in self.items.peek(name):
+            if stack.stackSize and stack.item.name != 'null_item':
+                key = (stack.item.name, stack.item.toBytes())
+                totals[key] = totals.get(key, 0) + stack.stackSize
+                if key not in items:
+                    items[key] = stack.item
+
+        # Split the totals back into stacks, in order of item name (and of first appearance for the same name)
         newGroup = []
-        # Iterate each item, find duplicate stacks and add them together
-        for i, itemstack in enumerate(self.items[name]):
-            # Iterate the newGroup and try to add the stack to it
-            for j, newStack in enumerate(newGroup):
-                # If they are the same item type
-                if newStack == itemstack:
-                    result, carry = itemstack.add(newStack, compress)
-                    newGroup[j] = result
-                    # Reduce the itemstack and keep trying to fit it in
-                    itemstack = carry
-                    # If the whole itemstack has been distributed into the new group, move on
-                    if not carry:
-                        break
-
-            # If the stack could not be merged into existing stacks, make a new stack with the remainder
-            if itemstack:
-                newGroup.append(itemstack)
-
-        # Sort by item name
-        self.items[name] = sorted([a for a in newGroup if a])
+        for key in sorted(totals, key=lambda a: a[0]):
+            total = totals[key]
+            stackSize = total if compress else items[key].getMaxStackSize()
+            if stackSize <= 0:
+                stackSize = total
+            # Itemstacks are never changed once made, so the full stacks can share one object
+            newGroup += [ItemStack(items[key], stackSize)]*(total//stackSize)
+            if total%stackSize:
+                newGroup.append(ItemStack(items[key], total%stackSize))
+
+        self.items[name] = newGroup
 
     def checkWeapon(self, weapon):
         '''
@@ -181,8 +470,10 @@ class Inventory:
         '''
         Add an itemstack to the main section of the inventory
         '''
+        self.version += 1
         if len(self.items['main']) < self.maxSize:
             self.items['main'].append(itemstack)
+            return
 
         else:
             for i, stack in enumerate(self.items['main']):
@@ -213,8 +504,8 @@ class Inventory:
         # Fill the first inventory's main section
         # with all of the second inventory's contents
         sumInv.items = inv1.items
-        sumInv.items['main'] += inv2.items['hotbar']
-        sumInv.items['main'] += inv2.items['main']
+        sumInv.items['main'] += inv2.items.peek('hotbar')
+        sumInv.items['main'] += inv2.items.peek('main')
         sumInv.items['main'] += [inv2.items['left'], inv2.items['right'], inv2.items['armour']]
 
         # Sort and stack the itemstacks
@@ -248,17 +539,15 @@ class ItemStack:
     def __lt__(self, other):
         if other is None:
             return True
-        return self.getRegistryName() < other.getRegistryName()
+        return self.item.name < other.item.name
 
     def __gt__(self, other):
         if other is None:
             return False
-        return self.getRegistryName() > other.getRegistryName()
+        return self.item.name > other.item.name
 
     def __eq__(self, other):
-        if not isinstance(other, ItemStack):
-            return False
-        return self.getRegistryName() == other.getRegistryName()
+        return isinstance(other, ItemStack) and self.item.name == other.item.name
 
     def __str__(self):
         return 'ItemStack(item="{}", stackSize="{}")'.format(self.getRegistryName(), self.stackSize)
@@ -302,9 +591,7 @@ class ItemStack:
         bytes = bytes[4:]
 
         # Get the item from the data
-        items = game.modLoader.gameRegistry.items.values()
-        resources = game.modLoader.gameRegistry.resources
-        stack.item = Item.fromBytes(items, resources, bytes)
+        stack.item = Item.fromBytes(game.modLoader.gameRegistry, bytes)
 
         return stack
 
@@ -353,6 +640,11 @@ class ItemStack:
         return [result, carryover]
 
 class Item:
+    # The id the item is sent as, given when the item is registered. Id 0 is an empty slot
+    itemId = 0
+    # Whether every instance of the item is the same, so one instance can be shared by every stack
+    stateless = False
+
     def __init__(self):
         self.name = ''
         self.image = None
@@ -394,42 +686,18 @@ class Item:
         '''
         Get a byte representation of the item
         '''
-        className = self.__class__.__name__
-        className = len(className).to_bytes(1, 'big')+className.encode()
-        image = self.image if isinstance(self.image, str) else ''
-        image = len(image).to_bytes(1, 'big')+image.encode()
-        itemName = len(self.name).to_bytes(1, 'big')+self.name.encode()
-        return itemName + image + className
-
-    def fromBytes(itemClasses, resources, data):
-        # Get the item name
-        itemNameLen = data[0]
-        itemName = data[1:1+itemNameLen].decode()
-        data = data[1+itemNameLen:]
-
-        # Get the item image
-        imageLen = data[0]
-        image = data[1:imageLen+1].decode()
-        data = data[1+imageLen:]
-
-        classLen = data[0]
-        className = data[1:1+classLen].decode()
-        data = data[1+classLen:]
-        if data:
-            # This is a weapon, decode accordingly
-            itemTuple = (itemName, image, className)
-            return Weapon.fromBytes(itemClasses, resources, data, itemTuple)
-
-        # Iterate the possible classes and look for the matching item class
-        for itemClass in itemClasses:
-            if itemClass.__name__ == className:
-                # Fill in the values for the item, then return it
-                item = itemClass()
-                item.name = itemName
-                item.image = image
-                return item
-
-        return NullItem()
+        return self.itemId.to_bytes(2, 'big')
+
+    @staticmethod
+    def fromBytes(gameRegistry, data):
+        '''
+        Get an item from its byte representation
+        '''
+        item = gameRegistry.getItem(int.from_bytes(data[:2], 'big'))
+        if len(data) > 2 and isinstance(item, Weapon):
+            # This is a weapon, decode its stats too
+            Weapon.readStats(item, data[2:])
+        return item
 
 class Weapon(Item):
     def __init__(self):
@@ -467,28 +735,14 @@ class Weapon(Item):
         itemData += self.knockback.to_bytes(2, 'big')
         return itemData
 
-    def fromBytes(itemClasses, resources, data, itemTuple):
-        itemName, image, className = itemTuple
-
-        attack = int.from_bytes(data[:3], 'big')
-        attackRange = int.from_bytes(data[3:7], 'big')
-        damageClass = data[7]
-        knockback = int.from_bytes(data[8:], 'big')
-
-        # Iterate the possible classes and look for the matching item class
-        for itemClass in itemClasses:
-            if itemClass.__name__ == className:
-                # Fill in the values for the item, then return it
-                item = itemClass()
-                item.name = itemName
-                item.image = image
-                item.attack = attack
-                item.range = attackRange
-                item.damageClass = damageClass
-                item.knockback = knockback
-                return item
-
-        return NullItem()
+    def readStats(self, data):
+        '''
+        Fill in the weapon stats from their byte representation
+        '''
+        self.attack = int.from_bytes(data[:3], 'big')
+        self.range = int.from_bytes(data[3:7], 'big')
+        self.damageClass = data[7]
+        self.knockback = int.from_bytes(data[8:10], 'big')
 
     def calcDamage(self, game, source, entityList):
         '''
@@ -518,6 +772,8 @@ class NullItem(Item):
     '''
     A special item class used for empty itemslots
     '''
+    stateless = True
+
     def __init__(self):
         self.setRegistryName('null_item')
         self.image = None
@@ -0,0 +1,64 @@
+'''
+lod.py
+A module for simulating entities in less detail the further they are from any player.
+'''
+# Import the game's modules
+import util
+
+# The tier of entities too far from any player to simulate at all
+DORMANT = -1
+
+class SimulationScheduler:
+    def __init__(self, tiers=util.SIMULATION_TIERS):
+        # Each tier is (maximum distance to the nearest player, ticks between AI updates)
+        self.tiers = sorted(tiers)
+        self.cellTiers = {}
+        self.tierCounts = {}
+
+    def update(self, grid, players):
+        '''
+        Work out the tier of every occupied cell in a spatial grid, from the distance to the nearest player
+        '''
+        self.cellTiers = {}
+        self.tierCounts = {tier : 0 for tier in range(len(self.tiers))}
+        self.tierCounts[DORMANT] = 0
+        size = grid.cellSize
+
+        for cell, objects in grid.cells.items():
+            # Measure to the nearest point of the cell, so no entity is simulated in less detail than it should be
+            nearest = float('inf')
+            for player in players:
+                x = max(cell[0]*size - player.pos[0], 0, player.pos[0] - (cell[0]+1)*size)
+                y = max(cell[1]*size - player.pos[1], 0, player.pos[1] - (cell[1]+1)*size)
+                nearest = min(nearest, (x**2 + y**2)**0.5)
+
+            tier = DORMANT
+            for t, (maxDistance, interval) in enumerate(self.tiers):
+                if nearest <= maxDistance:
+                    tier = t
+                    break
+            self.cellTiers[cell] = tier
+            self.tierCounts[tier] += len(objects)
+
+    def getTier(self, cell):
+        '''
+        Return the tier of the given cell
+        '''
+        return self.cellTiers.get(cell, DORMANT)
+
+    def shouldTick(self, tier, key, tick):
+        '''
+        Return whether an object in the given tier should run its AI this tick
+        The key staggers the objects in a tier across the ticks in between
+        '''
+        if tier == DORMANT:
+            return False
+        return (tick + key) % self.tiers[tier][1] == 0
+
+    def getTierCounts(self):
+        '''
+        Return the number of objects in each tier as of the last update, keyed by the tier's maximum distance
+        '''
+        counts = {self.tiers[t][0] : self.tierCounts.get(t, 0) for t in range(len(self.tiers))}
+        counts['dormant'] = self.tierCounts.get(DORMANT, 0)
+        return counts
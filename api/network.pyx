@@ -8,31 +8,92 @@ from api.packets import *
 
 # Import the Python standard libraries
 import socket
+import struct
 import math
 import re
 import time
 import io
-from threading import Thread
+import os
+import zlib
+from threading import Thread, Lock
 from multiprocessing import Process
 
+# Datagram kinds for the unreliable side channel
+DATAGRAM_HELLO = 0
+DATAGRAM_ACK = 1
+DATAGRAM_DATA = 2
+
+# Datagram header: kind, session key, sequence number, channel, packet type length
+DATAGRAM_HEADER = struct.Struct('>B8sIBB')
+# Keep datagrams small enough to avoid IP fragmentation on most links
+MAX_DATAGRAM_SIZE = 1200
+# Number of HELLO datagrams to try before falling back to TCP
+DATAGRAM_ATTEMPTS = 5
+
+# Message kinds for the local transport
+LOCAL_CONNECT = 0
+LOCAL_CLOSE = 1
+LOCAL_DATA = 2
+
+# Local message header: PacketHandler port, channel, kind, packet type length
+LOCAL_HEADER = struct.Struct('>HBBB')
+
+# Capture file layout: a magic number, then records of kind, timestamp, connection index, length, data
+CAPTURE_MAGIC = b'MATACAP1'
+CAPTURE_RECORD = struct.Struct('>BdII')
+
+# Capture record kinds
+CAPTURE_OPEN = 0
+CAPTURE_FRAME = 1
+CAPTURE_DATAGRAM = 2
+CAPTURE_CLOSE = 3
+
+def getChannelId(name):
+    '''
+    Return the id a named PacketChannel is sent with, derived from the name so it matches on every side
+    Ids run from 1 to 255, as 0 is the game's PacketHandler
+    '''
+    return zlib.crc32(name.encode()) % 255 + 1
+
+# The packets every PacketHandler accepts by default
+DEFAULT_PACKETS = [WorldUpdatePacket, LoginPacket,
+                   DisconnectPacket, SyncPlayerPacket,
+                   ResetPlayerPacket, InvalidLoginPacket,
+                   SetupClientPacket, SendCommandPacket,
+                   MountPacket, AttackPacket,
+                   DatagramSessionPacket
+                  ]
+
 class PacketHandler:
-    def __init__(self, game, side, port=util.DEFAULT_PORT):
+    def __init__(self, game, side, port=util.DEFAULT_PORT, datagrams=False, capture=None, listen=True):
         self.game = game
         self.side = side
         self.port = port
 
+        # Record inbound traffic to a PacketCapture, if given
+        self.capture = capture
+
         self.connections = {}
-        self.safePackets = [WorldUpdatePacket, LoginPacket,
-                            DisconnectPacket, SyncPlayerPacket,
-                            ResetPlayerPacket, InvalidLoginPacket,
-                            SetupClientPacket, SendCommandPacket,
-                            MountPacket, AttackPacket
-                           ]
+        self.safePackets = list(DEFAULT_PACKETS)
+
+        # Channel 0 is this handler, the rest are PacketChannels sharing its connections
+        self.channelId = 0
+        self.channels = {0 : self}
 
         self.socket = socket.socket()
 
+        # Initialise the unreliable side channel
+        self.datagrams = datagrams
+        self.datagramSocket = None
+        self.datagramSessions = {}
+
+        # Listen on the local transport to a combined game, if there is one
+        self.localConnIndex = None
+        if game.localTransport:
+            game.localTransport.registerHandler(self)
+
         # Bind the socket if the PacketHandler is server-side
-        if side == util.SERVER:
+        if side == util.SERVER and listen:
             try:
                 self.socket.bind(('0.0.0.0', self.port))
             except OSError:
@@ -42,10 +103,27 @@ class PacketHandler:
             connPoll.daemon = True
             connPoll.start()
 
+            # Bind the datagram socket next to the TCP listener
+            if datagrams:
+                self.datagramSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                try:
+                    self.datagramSocket.bind(('0.0.0.0', self.port))
+                except OSError:
+                    print('[WARNING] Unable to bind the UDP port. Falling back to TCP only')
+                    self.datagramSocket = None
+                else:
+                    datagramPoll = Thread(target=self.pollForDatagrams)
+                    datagramPoll.daemon = True
+                    datagramPoll.start()
+
     def connectToServer(self, address):
         '''
         A client-side method to connect to a chosen server
         '''
+        # Skip the network stack when connecting to our own forked server
+        if self.game.localTransport and self.isLocalAddress(address):
+            return self.connectLocally()
+
         self.socket = socket.socket()
 
         try:
@@ -69,6 +147,57 @@ class PacketHandler:
         # Send a login packet
         self.sendToServer(LoginPacket(self.game.player))
 
+    def addChannel(self, channel, channelId):
+        '''
+        Multiplex a PacketChannel over the connections of this PacketHandler
+        '''
+        if channelId in self.channels or not 0 < channelId < 256:
+            raise KeyError('[ERROR] Invalid or duplicate packet channel id: {}'.format(channelId))
+
+        channel.channelId = channelId
+        channel.connections = self.connections
+        self.channels[channelId] = channel
+
+    def isLocalAddress(self, address):
+        '''
+        Return whether an address refers to this machine
+        '''
+        return address in ['localhost', '127.0.0.1', socket.gethostname(), socket.getfqdn()]
+
+    def connectLocally(self):
+        '''
+        A client-side method to connect to the forked server over the local transport
+        '''
+        self.localConnIndex = max(self.connections, default=0)+1
+        self.connections[self.localConnIndex] = LocalConnection(self.game.localTransport, self.port)
+        self.game.localTransport.sendMessage(self.port, LOCAL_CONNECT)
+
+        # Send a login packet
+        self.sendToServer(LoginPacket(self.game.player))
+
+    def acceptLocalConnection(self):
+        '''
+        A server-side method to accept the combined game's client over the local transport
+        '''
+        self.localConnIndex = max(self.connections, default=0)+1
+        self.connections[self.localConnIndex] = LocalConnection(self.game.localTransport, self.port)
+
+    def dropLocalConnection(self):
+        '''
+        Handle the other side closing the local connection
+        '''
+        connection = self.connections.get(self.localConnIndex)
+        if not isinstance(connection, LocalConnection):
+            # The connection has already been closed on this side
+            return
+        del self.connections[self.localConnIndex]
+
+        # Disconnect the same way as a reset network connection
+        if self.side == util.CLIENT or self.side == util.COMBINED:
+            self.game.fireEvent('onDisconnect', 'Server Connection Reset')
+        elif connection.username:
+            self.game.fireEvent('onDisconnect', connection.username)
+
     def pollForConnections(self):
         '''
         A server-side method to poll for incoming connections from clients
@@ -76,13 +205,181 @@ class PacketHandler:
         self.socket.listen(util.MAX_PLAYERS)
         while True:
             conn, addr = self.socket.accept()
-            self.connections[max(self.connections, default=0)+1] = Connection(conn, addr)
+            connection = Connection(conn, addr)
+            connIndex = max(self.connections, default=0)+1
+
+            # Key a datagram session to this connection, to be offered after login
+            if self.datagramSocket:
+                connection.sessionKey = os.urandom(8)
+                connection.datagramSocket = self.datagramSocket
+                self.datagramSessions[connection.sessionKey] = connIndex
+
+            self.connections[connIndex] = connection
+            if self.capture:
+                self.capture.write(CAPTURE_OPEN, connIndex)
 
             # Fork a connection handling thread
             t = Thread(target=self.handleConn, args=(max(self.connections, default=0),))
             t.daemon = True
             t.start()
 
+    def pollForDatagrams(self):
+        '''
+        A server-side method to receive datagrams from clients
+        '''
+        while True:
+            try:
+                datagram, addr = self.datagramSocket.recvfrom(65535)
+            except OSError:
+                return
+
+            header = self.parseDatagram(datagram)
+            if not header:
+                continue
+            kind, sessionKey, sequence, channel, packetType, data = header
+
+            # Find the authenticated connection this datagram belongs to
+            connIndex = self.datagramSessions.get(sessionKey)
+            connection = self.connections.get(connIndex)
+            if connection is None or not connection.username:
+                continue
+            connection.bytesReceived += len(datagram)
+            if self.capture:
+                self.capture.write(CAPTURE_DATAGRAM, connIndex, datagram)
+
+            if kind == DATAGRAM_HELLO:
+                # Remember where the client is, and let it know that datagrams get through
+                connection.datagramAddress = addr
+                self.datagramSocket.sendto(DATAGRAM_HEADER.pack(DATAGRAM_ACK, sessionKey, 0, 0, 0), addr)
+
+            elif kind == DATAGRAM_DATA:
+                if connection.acceptDatagram(packetType, sequence):
+                    # Follow the client if its address changes (e.g. NAT rebinding)
+                    connection.datagramAddress = addr
+                    self.dispatchPacket(packetType, data, connIndex, channel, inOrder=True)
+
+    def openDatagramChannel(self, connection):
+        '''
+        A client-side method to open the datagram channel offered by the server
+        '''
+        if not self.datagrams or connection.datagramSocket:
+            return
+
+        # Find the index of the connection the offer arrived on
+        connIndex = None
+        for index, conn in self.connections.items():
+            if conn is connection:
+                connIndex = index
+        if connIndex is None:
+            return
+
+        try:
+            address = (connection.connObj.getpeername()[0], self.port)
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.settimeout(1)
+        except OSError:
+            return
+
+        connection.datagramSocket = sock
+        connection.datagramAddress = address
+
+        # Fork a datagram handling thread and a handshake thread
+        t = Thread(target=self.handleDatagrams, args=(connIndex,))
+        t.daemon = True
+        t.start()
+
+        t = Thread(target=self.sendDatagramHello, args=(connection,))
+        t.daemon = True
+        t.start()
+
+    def sendDatagramHello(self, connection):
+        '''
+        Repeat the datagram handshake until the server answers, or give up and stay on TCP
+        '''
+        for attempt in range(DATAGRAM_ATTEMPTS):
+            if connection.datagramReady or connection.datagramSocket is None:
+                return
+            try:
+                hello = DATAGRAM_HEADER.pack(DATAGRAM_HELLO, connection.sessionKey, 0, 0, 0)
+                connection.datagramSocket.sendto(hello, connection.datagramAddress)
+            except OSError:
+                break
+            time.sleep(1)
+
+        if not connection.datagramReady:
+            print('[WARNING] UDP appears to be blocked. Falling back to TCP')
+
+    def handleDatagrams(self, connIndex):
+        '''
+        A client-side method to receive datagrams from the server
+        '''
+        connection = self.connections[connIndex]
+        sock = connection.datagramSocket
+        while True:
+            try:
+                datagram, addr = sock.recvfrom(65535)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+
+            header = self.parseDatagram(datagram)
+            if not header or addr != connection.datagramAddress:
+                continue
+            kind, sessionKey, sequence, channel, packetType, data = header
+            if sessionKey != connection.sessionKey:
+                continue
+            connection.bytesReceived += len(datagram)
+
+            if kind == DATAGRAM_ACK and not connection.datagramReady:
+                # Datagrams work both ways, so confirm the channel over TCP
+                connection.datagramReady = True
+                connection.sendPacket(DatagramSessionPacket(sessionKey))
+
+            elif kind == DATAGRAM_DATA:
+                if connection.acceptDatagram(packetType, sequence):
+                    self.dispatchPacket(packetType, data, connIndex, channel, inOrder=True)
+
+    def parseDatagram(self, datagram):
+        '''
+        Split a datagram into its header values and packet data
+        '''
+        if len(datagram) < DATAGRAM_HEADER.size:
+            return None
+
+        kind, sessionKey, sequence, channel, typeLength = DATAGRAM_HEADER.unpack_from(datagram)
+        start = DATAGRAM_HEADER.size
+        try:
+            packetType = datagram[start:start+typeLength].decode()
+        except UnicodeDecodeError:
+            return None
+
+        return kind, sessionKey, sequence, channel, packetType, datagram[start+typeLength:]
+
+    def dispatchPacket(self, packetType, data, connIndex, channel=0, inOrder=False):
+        '''
+        Handle an unframed packet (from a datagram or the local transport) asynchronously
+        Datagrams are handled in order on the receiving thread instead, so a stale one can't be handled after a newer one
+        '''
+        handler = self.channels.get(channel)
+        if handler is None:
+            return
+
+        for packet in handler.safePackets:
+            if packet.__name__ == packetType:
+                if inOrder:
+                    try:
+                        handler.processPacket(packet, data, connIndex)
+                    except Exception as e:
+                        # Keep receiving datagrams after a bad one
+                        print('[ERROR] Datagram {} could not be handled: {}'.format(packetType, e))
+                    return
+
+                t = Thread(target=handler.processPacket, args=(packet, data, connIndex))
+                t.daemon = True
+                t.start()
+                return
+
     def getPacket(self, conn):
         '''
         Get the bytes of a data packet
@@ -98,8 +395,8 @@ class PacketHandler:
             currentByte = conn.recv(1)
 
         # Start fetching the useful info
-        # Get the packet type and part sections
-        byteBuf += conn.recv(34)
+        # Get the channel, packet type and part sections
+        byteBuf += conn.recv(35)
 
         # Get the packet length section
         length = conn.recv(2)
@@ -117,7 +414,7 @@ class PacketHandler:
         byteBuf += conn.recv(4)
 
         # If the packet is not the correct length, something strange has happened
-        if len(byteBuf) != 41+length:
+        if len(byteBuf) != 42+length:
             print(byteBuf)
             print(length)
             raise ConnectionResetError
@@ -134,6 +431,8 @@ class PacketHandler:
 
         try:
             # Pull the values from the byte string
+            dataDictionary['channel'] = data[0]
+            data = data[1:]
             dataDictionary['type'] = data[:32].decode().strip()
             data = data[32:]
             dataDictionary['part'] = str(data[0]) + '/' + str(data[1])
@@ -157,14 +456,20 @@ class PacketHandler:
         '''
         Handle communication on the given connection
         '''
-        conn = self.connections[connIndex].connObj
+        connection = self.connections[connIndex]
+        conn = connection.connObj
         while True:
             # Receive the packet data
             try:
                 data = self.getPacket(conn)
+                connection.bytesReceived += len(data)
+                if self.capture:
+                    self.capture.write(CAPTURE_FRAME, connIndex, data)
 
             except ConnectionResetError as e:
                 print('ConnectionResetError')
+                if self.capture:
+                    self.capture.write(CAPTURE_CLOSE, connIndex)
                 # Properly disconnect if the connection is reset from the other side
                 if self.side == util.CLIENT:
                     self.game.fireEvent('onDisconnect', 'Server Connection Reset')
@@ -193,8 +498,14 @@ class PacketHandler:
 
             # print('Received packet:', dataDictionary['type'])
 
+            # Find the channel the packet was sent on
+            handler = self.channels.get(dataDictionary['channel'])
+            if handler is None:
+                print('[WARNING] Packet received on unknown channel: {}'.format(dataDictionary['channel']))
+                continue
+
             # Handle the packet asynchronously
-            t = Thread(target=self.handlePacket, args=(dataDictionary, connIndex))
+            t = Thread(target=handler.handlePacket, args=(dataDictionary, connIndex))
             t.daemon = True
             t.start()
 
@@ -234,42 +545,44 @@ class PacketHandler:
                             # Clear the packet buffer
                             del self.connections[connIndex].multipartBuffer[dataDictionary['type']]
 
-                        # Initialise the packet, and handle it accordingly
-                        try:
-                            p = packet()
-                            p.fromBytes(dataDictionary['data'])
-
-                            # Pass the connection list in if a login packet
-                            if packet.__name__ in ['LoginPacket', 'SetupConnPacket']:
-                                # print('Logging in on packethandler:', self)
-                                # print('connections of that packethandler are:', self.connections)
-                                response = p.onReceive(self.connections[connIndex], self.side, self.game, self.connections)
-                            else:
-                                response = p.onReceive(self.connections[connIndex], self.side, self.game)
-
-                        except Exception as e:
-                            print('Packet unable to be handled correctly.')
-                            print('Error is:')
-                            raise e
-                            return
-
-                        self.game.fireEvent('onPacketReceived', p)
-
-                        # Send packet(s) in response to the received packet
-                        if response:
-                            # Send any required response and reset the receive size
-                            if isinstance(response, list):
-                                for res in response:
-                                    # print('sending packet {} in response to {}'.format(res.__class__.__name__, packet.__name__))
-                                    self.connections[connIndex].sendPacket(res)
-                            else:
-                                # print('sending packet {} in response to {}'.format(response.__class__.__name__, packet.__name__))
-                                self.connections[connIndex].sendPacket(response)
+                        self.processPacket(packet, dataDictionary['data'], connIndex)
                     break
                 except KeyError:
                     print(dataDictionary)
                     return
 
+    def processPacket(self, packet, data, connIndex):
+        '''
+        Decode a fully received packet, run its logic and send any response
+        '''
+        # Initialise the packet, and handle it accordingly
+        try:
+            p = packet()
+            p.fromBytes(data)
+
+            # Pass the connection list in if a login packet
+            if packet.__name__ in ['LoginPacket', 'SetupConnPacket']:
+                response = p.onReceive(self.connections[connIndex], self.side, self.game, self.connections)
+            else:
+                response = p.onReceive(self.connections[connIndex], self.side, self.game)
+
+        except Exception as e:
+            print('Packet unable to be handled correctly.')
+            print('Error is:')
+            raise e
+            return
+
+        self.game.fireEvent('onPacketReceived', p)
+
+        # Send packet(s) in response to the received packet
+        if response:
+            # Send any required response and reset the receive size
+            if isinstance(response, list):
+                for res in response:
+                    self.connections[connIndex].sendPacket(res, channel=self.channelId)
+            else:
+                self.connections[connIndex].sendPacket(response, channel=self.channelId)
+
     def closeConnection(self, username=''):
         '''
         A method for closing a connection
@@ -280,11 +593,10 @@ class PacketHandler:
                 if self.connections[conn].username == username:
                     # Close the socket object and delete the connection object from memory
                     # print('Connections in closeConnection (pre-connection close):', self.connections)
-                    try:
-                        self.connections[conn].connObj.shutdown(socket.SHUT_RDWR)
+                    self.connections[conn].close()
 
-                    except OSError:
-                        self.connections[conn].connObj.close()
+                    # Forget the datagram session for this connection
+                    self.datagramSessions.pop(self.connections[conn].sessionKey, None)
 
                     # print('Connections in closeConnection (post-connection close):', self.connections)
                     try:
@@ -299,11 +611,11 @@ class PacketHandler:
             for conn in keys:
                 # Close the socket object and delete the connection object from memory
                 try:
-                    try:
-                        self.connections[conn].connObj.shutdown(socket.SHUT_RDWR)
+                    self.connections[conn].close()
 
-                    except OSError:
-                        self.connections[conn].connObj.close()
+                    # Close the datagram channel to stop its receiving thread
+                    if self.connections[conn].datagramSocket:
+                        self.connections[conn].datagramSocket.close()
 
                     del self.connections[conn]
                 except KeyError:
@@ -368,6 +680,7 @@ class PacketHandler:
     def sendToNearby(self, packet, username, radius=16):
         '''
         Send a packet to all players within a certain distance of a given player
+        If the distance is None, send it to every player who can see the given player
         '''
         if self.checkClientPacket(packet):
             return
@@ -376,38 +689,91 @@ class PacketHandler:
         pos = player.pos
         dim = player.dimension
 
+        if radius is None:
+            self.sendToSubscribers(packet, pos, dim)
+            return
+
         # Loop all players and find the distance to the given player
         for p in self.game.getWorld(dim).getPlayersNear(pos, radius):
             self.sendToPlayer(packet, p.name)
 
-    def sendToPlayer(self, packet, username):
+    def sendToSubscribers(self, packet, pos, dimension):
+        '''
+        Send a packet to all players whose interest area includes a given position
+        '''
+        if self.checkClientPacket(packet):
+            return
+
+        subscribers = self.game.getWorld(dimension).getSubscribers(pos)
+        for conn in list(self.connections.values()):
+            if conn.username in subscribers:
+                conn.sendPacket(packet, channel=self.channelId)
+
+    def sendToPlayer(self, packet, username, unreliable=False):
         '''
         Send a packet to a client with the given username
+        Unreliable packets use the datagram channel when it is available
         '''
         if self.checkClientPacket(packet):
             return
 
         for conn in self.connections.values():
             if conn.username == username:
-                conn.sendPacket(packet)
+                conn.sendPacket(packet, unreliable, self.channelId)
                 return
 
-    def sendToServer(self, packet):
+    def sendToServer(self, packet, unreliable=False):
         '''
         Send a Packet to the server
+        Unreliable packets use the datagram channel when it is available
         '''
         if self.checkServerPacket(packet):
             return
 
         try:
-            self.connections[1].sendPacket(packet)
+            self.connections[1].sendPacket(packet, unreliable, self.channelId)
         except KeyError:
             print(packet)
             return
 
+class PacketChannel(PacketHandler):
+    '''
+    A logical packet pipeline with no sockets of its own
+    Once registered, it is multiplexed over the connections of the game's PacketHandler
+    The client and server channels of a mod must share a name, as the channel id is derived from it
+    '''
+    def __init__(self, game, side, name):
+        self.game = game
+        self.side = side
+        self.name = name
+        self.port = None
+
+        # The connections are filled in by the PacketHandler carrying this channel
+        self.connections = {}
+        self.safePackets = list(DEFAULT_PACKETS)
+        self.channelId = getChannelId(name)
+        self.channels = {}
+
+    def connectToServer(self, address):
+        '''
+        Do nothing, as the channel is connected along with the game's PacketHandler
+        '''
+        pass
+
+    def closeConnection(self, username=''):
+        '''
+        Do nothing, as the channel is disconnected along with the game's PacketHandler
+        '''
+        pass
+
 class GamePacketHandler(PacketHandler):
-    def __init__(self, game, side):
-        super().__init__(game, side, util.DEFAULT_PORT)
+    def __init__(self, game, side, capture=None, listen=True):
+        super().__init__(game, side, util.DEFAULT_PORT, util.ENABLE_UDP, capture, listen)
+
+        # Carry every registered PacketChannel over this handler's connections
+        for pipeline in game.modLoader.gameRegistry.packetPipelines.values():
+            if isinstance(pipeline, PacketChannel):
+                self.addChannel(pipeline, pipeline.channelId)
 
 class Connection:
     def __init__(self, conn, addr):
@@ -417,10 +783,64 @@ class Connection:
 
         self.multipartBuffer = {}
 
+        # Count the traffic on this connection
+        self.bytesSent = 0
+        self.bytesReceived = 0
+
+        # Unreliable side channel state
+        self.sessionKey = None
+        self.datagramSocket = None
+        self.datagramAddress = None
+        self.datagramReady = False
+        self.datagramSequence = 0
+        # Datagrams are sent from the tick thread and packet handling threads, so number them one at a time
+        self.datagramLock = Lock()
+        self.lastDatagramSequences = {}
+
     def __repr__(self):
         return 'Connection(username={}, connObj={})'.format(self.username, self.connObj.fileno())
 
-    def sendPacket(self, packet):
+    def close(self):
+        '''
+        Close the socket of this connection
+        '''
+        try:
+            self.connObj.shutdown(socket.SHUT_RDWR)
+
+        except OSError:
+            self.connObj.close()
+
+    def acceptDatagram(self, packetType, sequence):
+        '''
+        Return whether a datagram is newer than the last one received of the same type
+        Older datagrams are dropped, so the latest update always wins
+        '''
+        if sequence <= self.lastDatagramSequences.get(packetType, 0):
+            return False
+        self.lastDatagramSequences[packetType] = sequence
+        return True
+
+    def sendDatagram(self, packetType, packetString, channel=0):
+        '''
+        Send packet data on the datagram channel
+        Return whether the datagram could be sent
+        '''
+        if DATAGRAM_HEADER.size + len(packetType) + len(packetString) > MAX_DATAGRAM_SIZE:
+            return False
+
+        # Send while holding the lock, so the datagrams leave in the order of their sequence numbers
+        with self.datagramLock:
+            self.datagramSequence += 1
+            header = DATAGRAM_HEADER.pack(DATAGRAM_DATA, self.sessionKey, self.datagramSequence, channel, len(packetType))
+            datagram = header + packetType.encode() + packetString
+            try:
+                self.datagramSocket.sendto(datagram, self.datagramAddress)
+            except OSError:
+                return False
+            self.bytesSent += len(datagram)
+        return True
+
+    def sendPacket(self, packet, unreliable=False, channel=0):
         '''
         Send a packet on this connection
         '''
@@ -431,6 +851,11 @@ class Connection:
         packet.toBytes(buf2)
         packetString = buf2.getvalue()
 
+        # Send small unreliable packets as datagrams, falling back to TCP otherwise
+        if unreliable and self.datagramReady:
+            if self.sendDatagram(packet.__class__.__name__, packetString, channel):
+                return
+
         # Split the packet if required
         dataSize = len(packetString)
         dataList = [packetString[a:a+950] for a in range(0, dataSize, 950)]
@@ -456,7 +881,7 @@ class Connection:
             packetType = ' '*(32-len(packetType))+packetType
 
             # Write the header of the packet
-            buf.write(b'\x01' + packetType.encode() + partDetail)
+            buf.write(b'\x01' + channel.to_bytes(1, 'big') + packetType.encode() + partDetail)
 
             # Write the length
             buf.write(len(part).to_bytes(2, 'big'))
@@ -471,6 +896,7 @@ class Connection:
             try:
                 # Sanitise and send the two packets one after the other
                 self.connObj.send(buf.getvalue())
+                self.bytesSent += len(buf.getvalue())
 
             except Exception as e:
                 if isinstance(e, ConnectionResetError):
@@ -491,3 +917,133 @@ class Connection:
                         return
 
                     print('[ERROR] An Error Occured! '+str(e))
+
+class LocalConnection(Connection):
+    def __init__(self, transport, port):
+        super().__init__(None, 'local')
+        self.transport = transport
+        self.port = port
+
+    def __repr__(self):
+        return 'LocalConnection(username={}, port={})'.format(self.username, self.port)
+
+    def close(self):
+        '''
+        Tell the other side of the local transport that this connection is closed
+        '''
+        self.transport.sendMessage(self.port, LOCAL_CLOSE)
+
+    def sendPacket(self, packet, unreliable=False, channel=0):
+        '''
+        Send a packet on this connection
+        The pipe is reliable and ordered, so no framing, splitting or checksum is needed
+        '''
+        buf = io.BytesIO()
+        packet.toBytes(buf)
+        self.transport.sendMessage(self.port, LOCAL_DATA, packet.__class__.__name__, buf.getvalue(), channel)
+
+class LocalTransport:
+    '''
+    A loopback transport between a combined game and its forked server process
+    Messages for every PacketHandler share one multiprocessing pipe, tagged with the handler's port
+    '''
+    def __init__(self, pipe):
+        self.pipe = pipe
+        self.lock = Lock()
+        self.handlers = {}
+
+    def registerHandler(self, handler):
+        '''
+        Register a PacketHandler to receive messages sent to its port
+        '''
+        self.handlers[handler.port] = handler
+
+    def start(self):
+        '''
+        Start receiving messages once every PacketHandler has been registered
+        '''
+        t = Thread(target=self.pollMessages)
+        t.daemon = True
+        t.start()
+
+    def sendMessage(self, port, kind, packetType='', data=b'', channel=0):
+        '''
+        Send a message to the PacketHandler with the same port on the other side
+        '''
+        message = LOCAL_HEADER.pack(port, channel, kind, len(packetType)) + packetType.encode() + data
+        try:
+            with self.lock:
+                self.pipe.send_bytes(message)
+        except (OSError, EOFError):
+            print('[WARNING] The local transport has been closed')
+
+    def pollMessages(self):
+        '''
+        Receive messages from the other process and pass them to the matching PacketHandler
+        '''
+        while True:
+            try:
+                message = self.pipe.recv_bytes()
+            except (OSError, EOFError):
+                return
+
+            port, channel, kind, typeLength = LOCAL_HEADER.unpack_from(message)
+            handler = self.handlers.get(port)
+            if handler is None:
+                continue
+
+            if kind == LOCAL_CONNECT:
+                handler.acceptLocalConnection()
+
+            elif kind == LOCAL_CLOSE:
+                handler.dropLocalConnection()
+
+            elif handler.localConnIndex in handler.connections:
+                start = LOCAL_HEADER.size
+                packetType = message[start:start+typeLength].decode()
+                handler.dispatchPacket(packetType, message[start+typeLength:], handler.localConnIndex, channel)
+
+class PacketCapture:
+    '''
+    A compact binary log of the inbound traffic of a PacketHandler, for replaying later
+    '''
+    def __init__(self, path):
+        self.file = open(path, 'wb')
+        self.file.write(CAPTURE_MAGIC)
+        self.lock = Lock()
+        self.lastFlush = time.time()
+
+    def write(self, kind, connIndex, data=b''):
+        '''
+        Write a timestamped record to the capture
+        '''
+        now = time.time()
+        with self.lock:
+            self.file.write(CAPTURE_RECORD.pack(kind, now, connIndex, len(data)) + data)
+            # Flush regularly so a crashed server still leaves a usable capture
+            if now - self.lastFlush > 1:
+                self.file.flush()
+                self.lastFlush = now
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+def readCapture(path):
+    '''
+    Yield the (kind, timestamp, connIndex, data) records of a capture file
+    '''
+    with open(path, 'rb') as f:
+        if f.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+            raise ValueError('[ERROR] {} is not a packet capture'.format(path))
+
+        while True:
+            header = f.read(CAPTURE_RECORD.size)
+            if len(header) < CAPTURE_RECORD.size:
+                # A truncated final record means the server stopped mid-write
+                return
+            kind, timestamp, connIndex, length = CAPTURE_RECORD.unpack(header)
+            data = f.read(length)
+            if len(data) < length:
+                return
+            yield kind, timestamp, connIndex, data
@@ -1,4 +1,4 @@
-from api.entity import Player
+from api.entity import Player, POSITION_QUANTUM, isNewerSequence
 from api.vehicle import Vehicle
 from api.dimension import WorldMP
 from api.biome import TileMap
@@ -8,9 +8,25 @@ import util
 
 from datetime import datetime
 import random
+import struct
 import time
 import math
 
+# The movement sent by a client: the sequence number of its latest move, the number of moves, velocity and dimension,
+# followed by the displacement of each move, oldest first
+PLAYER_MOVEMENT = struct.Struct('>IBhhH')
+PLAYER_MOVE = struct.Struct('>ii')
+# The most unacknowledged moves sent again in each movement packet, so a lost or late packet doesn't lose its moves
+MAX_SENT_MOVES = 32
+# The last movement the server processed for a client, and the position it left the player at
+MOVEMENT_ACK = struct.Struct('>Iii')
+# The fraction of a tile (per second) that velocities are rounded to
+VELOCITY_QUANTUM = 1/256
+# The most movement time a player can bank, so moves bunched up by network jitter aren't cut short
+MOVE_ALLOWANCE_TIME = 0.5
+# The number of moves a client makes a second
+MOVE_RATE = 20
+
 class Packet:
     def toBytes(self, buf):
         '''
@@ -57,34 +73,50 @@ class LoginPacket(Packet):
 
         # Add the player
         self.player = game.getWorld(0).addPlayer(game, self.player)
+        # The new connection numbers its movement from the start again
+        self.player.syncSequence = 0
+
+        # Set the client up first, as it needs the item ids to decode anything sent on login
+        gameRegistry = game.modLoader.gameRegistry
+        connection.sendPacket(SetupClientPacket(game.getDimension(0).getBiomeSize(), gameRegistry.seed, gameRegistry.getItemNames()))
 
         # Fire a login event
         game.fireEvent('onPlayerLogin', self.player)
 
         # Sync the player back to the Client
-        return [
-                SetupClientPacket(game.getDimension(0).getBiomeSize(), game.modLoader.gameRegistry.seed),
-                ResetPlayerPacket(self.player)
-               ]
+        response = [ResetPlayerPacket(self.player)]
+
+        # Offer the datagram channel if the server has one
+        if connection.sessionKey:
+            response.append(DatagramSessionPacket(connection.sessionKey))
+
+        return response
 
 class SetupClientPacket(Packet):
-    def __init__(self, biomeSize=0, seed=0):
+    def __init__(self, biomeSize=0, seed=0, itemNames=None):
         self.seed = seed
         self.size = biomeSize
+        self.itemNames = itemNames or []
 
     def toBytes(self, buf):
         buf.write(self.size.to_bytes(1, 'big'))
-        buf.write(str(round(self.seed, 5)).encode())
+        seed = str(round(self.seed, 5)).encode()
+        buf.write(len(seed).to_bytes(1, 'big') + seed)
+        # Send the item names in the order of their ids, so the client decodes items the same way
+        buf.write('\n'.join(self.itemNames).encode())
 
     def fromBytes(self, data):
-        print(data)
         self.size = data[0]
-        self.seed = eval(data[1:])
+        seedLength = data[1]
+        self.seed = float(data[2:2+seedLength])
+        self.itemNames = data[2+seedLength:].decode().split('\n')
 
     def onReceive(self, connection, side, game):
         # Set the seed and biomesize
         game.modLoader.gameRegistry.seed = self.seed
         game.getDimension(0).biomeSize = self.size
+        # Match the server's item ids
+        game.modLoader.gameRegistry.setItemIds(self.itemNames)
         # Fire the login event
         game.fireEvent('onPlayerLogin', game.player)
 
@@ -109,6 +141,7 @@ class ResetPlayerPacket(Packet):
         # Sync the player object on the client
         if self.bits & 1:
             game.player.pos = self.player.pos
+            game.player.resetMoves()
         if self.bits & 2:
             game.player.health = self.player.health
         if self.bits & 4:
@@ -117,55 +150,85 @@ class ResetPlayerPacket(Packet):
             game.player.exp = self.player.exp
 
 class SyncPlayerPacket(Packet):
-    def __init__(self, player=''):
-        self.player = player
+    '''
+    The moves made by the client player which the server hasn't acknowledged yet
+    Each move is sent until it is acknowledged, as it would be lost for good if its only packet went missing
+    The sender is identified by the connection, so the player itself is not sent
+    '''
+    def __init__(self, moves=(), velocity=(0, 0), dimension=0):
+        # The (sequence number, displacement) of each move, with consecutive sequence numbers
+        self.moves = list(moves)[-MAX_SENT_MOVES:]
+        self.velocity = list(velocity)
+        self.dimension = dimension
 
     def toBytes(self, buf):
-        buf.write(self.player.toBytes())
+        sequence = self.moves[-1][0] if self.moves else 0
+        # Clamp the velocity to fit, as anything that fast won't be allowed anyway
+        velocity = [max(-32768, min(32767, round(a/VELOCITY_QUANTUM))) for a in self.velocity]
+        buf.write(PLAYER_MOVEMENT.pack(sequence, len(self.moves), velocity[0], velocity[1], self.dimension))
+        for moveSequence, displacement in self.moves:
+            buf.write(PLAYER_MOVE.pack(*[round(a/POSITION_QUANTUM) for a in displacement]))
 
     def fromBytes(self, data):
-        self.player = Player.fromBytes(data)
+        sequence, count, vx, vy, self.dimension = PLAYER_MOVEMENT.unpack_from(data)
+        self.velocity = [vx*VELOCITY_QUANTUM, vy*VELOCITY_QUANTUM]
+        displacements = PLAYER_MOVE.iter_unpack(data[PLAYER_MOVEMENT.size:PLAYER_MOVEMENT.size+count*PLAYER_MOVE.size])
+        self.moves = [((sequence-count+1+m)%2**32, [dx*POSITION_QUANTUM, dy*POSITION_QUANTUM])
+                      for m, (dx, dy) in enumerate(displacements)]
 
     def onReceive(self, connection, side, game):
-        # Update their status on the server if everything is ok
-        # Reset them if it's not
-        if connection.username and self.player.name != connection.username:
-            # This is someone trying to mess with another player, do nothing
+        # Move the player on the server as far as they are allowed to
+        # The client is told where they ended up in the next world update, and corrects itself to match
+        serverPlayer = game.getPlayer(connection.username)
+        if serverPlayer is None:
             return
 
-        playerList = game.getWorld(self.player.dimension)
-        serverPlayer = game.getPlayer(self.player.name)
-        if serverPlayer is None:
+        # Filter and apply the moves under the player's lock, so moves resent in two packets handled at once
+        # can't both pass the filter and be applied twice
+        with serverPlayer.moveLock:
+            return self.applyMoves(serverPlayer, game)
+
+    def applyMoves(self, serverPlayer, game):
+        '''
+        Apply the moves which haven't been received in an earlier packet, as far as the player is allowed to move
+        '''
+        moves = [a for a in self.moves if isNewerSequence(a[0], serverPlayer.syncSequence)]
+        if not moves:
             return
 
-        # Get the deltaTime, and deltaTicks since last synchronisation
+        if self.dimension != serverPlayer.dimension:
+            # TODO check if it's possible for the dimension shift to have occured
+            return ResetPlayerPacket(serverPlayer, bits=4)
+
+        # Get the time since the last synchronisation
         if isinstance(serverPlayer.synced, datetime):
             deltaTime = (datetime.now()-serverPlayer.synced).total_seconds()
         else:
-            deltaTime = 4
-
-        # Write the new sync time (in case we need to reset)
+            deltaTime = MOVE_ALLOWANCE_TIME
         serverPlayer.synced = datetime.now()
 
-        # Check if the player's motion is not greater than a certain threshold
-        threshold = serverPlayer.getSpeed(game)*(deltaTime+0.1) + 0.0005 # <- Add this tiny extra bit to account for float imprecision
-        if max([abs(self.player.pos[a]-serverPlayer.pos[a]) for a in (0, 1)]) > threshold:
-            return ResetPlayerPacket(serverPlayer)
+        # Add to the distance the player may move, banking a little for moves which arrive together,
+        # and enough for the moves held up by lost packets
+        speed = serverPlayer.getSpeed(game)
+        bankTime = MOVE_ALLOWANCE_TIME + len(moves)/MOVE_RATE
+        serverPlayer.moveAllowance = min(serverPlayer.moveAllowance + speed*deltaTime, speed*bankTime)
 
-        if self.player.dimension != serverPlayer.dimension:
-            # TODO check if it's possible for the dimension shift to have occured
-            return ResetPlayerPacket(serverPlayer, bits=4)
+        pos = serverPlayer.pos
+        for sequence, displacement in moves:
+            # Cut the move short if it goes further than allowed
+            distance = max([abs(a) for a in displacement])
+            if distance > serverPlayer.moveAllowance + POSITION_QUANTUM:
+                displacement = [a*serverPlayer.moveAllowance/distance for a in displacement]
+            serverPlayer.moveAllowance = max(0, serverPlayer.moveAllowance-distance)
 
-        # If the player has clipped into a plant, reset their position
-        world = game.modLoader.gameRegistry.dimensions[self.player.dimension].getWorldObj()
+            # TODO Add check for player collision with plants, buildings etc
 
-        # TODO Add check for player collision with plants, buildings etc
-        # if world.world.map[self.player.pos[1]][self.player.pos[0]].plantIndex < 0:
-        #     return ResetPlayerPacket(serverPlayer)
+            pos = [pos[a]+displacement[a] for a in (0, 1)]
+            serverPlayer.syncSequence = sequence
 
         # Sync the player object on the server
-        serverPlayer.setPos(self.player.pos)
-        serverPlayer.dimension = self.player.dimension
+        serverPlayer.setPos(pos)
+        serverPlayer.velocity = self.velocity
 
 class MountPacket(Packet):
     def __init__(self, vehicle=None, player=None):
@@ -227,17 +290,30 @@ class MountPacket(Packet):
                 game.fireEvent('onPlayerMount', self.player, self.entity, success, 'dismount')
 
 class WorldUpdatePacket(Packet):
-    def __init__(self, world=None, player=None):
+    def __init__(self, world=None, player=None, relevanceFunctions=None):
         self.world = world
         self.player = player
+        self.relevanceFunctions = relevanceFunctions or {}
 
     def toBytes(self, buf):
-        buf.write(self.world.getUpdateData(self.player))
+        # Acknowledge the player's latest move, with where it left them
+        pos = [round(a/POSITION_QUANTUM) for a in self.player.pos]
+        buf.write(MOVEMENT_ACK.pack(self.player.syncSequence, pos[0], pos[1]))
+        buf.write(self.world.getUpdateData(self.player, self.relevanceFunctions))
 
     def fromBytes(self, data):
-        self.world = data
+        sequence, x, y = MOVEMENT_ACK.unpack_from(data)
+        self.ack = (sequence, [x*POSITION_QUANTUM, y*POSITION_QUANTUM])
+        self.world = data[MOVEMENT_ACK.size:]
 
     def onReceive(self, connection, side, game):
+        # Correct the client player by the moves the server has processed, unless a vehicle is moving them
+        if game.player:
+            if game.player.ridingEntity:
+                game.player.resetMoves()
+            else:
+                game.player.reconcileMoves(*self.ack)
+
         # Update the world on the Client side
         if game.world:
             game.world.handleUpdate(self.world, game)
@@ -282,7 +358,7 @@ class AttackPacket(Packet):
       # Decode the player and weapon data
         self.player = game.getPlayer(self.player)
         gameRegistry = game.modLoader.gameRegistry
-        self.weapon = Item.fromBytes(gameRegistry.items.values(), gameRegistry.resources, self.weapon)
+        self.weapon = Item.fromBytes(gameRegistry, self.weapon)
 
         # If the weapon isn't in their (correct) server-side inventory, just stop processing
         # if not self.player.inventory.checkWeapon(self.weapon):
@@ -319,6 +395,26 @@ class AttackPacket(Packet):
         # Calculate and set the tickDamage value
         self.weapon.calcDamage(game, self.player.name, entitiesInArc)
 
+class DatagramSessionPacket(Packet):
+    def __init__(self, sessionKey=b''):
+        self.sessionKey = sessionKey
+
+    def toBytes(self, buf):
+        buf.write(self.sessionKey)
+
+    def fromBytes(self, data):
+        self.sessionKey = data
+
+    def onReceive(self, connection, side, game):
+        if side == util.SERVER:
+            # The client has received datagrams, so start sending them once its address is known
+            if self.sessionKey == connection.sessionKey and connection.datagramAddress:
+                connection.datagramReady = True
+        else:
+            # Store the session key, and try to open the datagram channel
+            connection.sessionKey = self.sessionKey
+            game.packetPipeline.openDatagramChannel(connection)
+
 class InvalidLoginPacket(Packet):
     def toBytes(self, buf):
         buf.write(b'a')
@@ -0,0 +1,201 @@
+'''
+pathfinding.py
+A module for finding walkable paths through a world's tiles and plants.
+'''
+# Import the Python standard libraries
+import math
+import heapq
+from collections import OrderedDict
+
+# The side length of a navigation chunk, in tiles
+CHUNK_SIZE = 16
+# The number of A* node expansions allowed in a single tick, across every search
+SEARCH_BUDGET = 2000
+# The most nodes a single search may expand before giving up
+MAX_EXPANSIONS = 1000
+# The furthest a path may be searched for, in tiles
+MAX_DISTANCE = 64
+# The most paths kept in the cache
+MAX_CACHED_PATHS = 2048
+
+# Returned by a search which ran out of the tick's budget, as opposed to finding there is no path
+BUDGET_EXHAUSTED = 'budget exhausted'
+
+# The steps to the 8 neighbouring cells, and their cost
+NEIGHBOURS = [(1, 0, 1), (-1, 0, 1), (0, 1, 1), (0, -1, 1),
+              (1, 1, 2**0.5), (1, -1, 2**0.5), (-1, 1, 2**0.5), (-1, -1, 2**0.5)]
+
+def getCell(pos):
+    '''
+    Return the tile cell containing a given position
+    '''
+    return (math.floor(pos[0]), math.floor(pos[1]))
+
+def getChunk(cell):
+    '''
+    Return the navigation chunk containing a given cell
+    '''
+    return (cell[0]//CHUNK_SIZE, cell[1]//CHUNK_SIZE)
+
+def octileDistance(cell1, cell2):
+    '''
+    Return the length of the shortest 8-directional path between two cells, ignoring obstacles
+    '''
+    dx = abs(cell1[0]-cell2[0])
+    dy = abs(cell1[1]-cell2[1])
+    return max(dx, dy) + (2**0.5-1)*min(dx, dy)
+
+class PathFinder:
+    '''
+    Finds paths for AI tasks, using a walkability grid built lazily from the ChunkProvider
+    The grid is cached per chunk, and found paths are cached by their start and goal cells
+    Tiles are generated from the world seed and never change, so neither cache is invalidated
+    '''
+    def __init__(self, chunkProvider, gameRegistry, searchBudget=SEARCH_BUDGET):
+        self.chunkProvider = chunkProvider
+        self.gameRegistry = gameRegistry
+
+        # Map chunks to a bytearray of the walkable cells inside them
+        self.chunks = {}
+
+        # Map (start cell, goal cell) to paths, from the least to the most recently used
+        self.paths = OrderedDict()
+
+        # The search budget left in the current tick
+        self.searchBudget = searchBudget
+        self.budgetLeft = searchBudget
+        self.budgetTick = None
+
+    def getWalkableChunk(self, chunk):
+        '''
+        Return the walkability grid of a chunk, building it if required
+        '''
+        walkable = self.chunks.get(chunk)
+        if walkable is None:
+            x, y = chunk[0]*CHUNK_SIZE, chunk[1]*CHUNK_SIZE
+            walkable = bytearray(CHUNK_SIZE**2)
+            for b in range(CHUNK_SIZE):
+                for a in range(CHUNK_SIZE):
+                    walkable[b*CHUNK_SIZE + a] = self.isTileWalkable((x+a, y+b))
+            self.chunks[chunk] = walkable
+        return walkable
+
+    def isTileWalkable(self, cell):
+        '''
+        Ask the ChunkProvider whether the tile in a cell can be walked through
+        '''
+        tile = self.chunkProvider.getTileAt(cell, self.gameRegistry)
+        return tile is None or tile.isWalkable()
+
+    def isWalkable(self, pos):
+        '''
+        Return whether the tile at a given position can be walked through
+        '''
+        cell = getCell(pos)
+        chunk = getChunk(cell)
+        return bool(self.getWalkableChunk(chunk)[(cell[1]-chunk[1]*CHUNK_SIZE)*CHUNK_SIZE + cell[0]-chunk[0]*CHUNK_SIZE])
+
+    def findPath(self, start, goal, tick):
+        '''
+        Return a list of waypoints from the start position to the goal position
+        Return None if there is no path, or the search budget for this tick has run out
+        '''
+        # Refill the budget at the start of each tick
+        if tick != self.budgetTick:
+            self.budgetTick = tick
+            self.budgetLeft = self.searchBudget
+
+        startCell, goalCell = getCell(start), getCell(goal)
+        if startCell == goalCell:
+            return [list(goal)]
+
+        # Use the cached path if the same trip has been searched for already
+        key = (startCell, goalCell)
+        if key in self.paths:
+            self.paths.move_to_end(key)
+            path = self.paths[key]
+            return None if path is None else [list(a) for a in path]
+
+        if octileDistance(startCell, goalCell) > MAX_DISTANCE or self.budgetLeft <= 0:
+            return None
+
+        path = self.search(startCell, goalCell)
+        # Don't cache a search cut short by the budget, so it is tried again next tick
+        if path is BUDGET_EXHAUSTED:
+            return None
+        self.cachePath(key, path)
+        return None if path is None else [list(a) for a in path]
+
+    def search(self, startCell, goalCell):
+        '''
+        Run an A* search between two cells, and return the smoothed list of waypoints
+        Return None if there is no path, or BUDGET_EXHAUSTED if the tick's search budget ran out first
+        '''
+        if not self.isWalkable(goalCell):
+            return None
+
+        openHeap = [(octileDistance(startCell, goalCell), 0, startCell)]
+        cameFrom = {startCell : None}
+        costs = {startCell : 0}
+        expansions = 0
+
+        while openHeap:
+            estimate, cost, cell = heapq.heappop(openHeap)
+            if cell == goalCell:
+                return self.buildPath(cameFrom, goalCell)
+            if cost > costs[cell]:
+                continue
+
+            expansions += 1
+            self.budgetLeft -= 1
+            if self.budgetLeft < 0:
+                return BUDGET_EXHAUSTED
+            if expansions > MAX_EXPANSIONS:
+                return None
+
+            for dx, dy, stepCost in NEIGHBOURS:
+                neighbour = (cell[0]+dx, cell[1]+dy)
+                if not self.isWalkable(neighbour):
+                    continue
+                # Don't cut the corners of obstacles when moving diagonally
+                if dx and dy and not (self.isWalkable((cell[0]+dx, cell[1])) and self.isWalkable((cell[0], cell[1]+dy))):
+                    continue
+
+                newCost = cost + stepCost
+                if newCost < costs.get(neighbour, float('inf')):
+                    costs[neighbour] = newCost
+                    cameFrom[neighbour] = cell
+                    heapq.heappush(openHeap, (newCost + octileDistance(neighbour, goalCell), newCost, neighbour))
+
+        return None
+
+    def buildPath(self, cameFrom, goalCell):
+        '''
+        Walk back from the goal to build the path, keeping only the cells where it turns
+        '''
+        cells = [goalCell]
+        while cameFrom[cells[-1]] is not None:
+            cells.append(cameFrom[cells[-1]])
+        cells.reverse()
+
+        waypoints = []
+        for c in range(1, len(cells)):
+            # Skip any cell that continues in the same direction as the last step
+            if c < len(cells)-1:
+                step = (cells[c][0]-cells[c-1][0], cells[c][1]-cells[c-1][1])
+                nextStep = (cells[c+1][0]-cells[c][0], cells[c+1][1]-cells[c][1])
+                if step == nextStep:
+                    continue
+            # Aim for the centre of the cell
+            waypoints.append((cells[c][0]+0.5, cells[c][1]+0.5))
+        return waypoints
+
+    def cachePath(self, key, path):
+        '''
+        Store a search result
+        '''
+        # Forget the least recently used path if the cache is full, so the paths in use survive
+        if len(self.paths) >= MAX_CACHED_PATHS:
+            self.paths.popitem(last=False)
+
+        self.paths[key] = path
@@ -0,0 +1,437 @@
+'''
+persistence.py
+A module for saving the server's worlds to disk, as periodic snapshots with a journal of the changes between them.
+'''
+# Import the Python standard libraries
+import os
+import time
+import zlib
+import struct
+import queue
+import threading
+
+# Import the game's modules
+from api.entity import Player, Entity, Pickup
+from api.vehicle import Vehicle
+from api.item import Inventory, ItemStack
+
+import util
+
+# The names of the save files, inside the save directory
+SNAPSHOT_FILE = 'world.snapshot'
+JOURNAL_FILE = 'world.journal.{}'
+
+# The header at the start of a snapshot file, holding the generation of the journal it continues from
+SNAPSHOT_MAGIC = b'HSCW'
+SNAPSHOT_HEADER = struct.Struct('>4sI')
+
+# The header of every record, holding its type, length and checksum
+RECORD_HEADER = struct.Struct('>BII')
+
+# The types of record
+PLAYER = 0
+ENTITY = 1
+VEHICLE = 2
+REMOVE_ENTITY = 3
+REMOVE_VEHICLE = 4
+REMOVE_PLAYER = 5
+ITEM_IDS = 6
+
+# The number of objects captured between each check of the snapshot time budget
+CAPTURE_BATCH = 32
+
+def packRecord(recordType, dimension, *fields):
+    '''
+    Pack the fields of a record, each prefixed with its length, behind a record header
+    '''
+    payload = dimension.to_bytes(2, 'big') + b''.join([len(a).to_bytes(4, 'big') + a for a in fields])
+    return RECORD_HEADER.pack(recordType, len(payload), zlib.crc32(payload)) + payload
+
+def unpackRecords(data):
+    '''
+    Yield the type, dimension and fields of every record in some data
+    Stop at the first record which is cut off or corrupted, as it was being written during a crash
+    '''
+    offset = 0
+    while offset + RECORD_HEADER.size <= len(data):
+        recordType, length, checksum = RECORD_HEADER.unpack_from(data, offset)
+        offset += RECORD_HEADER.size
+        payload = data[offset:offset+length]
+        if len(payload) != length or zlib.crc32(payload) != checksum:
+            print('[WARNING] Discarding a damaged save record and everything after it')
+            return
+        offset += length
+
+        dimension = int.from_bytes(payload[:2], 'big')
+        fields = []
+        a = 2
+        while a < len(payload):
+            fieldLength = int.from_bytes(payload[a:a+4], 'big')
+            fields.append(payload[a+4:a+4+fieldLength])
+            a += 4+fieldLength
+        yield recordType, dimension, fields
+
+def getEntityFields(entity):
+    '''
+    Return the fields saved for an entity, which include the itemstack of a pickup
+    '''
+    if isinstance(entity, Pickup):
+        return [entity.toBytes(), entity.getItem().toBytes()]
+    return [entity.toBytes()]
+
+class WorldPersistence:
+    '''
+    Saves the players, entities and vehicles of every world (SERVER-SIDE)
+    A snapshot is captured across several ticks within a time budget, then compressed and written by a background thread
+    Changes between snapshots are appended to a journal, which is replayed over the snapshot to recover
+    Players are journalled when they move to another tile, but entity and vehicle positions are only saved
+    in snapshots, so an entity or vehicle recovers at the position of the last snapshot
+    '''
+    def __init__(self, game, saveDir=util.SAVE_DIR, fsyncPolicy=util.FSYNC_POLICY,
+                 snapshotInterval=util.SNAPSHOT_INTERVAL, snapshotBudget=util.SNAPSHOT_BUDGET):
+        self.game = game
+        self.saveDir = saveDir
+        self.fsyncPolicy = fsyncPolicy
+        self.snapshotInterval = snapshotInterval
+        self.snapshotBudget = snapshotBudget
+
+        # The generation of the journal being written. A snapshot replaces every journal before its own generation
+        self.generation = 0
+        self.journal = None
+
+        # The state last written to the journal, to find what has changed since
+        self.knownPlayers = {}
+        self.knownEntities = set()
+        self.knownVehicles = set()
+
+        # The snapshot being captured, and when the last one was started
+        self.capturing = None
+        self.captured = []
+        self.lastSnapshot = time.time()
+
+        # Start the thread to write snapshots in the background
+        self.writeQueue = queue.Queue()
+        self.writer = threading.Thread(target=self.writeSnapshots, daemon=True)
+        self.writer.start()
+
+    def getPath(self, filename):
+        '''
+        Return the path to a file in the save directory
+        '''
+        return os.path.join(self.saveDir, filename)
+
+    def getJournalGenerations(self):
+        '''
+        Return the generations of the journals in the save directory, in order
+        '''
+        prefix = JOURNAL_FILE.format('')
+        generations = []
+        for filename in os.listdir(self.saveDir):
+            if filename.startswith(prefix) and filename[len(prefix):].isdigit():
+                generations.append(int(filename[len(prefix):]))
+        return sorted(generations)
+
+    def openJournal(self, generation):
+        '''
+        Close the current journal, and start appending to the journal of a new generation
+        '''
+        if self.journal:
+            self.syncFile(self.journal, 'always')
+            self.journal.close()
+        self.generation = generation
+        self.journal = open(self.getPath(JOURNAL_FILE.format(generation)), 'ab')
+        self.journal.write(self.getItemIdsRecord())
+
+    def syncFile(self, f, *policies):
+        '''
+        Flush a file to the operating system, and force it to the disk if the fsync policy asks for it
+        '''
+        f.flush()
+        if self.fsyncPolicy in policies:
+            os.fsync(f.fileno())
+
+    def getItemIdsRecord(self):
+        '''
+        Return a record of the item ids used in the saved inventories
+        '''
+        return packRecord(ITEM_IDS, 0, '\n'.join(self.game.modLoader.gameRegistry.getItemNames()).encode())
+
+    def getWorlds(self):
+        '''
+        Return each dimension id and its world
+        '''
+        worlds = []
+        for d in self.game.modLoader.gameRegistry.dimensions.keys():
+            world = self.game.getWorld(d)
+            if world:
+                worlds.append((d, world))
+        return worlds
+
+    def recover(self):
+        '''
+        Load the last snapshot, then replay every journal written since it over the worlds
+        '''
+        os.makedirs(self.saveDir, exist_ok=True)
+        start = time.time()
+        players = {}
+        count = 0
+
+        # Load the snapshot, if one has been saved
+        generation = 0
+        snapshotPath = self.getPath(SNAPSHOT_FILE)
+        if os.path.isfile(snapshotPath):
+            with open(snapshotPath, 'rb') as f:
+                data = f.read()
+            try:
+                magic, generation = SNAPSHOT_HEADER.unpack_from(data)
+                if magic != SNAPSHOT_MAGIC:
+                    raise ValueError
+                data = zlib.decompress(data[SNAPSHOT_HEADER.size:])
+            except (struct.error, ValueError, zlib.error):
+                print('[ERROR] The world snapshot is damaged, and cannot be loaded')
+                data = b''
+                generation = 0
+            for record in unpackRecords(data):
+                count += self.applyRecord(players, *record)
+
+        # Replay the journals from the snapshot onwards
+        generations = [a for a in self.getJournalGenerations() if a >= generation]
+        for g in generations:
+            with open(self.getPath(JOURNAL_FILE.format(g)), 'rb') as f:
+                data = f.read()
+            for record in unpackRecords(data):
+                count += self.applyRecord(players, *record)
+
+        # Let the mods set up the loaded players again
+        for player in players.values():
+            self.game.fireEvent('onPlayerLoaded', player)
+
+        # Remember the recovered state, so only new changes are journalled
+        self.updateKnownState()
+        self.openJournal(max(generations + [generation]) + 1)
+        if count:
+            print('[INFO] Recovered {} saved objects in {:.0f}ms'.format(count, (time.time()-start)*1000))
+
+    def applyRecord(self, players, recordType, dimension, fields):
+        '''
+        Apply a single saved record to the worlds
+        Return the number of objects that were loaded
+        '''
+        gameRegistry = self.game.modLoader.gameRegistry
+        if recordType == ITEM_IDS:
+            # Use the item ids the following records were saved with
+            gameRegistry.setItemIds(fields[0].decode().split('\n'))
+            return 0
+
+        world = self.game.getWorld(dimension)
+        if world is None:
+            return 0
+
+        if recordType == PLAYER:
+            player = Player.fromBytes(fields[0])
+            player.setInventory(Inventory.fromBytes(self.game, fields[1]))
+            # Replace any older copy of the player, in any world
+            self.removePlayer(player.name)
+            world.players.append(player)
+            world.playerGrid.updateObject(player.name, player)
+            players[player.name] = player
+
+        elif recordType == ENTITY:
+            entity = Entity.fromBytes(fields[0], gameRegistry.entities)
+            self.removeObject(world.entities, world, entity.uuid)
+            if isinstance(entity, Pickup):
+                # A pickup is nothing without its itemstack, so drop any saved without one
+                if len(fields) < 2:
+                    return 0
+                entity.setItemstack(ItemStack.fromBytes(self.game, fields[1]))
+            world.spawnEntityInWorld(entity)
+
+        elif recordType == VEHICLE:
+            vehicle = Vehicle.fromBytes(fields[0], gameRegistry.vehicles)
+            self.removeObject(world.vehicles, world, vehicle.uuid)
+            world.spawnEntityInWorld(vehicle)
+
+        elif recordType == REMOVE_PLAYER:
+            self.removePlayer(fields[0].decode())
+            players.pop(fields[0].decode(), None)
+            return 0
+
+        elif recordType in (REMOVE_ENTITY, REMOVE_VEHICLE):
+            objects = world.entities if recordType == REMOVE_ENTITY else world.vehicles
+            self.removeObject(objects, world, int.from_bytes(fields[0], 'big'))
+            return 0
+
+        return 1
+
+    def removePlayer(self, name):
+        '''
+        Remove the player with a given name from every world
+        '''
+        for d, world in self.getWorlds():
+            for p in range(len(world.players)-1, -1, -1):
+                if world.players[p].name == name:
+                    del world.players[p]
+                    world.playerGrid.removeObject(name)
+
+    def removeObject(self, objects, world, uuid):
+        '''
+        Remove the entity or vehicle with a given uuid from a world, if it is there
+        '''
+        for o in range(len(objects)):
+            if objects[o].uuid == uuid:
+                obj = objects.pop(o)
+                if isinstance(obj, Vehicle):
+                    world.vehicleGrid.removeObject(uuid)
+                else:
+                    world.entityGrid.removeObject(uuid)
+                    if world.entityStore:
+                        world.entityStore.removeEntity(obj)
+                return
+
+    def getPlayerState(self, player):
+        '''
+        Return the parts of a player which are journalled when they change
+        The position is rounded to the tile, so shuffling about on the spot doesn't rewrite the player
+        '''
+        return (int(player.exp), player.dimension, player.inventory.hashInv(), round(player.pos[0]), round(player.pos[1]))
+
+    def updateKnownState(self):
+        '''
+        Remember the current state of every world, without journalling it
+        '''
+        self.knownPlayers = {}
+        self.knownEntities = set()
+        self.knownVehicles = set()
+        for d, world in self.getWorlds():
+            for player in world.players:
+                self.knownPlayers[player.name] = self.getPlayerState(player)
+            self.knownEntities.update([(d, e.uuid) for e in world.entities])
+            self.knownVehicles.update([(d, v.uuid) for v in world.vehicles])
+
+    def writeJournal(self):
+        '''
+        Append a record of every player whose inventory, exp, dimension or tile has changed,
+        and every player, entity and vehicle added or removed, since the last call
+        '''
+        records = []
+        players = {}
+        entities = set()
+        vehicles = set()
+        for d, world in self.getWorlds():
+            for player in world.players:
+                state = self.getPlayerState(player)
+                players[player.name] = state
+                if self.knownPlayers.get(player.name) != state:
+                    records.append(packRecord(PLAYER, d, player.toBytes(), player.inventory.toBytes()))
+
+            for entity in world.entities:
+                entities.add((d, entity.uuid))
+                if (d, entity.uuid) not in self.knownEntities:
+                    records.append(packRecord(ENTITY, d, *getEntityFields(entity)))
+            for vehicle in world.vehicles:
+                vehicles.add((d, vehicle.uuid))
+                if (d, vehicle.uuid) not in self.knownVehicles:
+                    records.append(packRecord(VEHICLE, d, vehicle.toBytes()))
+
+        for name in self.knownPlayers.keys() - players.keys():
+            records.append(packRecord(REMOVE_PLAYER, 0, name.encode()))
+        for d, uuid in self.knownEntities - entities:
+            records.append(packRecord(REMOVE_ENTITY, d, uuid.to_bytes(8, 'big')))
+        for d, uuid in self.knownVehicles - vehicles:
+            records.append(packRecord(REMOVE_VEHICLE, d, uuid.to_bytes(8, 'big')))
+        self.knownPlayers = players
+        self.knownEntities = entities
+        self.knownVehicles = vehicles
+
+        if records:
+            self.journal.write(b''.join(records))
+            self.syncFile(self.journal, 'always')
+
+    def startSnapshot(self):
+        '''
+        Begin capturing a snapshot of every world
+        Return False if a snapshot is already being captured
+        '''
+        if self.capturing is not None:
+            return False
+
+        # Bring the journal up to date, and start a new one for the changes made while capturing
+        self.writeJournal()
+        self.openJournal(self.generation+1)
+        self.lastSnapshot = time.time()
+
+        # Only gather the objects now, as encoding them is spread over the next ticks
+        self.capturing = []
+        for d, world in self.getWorlds():
+            self.capturing += [(PLAYER, d, a) for a in world.players]
+            self.capturing += [(ENTITY, d, a) for a in world.entities]
+            self.capturing += [(VEHICLE, d, a) for a in world.vehicles]
+        self.capturing.reverse()
+        self.captured = [self.getItemIdsRecord()]
+        return True
+
+    def continueSnapshot(self, budget=None):
+        '''
+        Encode the objects of the snapshot being captured, until the time budget for this tick runs out
+        Hand the snapshot over to be written once every object is encoded
+        '''
+        budget = self.snapshotBudget if budget is None else budget
+        start = time.time()
+        while self.capturing and time.time()-start < budget:
+            for a in range(min(CAPTURE_BATCH, len(self.capturing))):
+                recordType, d, obj = self.capturing.pop()
+                if recordType == PLAYER:
+                    self.captured.append(packRecord(PLAYER, d, obj.toBytes(), obj.inventory.toBytes()))
+                elif recordType == ENTITY and not obj.isDead:
+                    self.captured.append(packRecord(ENTITY, d, *getEntityFields(obj)))
+                elif recordType == VEHICLE and not obj.isDestroyed:
+                    self.captured.append(packRecord(VEHICLE, d, obj.toBytes()))
+
+        if not self.capturing:
+            self.writeQueue.put((self.generation, self.captured))
+            self.capturing = None
+            self.captured = []
+
+    def writeSnapshots(self):
+        '''
+        Compress and write the captured snapshots to disk, then delete the journals they replace (BACKGROUND THREAD)
+        '''
+        while True:
+            generation, records = self.writeQueue.get()
+            try:
+                data = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, generation) + zlib.compress(b''.join(records))
+                # Write to a temporary file first, so a crash never leaves a half-written snapshot
+                tempPath = self.getPath(SNAPSHOT_FILE + '.tmp')
+                with open(tempPath, 'wb') as f:
+                    f.write(data)
+                    self.syncFile(f, 'always', 'snapshot')
+                os.replace(tempPath, self.getPath(SNAPSHOT_FILE))
+
+                for g in self.getJournalGenerations():
+                    if g < generation:
+                        os.remove(self.getPath(JOURNAL_FILE.format(g)))
+            except OSError as e:
+                print('[ERROR] Unable to save the world snapshot: {}'.format(e))
+            self.writeQueue.task_done()
+
+    def tick(self, tick):
+        '''
+        Journal the latest changes once a second, and capture snapshots as often as configured
+        '''
+        if self.capturing is not None:
+            self.continueSnapshot()
+        elif time.time()-self.lastSnapshot >= self.snapshotInterval:
+            self.startSnapshot()
+        elif tick%util.FPS == 0:
+            self.writeJournal()
+
+    def close(self):
+        '''
+        Write the last changes to the journal, and finish writing any snapshot
+        '''
+        # Finish capturing the snapshot in progress, rather than dropping it
+        if self.capturing is not None:
+            self.continueSnapshot(float('inf'))
+        self.writeJournal()
+        self.syncFile(self.journal, 'always', 'snapshot')
+        self.writeQueue.join()
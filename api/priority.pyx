@@ -0,0 +1,170 @@
+'''
+priority.py
+A module for deciding which objects are sent to each client in a world update.
+'''
+# Import the game's modules
+import util
+
+# Import the Python standard libraries
+import time
+
+# The rate (in updates per second) that world updates are sent at
+FULL_RATE = 6
+# Update rates by distance from the client's player, as (maximum distance, updates per second)
+UPDATE_TIERS = [(10, FULL_RATE), (20, 3)]
+# The update rate of anything further away than the last tier
+FAR_RATE = 1
+
+# The number of seconds after a hit that two objects are still considered to be fighting
+COMBAT_TIME = 3
+# The number of updates that a removed object is repeated in, in case an update is lost
+REMOVAL_REPEATS = 6
+
+# Scores for objects which skip the queue. Only the client's own player may exceed the budget
+OWN_PLAYER = float('inf')
+NEW_OBJECT = 1e9
+
+def getObjectKey(obj):
+    '''
+    Return the key used to identify an object in world updates
+    Players are identified by username, everything else by uuid
+    '''
+    return obj.name if obj.isPlayer() else obj.uuid
+
+def defaultRelevance(prioritiser, player, obj, distance):
+    '''
+    Return the number of updates per second a client's player needs for a given object
+    '''
+    # Anything the player is riding with, or fighting with, is always sent at the full rate
+    if player.ridingEntity is not None:
+        if obj.uuid == player.ridingEntity or obj.ridingEntity == player.ridingEntity:
+            return FULL_RATE
+    if prioritiser.isInCombat(getObjectKey(player), getObjectKey(obj)):
+        return FULL_RATE
+
+    # Otherwise, send less often the further away the object is
+    for maxDistance, rate in UPDATE_TIERS:
+        if distance <= maxDistance:
+            return rate
+    return FAR_RATE
+
+class ClientUpdateState:
+    def __init__(self):
+        # The last time each object was sent to this client
+        self.lastSent = {}
+        # The keys of removed objects, and the number of updates left to repeat them in
+        self.removed = {}
+
+class UpdatePrioritiser:
+    def __init__(self, budget=util.UPDATE_BUDGET):
+        self.budget = budget
+        self.clients = {}
+        self.combat = {}
+
+    def recordCombat(self, targetKey, sourceKey):
+        '''
+        Record that an object has hit another object
+        '''
+        self.combat[(targetKey, sourceKey)] = time.time()
+
+    def isInCombat(self, key1, key2):
+        '''
+        Return whether two objects have hit each other recently
+        '''
+        now = time.time()
+        for pair in [(key1, key2), (key2, key1)]:
+            if now - self.combat.get(pair, 0) < COMBAT_TIME:
+                return True
+        return False
+
+    def clearCombat(self):
+        '''
+        Forget any combat records that have expired
+        '''
+        now = time.time()
+        for pair, hitTime in list(self.combat.items()):
+            if now - hitTime >= COMBAT_TIME:
+                del self.combat[pair]
+
+    def sync(self, players):
+        '''
+        Forget the update state of any clients whose players have left the world
+        '''
+        present = set([p.name for p in players])
+        for username in list(self.clients):
+            if username not in present:
+                del self.clients[username]
+
+    def selectUpdates(self, player, objectLists, relevanceFunctions=None, chunk=(0, 0)):
+        '''
+        Choose which of the visible objects to send to a client this update
+        objectLists is a list of (objectType, objects) pairs, and positions are sent relative to the given chunk
+        Return a list of the records to send for each object list, and the list of removed keys
+        '''
+        relevanceFunctions = relevanceFunctions or {}
+        state = self.clients.setdefault(player.name, ClientUpdateState())
+        now = time.time()
+
+        # Score every visible object by how overdue its next update is
+        candidates = []
+        visible = set()
+        for listIndex, (objectType, objects) in enumerate(objectLists):
+            relevance = relevanceFunctions.get(objectType, defaultRelevance)
+            for obj in objects:
+                key = getObjectKey(obj)
+                visible.add(key)
+
+                # The client's own player is always sent
+                if obj.isPlayer() and obj.name == player.name:
+                    candidates.append((OWN_PLAYER, listIndex, key, obj))
+                    continue
+
+                distance = ((obj.pos[0]-player.pos[0])**2 + (obj.pos[1]-player.pos[1])**2)**0.5
+                rate = min(FULL_RATE, relevance(self, player, obj, distance))
+                if rate <= 0:
+                    continue
+
+                lastSent = state.lastSent.get(key)
+                if lastSent is None:
+                    # The client hasn't got this object at all, so send it first
+                    candidates.append((NEW_OBJECT, listIndex, key, obj))
+                    continue
+
+                # Allow a little slack so updates land on the next send tick
+                overdue = (now - lastSent) * rate
+                if overdue >= 0.9:
+                    candidates.append((overdue, listIndex, key, obj))
+
+        candidates.sort(key=lambda a: a[0], reverse=True)
+
+        # Fill the update with the most overdue objects until the budget runs out
+        records = [[] for a in objectLists]
+        used = 0
+        for overdue, listIndex, key, obj in candidates:
+            # Objects keep their encoded records until they change, so an object is only encoded once for many clients
+            record = obj.getRecord(chunk)
+            # Count the size of the record and its length as they are written in the update
+            size = len(record) + 2
+            if used + size > self.budget and overdue != OWN_PLAYER:
+                continue
+            used += size
+            records[listIndex].append(record)
+            state.lastSent[key] = now
+
+        # Tell the client to remove objects it knows about which have gone out of view
+        for key in list(state.lastSent):
+            if key not in visible:
+                del state.lastSent[key]
+                state.removed[key] = REMOVAL_REPEATS
+
+        removed = []
+        for key in list(state.removed):
+            if key in visible:
+                del state.removed[key]
+                continue
+            removed.append(key)
+            state.removed[key] -= 1
+            if state.removed[key] <= 0:
+                del state.removed[key]
+
+        return records, removed
@@ -2,3 +2,14 @@ class Property:
     def __init__(self, **kwargs):
         for val in kwargs.items():
             self.__setattr__(*val)
+
+    def copy(self, **changes):
+        '''
+        Return a copy of this property, with any given values changed
+        Lists, dictionaries and sets are copied one level deep, so the copy can be changed without affecting this property
+        '''
+        values = {}
+        for key, value in self.__dict__.items():
+            values[key] = value.copy() if isinstance(value, (list, dict, set)) else value
+        values.update(changes)
+        return Property(**values)
@@ -0,0 +1,103 @@
+'''
+steering.py
+A module for moving groups of entities together, computed for every grouping entity at once.
+'''
+# Import the Python standard libraries
+import math
+
+# The distance entities look for others in their group
+GROUP_RADIUS = 30
+# The distance entities try to keep from each other
+SEPARATION_RADIUS = 3
+
+# The weighting of each steering rule
+SEPARATION_WEIGHT = 1.5
+COHESION_WEIGHT = 1.0
+ALIGNMENT_WEIGHT = 0.5
+# The smallest steering direction that will move an entity, so settled groups stay still
+STEER_THRESHOLD = 0.05
+
+class GroupSteering:
+    '''
+    Steers grouping entities by separation, cohesion and alignment (SERVER-SIDE)
+    Entities are queued by their AI tasks during a tick, then all steered in one pass over a spatial hash
+    '''
+    def __init__(self, radius=GROUP_RADIUS, separationRadius=SEPARATION_RADIUS):
+        self.radius = radius
+        self.separationRadius = separationRadius
+        # The queued entities and the time each of them is steering for
+        self.queued = []
+
+    def queueEntity(self, entity, deltaTime):
+        '''
+        Queue an entity to be steered with its group this tick
+        '''
+        self.queued.append((entity, deltaTime))
+
+    def getVelocity(self, entity):
+        '''
+        Return the last velocity of an entity, if it is known
+        '''
+        if entity.entityStore is not None:
+            return entity.entityStore.vel[entity.storeSlot].tolist()
+        return [0, 0]
+
+    def apply(self, entities):
+        '''
+        Steer every queued entity, using the given entities as the possible group members
+        '''
+        if not self.queued:
+            return
+
+        # Hash the possible group members by cell, only for the classes that are grouping
+        classes = set([entity.__class__ for entity, deltaTime in self.queued])
+        cells = {}
+        for entity in entities:
+            if entity.__class__ in classes:
+                pos = entity.pos
+                cell = (math.floor(pos[0]/self.radius), math.floor(pos[1]/self.radius))
+                cells.setdefault(cell, []).append((entity, pos, self.getVelocity(entity)))
+
+        radiusSquared = self.radius**2
+        separationSquared = self.separationRadius**2
+        for entity, deltaTime in self.queued:
+            x, y = entity.pos
+            cx, cy = math.floor(x/self.radius), math.floor(y/self.radius)
+
+            # Sum up the neighbours in the surrounding cells
+            count = 0
+            centreX = centreY = 0
+            alignX = alignY = 0
+            separateX = separateY = 0
+            for cell in [(cx+a, cy+b) for a in (-1, 0, 1) for b in (-1, 0, 1)]:
+                for other, pos, velocity in cells.get(cell, []):
+                    if other is entity or other.__class__ is not entity.__class__:
+                        continue
+                    dx, dy = x-pos[0], y-pos[1]
+                    distSquared = dx**2 + dy**2
+                    if distSquared > radiusSquared:
+                        continue
+
+                    count += 1
+                    centreX += pos[0]
+                    centreY += pos[1]
+                    alignX += velocity[0]
+                    alignY += velocity[1]
+                    # Push away from anything too close, more strongly the closer it is
+                    if 0 < distSquared < separationSquared:
+                        separateX += dx/distSquared
+                        separateY += dy/distSquared
+
+            if not count:
+                continue
+
+            # Combine the rules into a single direction, and steer along it
+            cohesion = [(centreX/count-x)/self.radius, (centreY/count-y)/self.radius]
+            speed = entity.speed or 1
+            alignment = [alignX/count/speed, alignY/count/speed]
+            direction = [SEPARATION_WEIGHT*separate + COHESION_WEIGHT*cohere + ALIGNMENT_WEIGHT*align
+                         for separate, cohere, align in zip([separateX, separateY], cohesion, alignment)]
+            if (direction[0]**2 + direction[1]**2)**0.5 > STEER_THRESHOLD:
+                entity.steer(direction, deltaTime)
+
+        self.queued = []
@@ -1,4 +1,4 @@
-from api.entity import EntityBase, Player
+from api.entity import EntityBase, Player, packPos, unpackPos, packKey, unpackKey, packName, unpackName
 
 class Vehicle(EntityBase):
     def __init__(self):
@@ -37,6 +37,7 @@ class Vehicle(EntityBase):
             self.riders['driver'] = entity.name
         else:
             self.riders['other'].append(entity.name)
+        self.clearRecordCache()
         entity.ridingEntity = self.uuid
         return True
 
@@ -48,11 +49,13 @@ class Vehicle(EntityBase):
         driver = self.riders.get('driver')
         if entity.name == driver:
             self.riders['driver'] = None
+            self.clearRecordCache()
             return
         # Iterate the other connected riders, compare the entity and remove it if possible
         for r, rider in enumerate(self.riders['other']):
             if entity.name == rider:
                 self.riders['other'].pop(r)
+                self.clearRecordCache()
                 entity.ridingEntity = None
                 return
 
@@ -123,17 +126,44 @@ class Vehicle(EntityBase):
     def setImage(self, image):
         self.image = image
 
-    def toBytes(self):
-        return (str([self.__class__.__name__, self.name, self.uuid, self.pos, self.riders]).replace(', ', ',')).encode()
+    def toBytes(self, chunk=(0, 0)):
+        '''
+        Get a byte representation of the vehicle, with its position relative to the given chunk
+        '''
+        driver = self.riders['driver']
+        riders = b'\x01' + packKey(driver) if driver is not None else b'\x00'
+        riders += len(self.riders['other']).to_bytes(1, 'big') + b''.join([packKey(a) for a in self.riders['other']])
+        return (packName(self.__class__.__name__) + packName(self.name) + self.uuid.to_bytes(8, 'big') +
+                packPos(self.pos, chunk) + riders)
 
     @staticmethod
-    def fromBytes(vBytes, vehicleClassList):
-        vehicleClass, *vehicleProps = eval(vBytes)
+    def fromBytes(data, vehicleClassList, chunk=(0, 0)):
+        '''
+        Get a vehicle object from its byte representation
+        '''
+        vehicleClass, index = unpackName(data, 0)
+        name, index = unpackName(data, index)
+        uuid = int.from_bytes(data[index:index+8], 'big')
+        pos, index = unpackPos(data, index+8, chunk)
+
+        # Read the driver, then the other riders
+        driver = None
+        if data[index]:
+            driver, index = unpackKey(data, index+1)
+        else:
+            index += 1
+        riderCount = data[index]
+        index += 1
+        others = []
+        for a in range(riderCount):
+            rider, index = unpackKey(data, index)
+            others.append(rider)
+
         finalVehicle = vehicleClassList.get(vehicleClass, Vehicle)()
 
-        finalVehicle.setRegistryName(vehicleProps[0])
-        finalVehicle.uuid = vehicleProps[1]
-        finalVehicle.pos = vehicleProps[2]
-        finalVehicle.riders = vehicleProps[3]
+        finalVehicle.setRegistryName(name)
+        finalVehicle.uuid = uuid
+        finalVehicle.pos = pos
+        finalVehicle.riders = {'driver' : driver, 'other' : others}
 
         return finalVehicle
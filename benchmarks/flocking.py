@@ -0,0 +1,84 @@
+"""
+flocking.py
+A benchmark for the batched group steering of NPCs
+Steers growing numbers of NPCs spread at a constant density, and reports the time per steering pass
+
+Usage:
+python3 benchmarks/flocking.py [--counts 10,100,1000,5000] [--passes 20]
+"""
+# Import the Python standard libraries
+import sys
+import os
+import time
+import random
+
+# The game is run from the root of the repository
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(ROOT)
+sys.path.insert(0, ROOT)
+
+# Import the game's modules (packets first, as it and dimension import each other)
+from api import packets, dimension
+from api.steering import GroupSteering
+from mods.default.server.entity.npc import NPC
+
+# The area given to each NPC, in square tiles
+AREA_PER_NPC = 64
+
+def makeNPCs(count, entityStore):
+    """
+    Create a number of NPCs spread randomly over an area which grows with the count
+    """
+    side = (count*AREA_PER_NPC)**0.5
+    npcs = []
+    for a in range(count):
+        npc = NPC()
+        npc.uuid = a
+        npc.pos = [random.uniform(0, side), random.uniform(0, side)]
+        if entityStore:
+            entityStore.addEntity(npc)
+        npcs.append(npc)
+    return npcs
+
+def measure(count, passes):
+    """
+    Return the mean time of a steering pass over every NPC, in seconds
+    """
+    entityStore = dimension.EntityStore() if dimension.numpy is not None else None
+    npcs = makeNPCs(count, entityStore)
+    steering = GroupSteering()
+
+    total = 0
+    for p in range(passes):
+        start = time.perf_counter()
+        for npc in npcs:
+            steering.queueEntity(npc, 1/60)
+        steering.apply(npcs)
+        if entityStore:
+            entityStore.applyMovement()
+        total += time.perf_counter()-start
+    return total/passes
+
+def main(args):
+    counts = [10, 100, 1000, 5000]
+    passes = 20
+    i = 0
+    while i < len(args):
+        if args[i] == '--counts' and i != len(args)-1:
+            counts = [int(a) for a in args[i+1].split(',')]
+            i += 1
+        elif args[i] == '--passes' and i != len(args)-1:
+            passes = int(args[i+1])
+            i += 1
+        else:
+            print('[WARNING] Unknown argument: {}'.format(args[i]))
+        i += 1
+
+    random.seed(0)
+    print('{:>8} {:>12} {:>14}'.format('npcs', 'pass ms', 'us per npc'))
+    for count in counts:
+        passTime = measure(count, passes)
+        print('{:>8} {:>12.2f} {:>14.2f}'.format(count, passTime*1000, passTime/count*1e6))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
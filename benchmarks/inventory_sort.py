@@ -0,0 +1,72 @@
+"""
+inventory_sort.py
+A benchmark for sorting and stacking the items in an inventory
+Sorts groups of randomly split stacks of growing size, and reports the time per sort
+
+Usage:
+python3 benchmarks/inventory_sort.py [--counts 16,999,10000] [--passes 20]
+"""
+# Import the Python standard libraries
+import sys
+import os
+import time
+import random
+
+# The game is run from the root of the repository
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(ROOT)
+sys.path.insert(0, ROOT)
+
+# Import the game's modules
+from api.item import Inventory, ItemStack
+from mods.default.items import Dirt, Gold, Sword
+
+def makeStacks(count):
+    """
+    Create a number of small stacks of a mix of items
+    """
+    stacks = []
+    for a in range(count):
+        itemClass = random.choice([Dirt, Gold, Sword])
+        stacks.append(ItemStack(itemClass(), 1 if itemClass is Sword else random.randint(1, 50)))
+    return stacks
+
+def measure(count, passes):
+    """
+    Return the mean time to sort a group of stacks, in seconds
+    """
+    stacks = makeStacks(count)
+    inventory = Inventory()
+    inventory.maxSize = count
+
+    total = 0
+    for p in range(passes):
+        inventory.items['main'] = stacks
+        start = time.perf_counter()
+        inventory.sortGroup('main')
+        total += time.perf_counter()-start
+    return total/passes
+
+def main(args):
+    counts = [16, 999, 10000]
+    passes = 20
+    i = 0
+    while i < len(args):
+        if args[i] == '--counts' and i != len(args)-1:
+            counts = [int(a) for a in args[i+1].split(',')]
+            i += 1
+        elif args[i] == '--passes' and i != len(args)-1:
+            passes = int(args[i+1])
+            i += 1
+        else:
+            print('[WARNING] Unknown argument: {}'.format(args[i]))
+        i += 1
+
+    random.seed(0)
+    print('{:>8} {:>12} {:>14}'.format('stacks', 'sort ms', 'us per stack'))
+    for count in counts:
+        sortTime = measure(count, passes)
+        print('{:>8} {:>12.3f} {:>14.2f}'.format(count, sortTime*1000, sortTime/count*1e6))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,71 @@
+"""
+startup.py
+A benchmark for the startup of a dedicated server
+Measures the time taken to import the game and load the server mods, and the peak memory use
+Fails if pygame is loaded, as the dedicated server should run without SDL
+
+Usage:
+python3 benchmarks/startup.py [--runs 5]
+"""
+# Import the Python standard libraries
+import sys
+import os
+import json
+import subprocess
+
+# The game is run from the root of the repository
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The script run in a fresh interpreter for each measurement
+STARTUP_SCRIPT = '''
+import sys
+import time
+import json
+import resource
+
+start = time.perf_counter()
+import util
+import game
+importTime = time.perf_counter() - start
+
+server = game.Game(util.ArgumentHandler(['--mode', 'SERVER', '--disableNetwork', '--disablePersistence']))
+startupTime = time.perf_counter() - start
+
+print(json.dumps({
+    'import' : importTime,
+    'startup' : startupTime,
+    'rss' : resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    'pygame' : 'pygame' in sys.modules,
+}))
+'''
+
+def measureStartup():
+    """
+    Start a server in a new interpreter and return its measurements
+    """
+    result = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT], cwd=ROOT,
+                            stdout=subprocess.PIPE, universal_newlines=True, check=True)
+    return json.loads(result.stdout.strip().split('\n')[-1])
+
+def main(args):
+    runs = 5
+    if '--runs' in args[:-1]:
+        runs = int(args[args.index('--runs')+1])
+
+    results = [measureStartup() for a in range(runs)]
+
+    if any([r['pygame'] for r in results]):
+        print('[ERROR] pygame was imported by a dedicated server')
+        sys.exit(1)
+
+    # Report the median of each measurement
+    median = lambda key: sorted([r[key] for r in results])[len(results)//2]
+    print('Server startup over {} runs (median)'.format(runs))
+    print('  import time:  {:.1f}ms'.format(median('import')*1000))
+    print('  startup time: {:.1f}ms'.format(median('startup')*1000))
+    # ru_maxrss is in bytes on macOS, and in kilobytes elsewhere
+    rss = median('rss') / (1024 if sys.platform == 'darwin' else 1)
+    print('  peak RSS:     {:.1f}MB'.format(rss/1024))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,62 @@
+"""
+checktiles.py
+A check that the single tile lookups used for pathfinding match the generated world
+Generates a TileMap around a few centres and compares every tile in it against getTileAt
+Fails on the first tile which differs
+
+Usage:
+python3 checktiles.py [--centres 0,0;12.6,-40.3] [--dimension 0]
+"""
+# Import the Python standard libraries
+import sys
+
+# Import the game's modules
+import util
+import game
+
+# The offset from the centre of the generated TileMap to the map index of the centre tile
+MAP_OFFSET = (75, 45)
+
+def checkTiles(chunkProvider, centre, gameRegistry):
+    """
+    Generate a TileMap around a centre, and assert that getTileAt agrees with every tile in it
+    """
+    tileMap = chunkProvider.generate(centre, gameRegistry)
+
+    for y, row in enumerate(tileMap.map):
+        for x, tile in enumerate(row):
+            # Find a world position which the renderer draws at this map index, away from the tile edges
+            offset = [x - MAP_OFFSET[0], y - MAP_OFFSET[1]]
+            pos = [centre[a] + offset[a] + (0.5 if offset[a] >= 0 else -0.5) for a in (0, 1)]
+
+            lookup = chunkProvider.getTileAt(pos, gameRegistry, centre)
+            assert type(lookup) == type(tile) and (lookup.tileIndex, lookup.plantIndex) == (tile.tileIndex, tile.plantIndex), \
+                'getTileAt({}) around {} gave {} {}, but the TileMap has {} {} at [{}, {}]'.format(
+                    pos, centre, type(lookup).__name__, (lookup.tileIndex, lookup.plantIndex),
+                    type(tile).__name__, (tile.tileIndex, tile.plantIndex), x, y)
+
+def main(args):
+    centres = [[0, 0], [12.6, -40.3], [-250.4, 97.5]]
+    dimensionId = 0
+    i = 0
+    while i < len(args):
+        if args[i] == '--centres' and i != len(args)-1:
+            centres = [[float(b) for b in a.split(',')] for a in args[i+1].split(';')]
+            i += 1
+        elif args[i] == '--dimension' and i != len(args)-1:
+            dimensionId = int(args[i+1])
+            i += 1
+        else:
+            print('[WARNING] Unknown argument: {}'.format(args[i]))
+        i += 1
+
+    server = game.Game(util.ArgumentHandler(['--mode', 'SERVER', '--disableNetwork', '--disablePersistence']))
+    gameRegistry = server.modLoader.gameRegistry
+    chunkProvider = server.getDimension(dimensionId).chunkProvider
+
+    for centre in centres:
+        checkTiles(chunkProvider, centre, gameRegistry)
+    print('[INFO] getTileAt matches the generated TileMap around {} centres'.format(len(centres)))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
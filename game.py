@@ -10,25 +10,38 @@ import socket
 import sys
 import os
 
-if 'SERVER' not in sys.argv:
-    import pygame
-    pygame.init()
-    from api.gui.gui import GUIState
-
 # Import the game's modules
 import util
 import mod
 from api.entity import Player
-from api import network
+from api import network, persistence
 from api.packets import *
 
+def loadClientLibraries():
+    """
+    Import pygame and the gui module, which only the client needs
+    A dedicated server never imports them, so it runs without SDL
+    """
+    global pygame, GUIState
+    import pygame
+    pygame.init()
+    from api.gui.gui import GUIState
+
 class Game:
     """
     A class to hold all of the elements of the game together
     """
-    def __init__(self, argHandler):
+    def __init__(self, argHandler, localPipe=None):
+        # Load the rendering libraries before any client side mods are registered
+        if argHandler.getRuntimeType() != util.SERVER:
+            loadClientLibraries()
+
         # Initialise the child process value
         self.child = None
+        # Initialise the local transport to the parent process, if forked from one
+        self.localTransport = None
+        if localPipe:
+            self.localTransport = network.LocalTransport(localPipe)
         #Initilise the port handling variable
         self.lastUsedPort = util.DEFAULT_PORT
 
@@ -44,8 +57,24 @@ class Game:
         # Load all of the registered mods
         self.modLoader.loadRegisteredMods()
 
+        # Load the saved worlds, and keep saving them from now on (SERVER-SIDE)
+        self.persistence = None
+        if self.args.getRuntimeType() == util.SERVER and self.args.getPersistenceEnabled():
+            self.persistence = persistence.WorldPersistence(self)
+            self.persistence.recover()
+
+        # Open the packet capture if requested
+        self.capture = None
+        if self.args.getCaptureFile():
+            self.capture = network.PacketCapture(self.args.getCaptureFile())
+
         # Create a default packetPipeline for the game instance
-        self.packetPipeline = network.GamePacketHandler(self, self.args.getRuntimeType())
+        self.packetPipeline = network.GamePacketHandler(self, self.args.getRuntimeType(),
+                                                        self.capture, self.args.getNetworkEnabled())
+
+        # Start the local transport now that all PacketHandlers are registered to it
+        if self.localTransport:
+            self.localTransport.start()
 
         if self.args.getRuntimeType() != util.SERVER:
             # Set the world and player up
@@ -65,6 +94,14 @@ class Game:
         """
         Safely disconnect all players, unload the mods and quit the game
         """
+        # Finish writing the packet capture
+        if self.capture:
+            self.capture.close()
+
+        # Write the last changes to the saved worlds
+        if self.persistence:
+            self.persistence.close()
+
         # Terminate the child server process if running a combined game
         if self.child:
             # Ask the process to die nicely...
@@ -86,93 +123,113 @@ class Game:
         self.fireEvent('onGameLaunch')
         self.tick = 0
         self.deltaTime = 0
+        self.tickTime = 0
+
+        # Open the tick time log if requested
+        tickLog = None
+        if self.args.getTickLog():
+            tickLog = open(self.args.getTickLog(), 'w', buffering=1)
         # Run at 30 ticks per second
         while True:
-            self.tick += 1
             # Get the start time of the tick
             startTickTime = time.time()
 
-            # Tick the world object
-            for d in self.modLoader.gameRegistry.dimensions.keys():
-                world = self.getWorld(d)
-                if world and self.args.getRuntimeType() == util.SERVER:
-                    # If there are players in the world, update the world every tick
-                    if world.players:
-                        world.tickUpdate(self)
-                    elif (self.tick+d)%(5*util.FPS) == True:
-                        # Fuzzy/slow logic if there are no players inside
-                        world.tickUpdate(self)
-
-            # Trigger all of the onTick events
-            self.fireEvent('onTick', self.deltaTime, self.tick)
-
-            # If running a client side game then do some extra things
-            if self.args.getRuntimeType() != util.SERVER:
-                # Check for dimension change
-                if self.dimensionId != self.player.dimension:
-                    self.fireEvent('onDimensionChange', self.player, self.player.dimension, dimensionId)
-                    self.dimensionId = self.player.dimension
-                    self.world = self.getWorld(self.player.dimension)
-
-                # Get the mouse position
-                pos = pygame.mouse.get_pos()
-
-                # Draw the client game
-                self.drawClientGame(pos)
-
-                # Handle the pygame events
-                for event in pygame.event.get():
-                    if event.type == pygame.QUIT:
-                        self.quit()
-
-                    elif self.getGui():
-                        if event.type == pygame.VIDEORESIZE:
-                            oldSurface = pygame.display.get_surface().copy()
-                            width = min(max(400, event.w), 65535)
-                            height = min(max(300, event.h), 49151)
-                            pygame.display.set_mode((width, height), util.DISPLAY_FLAGS)
-                            pygame.display.get_surface().blit(oldSurface, [0, 0])
-                            pygame.display.flip()
-                            # Fire an onResize call to rescale the gui
-                            self.currentGUIState.onResize(pygame.display.get_surface())
-
-                        elif event.type == pygame.KEYDOWN:
-                            # Handle a keypress on the gui
-                            if self.getGui()[1].currentTextBox is not None:
-                                self.getGui()[1].textboxes[self.getGui()[1].currentTextBox].doKeyPress(event)
-                            self.getGui()[1].doKeyPress(event)
-                            # If the keypress is not applicable to the gui, revert to the overlays
-                            for i, overlay in enumerate(self.getOverlays()):
-                                self.getOverlays()[i][1].doKeyPress(event)
-
-                            # Finally, trigger any registered event functions
-                            self.fireEvent('onKeyPress', event)
-
-                        elif event.type == pygame.MOUSEBUTTONDOWN:
-                            pressed = pygame.mouse.get_pressed()
-                            # Handle a mouse click on buttons
-                            if self.getGUIState() and pressed[0]:
-                                for button in self.getGUIState().getButtons():
-                                    if button.isHovered(pos) and button.enabled:
-                                        button.onClick(self)
-
-                            # Then, handle a mouse click on a text box
-                            if self.getGui() and pressed[0]:
-                                self.getGui()[1].currentTextBox = None
-                                for t, textbox in enumerate(self.getGui()[1].textboxes):
-                                    if textbox.isHovered(pos):
-                                        self.getGui()[1].currentTextBox = t
-
-                            # Finally, trigger any registered event functions
-                            self.fireEvent('onMouseClick', pos, pressed, event)
+            self.tickGame()
 
             # Get the time that the tick took to run
             self.deltaTime = time.time()-startTickTime
+            self.tickTime = self.deltaTime
+            if tickLog:
+                tickLog.write('{:.3f} {:.3f}\n'.format(startTickTime, self.tickTime*1000))
             # Sleep if running faster than preset tps/fps
             if self.deltaTime < 1/util.FPS:
                 time.sleep((1/util.FPS)-self.deltaTime)
                 self.deltaTime = 1/util.FPS
 
+    def tickGame(self):
+        """
+        Run the logic for a single tick of the game
+        """
+        self.tick += 1
+
+        # Tick the world object
+        for d in self.modLoader.gameRegistry.dimensions.keys():
+            world = self.getWorld(d)
+            if world and self.args.getRuntimeType() == util.SERVER:
+                # If there are players in the world, update the world every tick
+                if world.players:
+                    world.tickUpdate(self)
+                elif (self.tick+d)%(5*util.FPS) == True:
+                    # Fuzzy/slow logic if there are no players inside
+                    world.tickUpdate(self)
+
+        # Journal the changes to the worlds, and continue any snapshot being saved
+        if self.persistence:
+            self.persistence.tick(self.tick)
+
+        # Trigger all of the onTick events
+        self.fireEvent('onTick', self.deltaTime, self.tick)
+
+        # If running a client side game then do some extra things
+        if self.args.getRuntimeType() != util.SERVER:
+            # Check for dimension change
+            if self.dimensionId != self.player.dimension:
+                self.fireEvent('onDimensionChange', self.player, self.player.dimension, dimensionId)
+                self.dimensionId = self.player.dimension
+                self.world = self.getWorld(self.player.dimension)
+
+            # Get the mouse position
+            pos = pygame.mouse.get_pos()
+
+            # Draw the client game
+            self.drawClientGame(pos)
+
+            # Handle the pygame events
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    self.quit()
+
+                elif self.getGui():
+                    if event.type == pygame.VIDEORESIZE:
+                        oldSurface = pygame.display.get_surface().copy()
+                        width = min(max(400, event.w), 65535)
+                        height = min(max(300, event.h), 49151)
+                        pygame.display.set_mode((width, height), util.getDisplayFlags())
+                        pygame.display.get_surface().blit(oldSurface, [0, 0])
+                        pygame.display.flip()
+                        # Fire an onResize call to rescale the gui
+                        self.currentGUIState.onResize(pygame.display.get_surface())
+
+                    elif event.type == pygame.KEYDOWN:
+                        # Handle a keypress on the gui
+                        if self.getGui()[1].currentTextBox is not None:
+                            self.getGui()[1].textboxes[self.getGui()[1].currentTextBox].doKeyPress(event)
+                        self.getGui()[1].doKeyPress(event)
+                        # If the keypress is not applicable to the gui, revert to the overlays
+                        for i, overlay in enumerate(self.getOverlays()):
+                            self.getOverlays()[i][1].doKeyPress(event)
+
+                        # Finally, trigger any registered event functions
+                        self.fireEvent('onKeyPress', event)
+
+                    elif event.type == pygame.MOUSEBUTTONDOWN:
+                        pressed = pygame.mouse.get_pressed()
+                        # Handle a mouse click on buttons
+                        if self.getGUIState() and pressed[0]:
+                            for button in self.getGUIState().getButtons():
+                                if button.isHovered(pos) and button.enabled:
+                                    button.onClick(self)
+
+                        # Then, handle a mouse click on a text box
+                        if self.getGui() and pressed[0]:
+                            self.getGui()[1].currentTextBox = None
+                            for t, textbox in enumerate(self.getGui()[1].textboxes):
+                                if textbox.isHovered(pos):
+                                    self.getGui()[1].currentTextBox = t
+
+                        # Finally, trigger any registered event functions
+                        self.fireEvent('onMouseClick', pos, pressed, event)
+
     def drawClientGame(self, pos):
         """
         Draw the game to the pygame display
@@ -358,7 +415,7 @@ class Game:
         """
         Connect the default pipeline to the server
         """
-        self.packetPipeline.connectToServer(address)
+        return self.packetPipeline.connectToServer(address)
 
     def getOpenPort(self):
         """
@@ -401,11 +458,15 @@ class Game:
 
         if argHandler.getRuntimeType() == util.COMBINED:
             # Fork a new Server process, then set to connect to it immediately
-            serverProcess = multiprocessing.Process(target=forkServer, args=(argHandler,))
+            # Connections to it go over a pipe rather than the network stack
+            localPipe, childPipe = multiprocessing.Pipe()
+            serverProcess = multiprocessing.Process(target=forkServer, args=(argHandler, childPipe))
             serverProcess.daemon = True
             self.child = serverProcess
             serverProcess.start()
 
+            self.localTransport = network.LocalTransport(localPipe)
+
             argHandler.results['address'] = socket.getfqdn()
 
         # Set the world generation seed
@@ -417,10 +478,10 @@ class Game:
                                                  util.COMBINED : 'COMBINED'
                                                 }[argHandler.getRuntimeType()]))
 
-def forkServer(argHandler):
+def forkServer(argHandler, localPipe):
     """
     Fork a new process to run the server in the background
     """
     argHandler.results['runtimeType'] = util.SERVER
-    serverRuntime = Game(argHandler)
+    serverRuntime = Game(argHandler, localPipe)
     serverRuntime.run()
@@ -0,0 +1,313 @@
+"""
+loadtest.py
+A headless load testing tool for the dedicated server
+Spawns simulated players against a local server process and reports
+server tick time, round trip latency and bandwidth as the player count grows
+
+Usage:
+python3 loadtest.py [--players 1,5,10,25] [--duration 20] [--address localhost] [--noServer]
+"""
+# Import the Python standard libraries
+import sys
+import os
+import time
+import math
+import random
+import subprocess
+import tempfile
+from threading import Lock
+
+# Import the game's modules
+import util
+import mod
+from api import network
+from api.packets import *
+from api.entity import Player
+from mods.default.packets import SendInventoryPacket, FetchInventoryPacket, EndTradePacket
+from mods.default.items import Sword
+
+# The rate the bots run at, in ticks per second
+BOT_TPS = 20
+
+class BotStats:
+    """
+    A thread-safe store for the measurements taken by the bots
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.rtts = []
+        self.disconnects = 0
+
+    def recordRtt(self, rtt):
+        with self.lock:
+            self.rtts.append(rtt)
+
+    def recordDisconnect(self):
+        with self.lock:
+            self.disconnects += 1
+
+    def reset(self):
+        """
+        Clear the measurements and return the old ones
+        """
+        with self.lock:
+            rtts, self.rtts = self.rtts, []
+            disconnects, self.disconnects = self.disconnects, 0
+        return rtts, disconnects
+
+class BotDimension:
+    """
+    Stands in for the client dimension, as bots never generate a world
+    """
+    def __init__(self):
+        self.biomeSize = 0
+
+class BotGame:
+    """
+    A headless stand-in for the client Game object
+    It holds just enough for the packet handlers to run
+    """
+    def __init__(self, name, stats):
+        self.stats = stats
+        self.localTransport = None
+        self.world = None
+        self.dimension = BotDimension()
+        self.loggedIn = False
+
+        self.player = Player()
+        self.player.setUsername(name)
+
+        # Register a channel with the same name as ClientMod's, so the channel id matches the server
+        self.modLoader = mod.ModLoader(self)
+        self.channel = network.PacketChannel(self, util.CLIENT, 'default')
+        for packet in [SendInventoryPacket, FetchInventoryPacket, EndTradePacket]:
+            self.channel.registerPacket(packet)
+        self.modLoader.gameRegistry.registerPacketHandler(self.channel)
+        # Register the weapon the bots attack with, so it is sent with the server's item id
+        self.modLoader.gameRegistry.registerItem(Sword)
+
+        self.packetPipeline = network.GamePacketHandler(self, util.CLIENT)
+
+        # Initialise the behaviour timers and state
+        self.pings = {}
+        self.pingSeq = 0
+        self.direction = random.random()*2*math.pi
+        self.timers = {'ping' : random.random(), 'chat' : random.random()*5,
+                       'attack' : random.random()*2, 'trade' : random.random()*10}
+        self.tradePartner = None
+
+    def connect(self, address):
+        """
+        Connect and log in to the server
+        """
+        return self.packetPipeline.connectToServer(address)
+
+    def disconnect(self):
+        """
+        Log out of the server
+        """
+        self.packetPipeline.sendToServer(DisconnectPacket())
+        self.packetPipeline.closeConnection()
+
+    def getTraffic(self):
+        """
+        Return the total number of bytes sent and received by this bot
+        """
+        return sum([c.bytesSent + c.bytesReceived for c in list(self.packetPipeline.connections.values())])
+
+    def fireEvent(self, eventType, *args):
+        if eventType == 'onPlayerLogin':
+            self.loggedIn = True
+        elif eventType == 'onDisconnect':
+            self.loggedIn = False
+            self.stats.recordDisconnect()
+
+    def fireCommand(self, text, username):
+        # Look for the echo of a latency ping
+        words = text.split()
+        if 'ping' in words[:-1]:
+            seq = int(words[words.index('ping')+1])
+            sent = self.pings.pop(seq, None)
+            if sent:
+                self.stats.recordRtt(time.time()-sent)
+
+    def getPlayer(self, username):
+        if isinstance(username, Player):
+            username = username.name
+        return self.player if username == self.player.name else None
+
+    def getEntity(self, uuid):
+        return None
+
+    def getDimension(self, dimensionId):
+        return self.dimension
+
+    def tick(self, deltaTime, others):
+        """
+        Run the bot behaviour for a tick
+        """
+        if not self.loggedIn:
+            return
+        pp = self.packetPipeline
+        for timer in self.timers:
+            self.timers[timer] -= deltaTime
+
+        # Walk in a slowly changing direction, just under full speed
+        self.direction += random.uniform(-0.3, 0.3)
+        distance = self.player.speed*deltaTime*0.8
+        pos = [self.player.pos[0] + distance*math.cos(self.direction),
+               self.player.pos[1] + distance*math.sin(self.direction)]
+        self.player.setPos(pos)
+        sequence, displacement = self.player.takeMove()
+        velocity = [a/deltaTime for a in displacement]
+        pp.sendToServer(SyncPlayerPacket(self.player.pendingMoves, velocity, self.player.dimension), True)
+
+        # Message ourselves to measure the round trip time
+        if self.timers['ping'] <= 0:
+            self.timers['ping'] += 1
+            self.pingSeq += 1
+            self.pings[self.pingSeq] = time.time()
+            pp.sendToServer(SendCommandPacket('/message {} ping {}'.format(self.player.name, self.pingSeq)))
+
+        # Chat to the players nearby
+        if self.timers['chat'] <= 0:
+            self.timers['chat'] += 5
+            pp.sendToServer(SendCommandPacket('/message local Hello from ' + self.player.name))
+
+        # Swing a sword at anything nearby
+        if self.timers['attack'] <= 0:
+            self.timers['attack'] += 2
+            pp.sendToServer(AttackPacket(self.player, Sword()))
+
+        # Request a trade with another bot, which accepts and then cancels it
+        if self.timers['trade'] <= 0:
+            self.timers['trade'] += 10
+            if self.tradePartner:
+                self.channel.sendToServer(EndTradePacket())
+                self.tradePartner = None
+            elif others:
+                partner = random.choice(others)
+                if partner is not self and partner.loggedIn and not partner.tradePartner:
+                    pp.sendToServer(SendCommandPacket('/trade ' + partner.player.name))
+                    partner.packetPipeline.sendToServer(SendCommandPacket('/trade accept'))
+                    partner.tradePartner = self.player.name
+                    partner.timers['trade'] = 2
+
+def percentile(values, p):
+    """
+    Return the pth percentile of a list of values
+    """
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values)-1, int(len(values)*p/100))]
+
+def readTickTimes(path, start, end):
+    """
+    Read the server tick times (in ms) logged between two timestamps
+    """
+    times = []
+    try:
+        for line in open(path):
+            try:
+                tickStart, tickTime = [float(a) for a in line.split()]
+            except ValueError:
+                continue
+            if start <= tickStart < end:
+                times.append(tickTime)
+    except FileNotFoundError:
+        pass
+    return times
+
+def runBots(bots, duration):
+    """
+    Tick all of the bots for a given number of seconds
+    """
+    end = time.time() + duration
+    lastTick = time.time()
+    while time.time() < end:
+        now = time.time()
+        for bot in bots:
+            bot.tick(now-lastTick, bots)
+        lastTick = now
+        time.sleep(max(0, 1/BOT_TPS - (time.time()-now)))
+
+def main(args):
+    # Handle the command line arguments
+    levels = [1, 5, 10, 25]
+    duration = 20
+    address = 'localhost'
+    startServer = True
+    i = 0
+    while i < len(args):
+        if args[i] == '--players' and i != len(args)-1:
+            levels = [int(a) for a in args[i+1].split(',')]
+            i += 1
+        elif args[i] == '--duration' and i != len(args)-1:
+            duration = float(args[i+1])
+            i += 1
+        elif args[i] == '--address' and i != len(args)-1:
+            address = args[i+1]
+            i += 1
+        elif args[i] == '--noServer':
+            startServer = False
+        else:
+            print('[WARNING] Unknown argument: {}'.format(args[i]))
+        i += 1
+
+    # Start a dedicated server which logs its tick times
+    server = None
+    tickLog = os.path.join(tempfile.gettempdir(), 'loadtest_ticks.log')
+    if startServer:
+        server = subprocess.Popen([sys.executable, 'main.py', '--mode', 'SERVER', '--tickLog', tickLog],
+                                  stdout=subprocess.DEVNULL)
+        time.sleep(5)
+
+    stats = BotStats()
+    bots = []
+    results = []
+    try:
+        for level in levels:
+            # Connect more bots to reach the next player count
+            while len(bots) < level:
+                bot = BotGame('bot{}'.format(len(bots)+1), stats)
+                error = bot.connect(address)
+                if error:
+                    print('[ERROR] Bot failed to connect: ' + error)
+                    return
+                bots.append(bot)
+                time.sleep(0.05)
+
+            # Let the logins settle, then measure
+            runBots(bots, 2)
+            stats.reset()
+            trafficStart = sum([b.getTraffic() for b in bots])
+            start = time.time()
+            runBots(bots, duration)
+            end = time.time()
+
+            rtts, disconnects = stats.reset()
+            rtts = [a*1000 for a in rtts]
+            ticks = readTickTimes(tickLog, start, end)
+            traffic = sum([b.getTraffic() for b in bots]) - trafficStart
+
+            results.append([level, percentile(ticks, 50), percentile(ticks, 99),
+                            percentile(rtts, 50), percentile(rtts, 95), percentile(rtts, 99),
+                            traffic/level/(end-start), disconnects])
+            print('Measured {} players'.format(level))
+
+    finally:
+        for bot in bots:
+            bot.disconnect()
+        if server:
+            server.terminate()
+
+    # Print the results table
+    print()
+    print('{:>8} {:>10} {:>10} {:>9} {:>9} {:>9} {:>12} {:>6}'.format('players', 'tick p50', 'tick p99',
+          'rtt p50', 'rtt p95', 'rtt p99', 'B/s/player', 'drops'))
+    for row in results:
+        print('{:>8} {:>8.2f}ms {:>8.2f}ms {:>7.1f}ms {:>7.1f}ms {:>7.1f}ms {:>12.0f} {:>6}'.format(*row))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
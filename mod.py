@@ -4,14 +4,28 @@ Module containing the Mod loading and Mod API code for the game
 """
 # Import the Python3 standard libraries
 import os
-import sys
 import importlib
+import ast
+import json
 
 from api.cmd import FailedCommand, MessageCommand
 from api.entity import Pickup
+from api.item import NullItem
 
-# Initialise the separator for directories
-dir_sep = '/' if sys.platform != 'win32' else '\\'
+# The cache of the classes defined in each mod file
+MOD_INDEX_FILE = os.path.join('mods', '.modindex.json')
+
+def getClassNames(path):
+    """
+    Return the names of the top level classes defined in a python file, without importing it
+    """
+    try:
+        with open(path, 'rb') as f:
+            tree = ast.parse(f.read(), path)
+    except (SyntaxError, ValueError):
+        print('[WARNING] Unable to parse mod file '+path)
+        return []
+    return [node.name for node in tree.body if isinstance(node, ast.ClassDef)]
 
 class ModLoader:
     def __init__(self, game):
@@ -19,6 +33,7 @@ class ModLoader:
         self.mods = {}
         self.game = game
         self.gameRegistry = GameRegistry()
+        self.modIndex = None
 
         self.entityCounter = 0
 
@@ -32,33 +47,69 @@ class ModLoader:
         # Hash and set the uuid
         return hash(entity.name+str(self.entityCounter)) & 0xffffffffffffffff
 
-    def registerModByName(self, name, subfolders=''):
+    def getModIndex(self):
         """
-        Recursively traverse the mod folder for a mod with the given mod name, and load it
+        Return a dictionary of class names to the mod modules that define them
+        The index is built by parsing the source, so no mod modules are imported
+        Each file is only parsed again when its modification time changes
         """
+        if self.modIndex is not None:
+            return self.modIndex
+
+        # Load the cached index from the last run
+        try:
+            with open(MOD_INDEX_FILE) as f:
+                cachedFiles = json.load(f).get('files', {})
+        except (OSError, ValueError):
+            cachedFiles = {}
+
         # Traverse the python files in the mod folder
-        for filename in os.listdir('mods'+subfolders):
-            if filename.endswith('.py'):
-                module = importlib.import_module(('mods' + subfolders + '.').replace(dir_sep, '.') + filename[:-3])
-                # Check if the mod class is in the file
-                if name in dir(module):
-                    modClass = module.__getattribute__(name)
-                    # Register it normally if it is
-                    self.registerMod(modClass)
-                    return 'found'
-
-            # Check if its a directory, and recurse as required
-            elif '.' not in filename and '__' not in filename:
-                try:
-                    open('mods' + subfolders + dir_sep + filename, 'r').close()
-                except:
-                    try:
-                        result = self.registerModByName(name, subfolders+dir_sep+filename)
-                        return result
-                    except FileNotFoundError:
-                        pass
-                    except RuntimeError:
-                        pass
+        files = {}
+        for dirpath, dirnames, filenames in os.walk('mods'):
+            dirnames[:] = sorted([d for d in dirnames if '.' not in d and '__' not in d])
+            for filename in sorted(filenames):
+                if not filename.endswith('.py'):
+                    continue
+                path = os.path.join(dirpath, filename)
+                mtime = os.path.getmtime(path)
+
+                # Reuse the cached entry if the file hasn't changed
+                entry = cachedFiles.get(path)
+                if entry is None or entry.get('mtime') != mtime:
+                    entry = {'mtime' : mtime,
+                             'module' : path[:-3].replace(os.sep, '.'),
+                             'classes' : getClassNames(path)}
+                files[path] = entry
+
+        # Save the index for the next run
+        if files != cachedFiles:
+            try:
+                with open(MOD_INDEX_FILE+'.tmp', 'w') as f:
+                    json.dump({'files' : files}, f)
+                os.replace(MOD_INDEX_FILE+'.tmp', MOD_INDEX_FILE)
+            except OSError:
+                print('[WARNING] Unable to save the mod index to '+MOD_INDEX_FILE)
+
+        # Map the class names to the modules they are defined in
+        self.modIndex = {}
+        for path in sorted(files):
+            for className in files[path]['classes']:
+                self.modIndex[className] = self.modIndex.get(className, [])+[files[path]['module']]
+        return self.modIndex
+
+    def registerModByName(self, name):
+        """
+        Find the mod class with the given name in the mod folder, and load it
+        Only the module defining the class is imported
+        """
+        for moduleName in self.getModIndex().get(name, []):
+            module = importlib.import_module(moduleName)
+            modClass = getattr(module, name, None)
+            # Register it if it is actually a mod
+            if isinstance(modClass, type) and issubclass(modClass, Mod):
+                self.registerMod(modClass)
+                return 'found'
+
         # Error if the mod doesn't exist
         raise FileNotFoundError('Mod file not found in \'mods\' folder')
 
@@ -95,6 +146,9 @@ class GameRegistry:
                          'Pickup' : Pickup,
                         }
         self.items = {}
+        # Map the item ids sent over the network to the item classes, and the stateless item classes to a shared instance
+        self.itemClasses = {}
+        self.itemInstances = {}
         self.guis = {}
         self.dimensions = {}
         self.vehicles = {}
@@ -107,18 +161,59 @@ class GameRegistry:
         self.resources = {}
         self.EVENT_BUS = {}
         self.properties = {}
+        self.updateRelevance = {}
         self.seed = 0
 
     def registerItem(self, itemClass):
         """
-        Register an item
+        Register an item, and give it the next free item id
         """
         tempItem = itemClass()
         if self.items.get(tempItem.getRegistryName()) is None:
             self.items[tempItem.getRegistryName()] = itemClass
+            itemClass.itemId = max(self.itemClasses.keys(), default=0)+1
+            self.itemClasses[itemClass.itemId] = itemClass
             return
         raise KeyError('[ERROR] Registry name {} already in use by another item!'.format(tempItem.getRegistryName()))
 
+    def getItemNames(self):
+        """
+        Return the registry names of the items, in the order of their ids
+        """
+        classNames = {itemClass : name for name, itemClass in self.items.items()}
+        names = ['']*max(self.itemClasses.keys(), default=0)
+        for itemId, itemClass in self.itemClasses.items():
+            names[itemId-1] = classNames[itemClass]
+        return names
+
+    def setItemIds(self, names):
+        """
+        Renumber the items to match a list of registry names, ordered by id (such as the server's list)
+        Items missing from the list are numbered after it, and names with no matching item decode as empty
+        """
+        self.itemClasses = {}
+        for i, name in enumerate(names):
+            if name in self.items:
+                self.items[name].itemId = i+1
+                self.itemClasses[i+1] = self.items[name]
+        for name, itemClass in self.items.items():
+            if name not in names:
+                itemClass.itemId = max(len(names), max(self.itemClasses.keys(), default=0))+1
+                self.itemClasses[itemClass.itemId] = itemClass
+
+    def getItem(self, itemId):
+        """
+        Return an item for a given item id, which is shared between stacks if the item is stateless
+        """
+        itemClass = self.itemClasses.get(itemId)
+        if itemClass is None:
+            return NullItem()
+        if not itemClass.stateless:
+            return itemClass()
+        if itemClass not in self.itemInstances:
+            self.itemInstances[itemClass] = itemClass()
+        return self.itemInstances[itemClass]
+
     def registerEntity(self, entityClass):
         """
         Register an entity
@@ -183,6 +278,12 @@ class GameRegistry:
         """
         Register a packet handler and any assosciated packets
         """
+        # Packet channels are told apart by an id derived from their name, so no two may share an id
+        channelId = getattr(packetHandler, 'channelId', 0)
+        for pipeline in self.packetPipelines.values():
+            if channelId and getattr(pipeline, 'channelId', 0) == channelId:
+                raise KeyError('[ERROR] Packet channel {} has the same id as packet channel {}, so one must be renamed'.format(packetHandler.name, pipeline.name))
+
         self.packetPipelines[len(self.packetPipelines)] = packetHandler
         return len(self.packetPipelines)-1
 
@@ -192,6 +293,13 @@ class GameRegistry:
         """
         self.properties[objectType] = self.properties.get(objectType, [])+[propertyObj]
 
+    def registerUpdateRelevance(self, relevanceFunction, objectType):
+        """
+        Register a function returning how many world updates per second a client needs for an object
+        objectType is one of 'Player', 'Entity' or 'Vehicle'
+        """
+        self.updateRelevance[objectType] = relevanceFunction
+
 class Mod:
     modName = 'Mod'
 
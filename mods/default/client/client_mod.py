@@ -22,7 +22,8 @@ class ClientMod(Mod):
     modName = 'ClientMod'
 
     def preLoad(self):
-        self.oldPlayerPos = [0, 0]
+        # The velocity of the player last sent to the server
+        self.playerVelocity = [0, 0]
         self.genLock = False
         self.chatMessages = {"global" : [], "faction" : []}
         self.latestChatTabs = []
@@ -30,7 +31,7 @@ class ClientMod(Mod):
         self.worldUpdateProperty = properties.Property(newPos=[0, 0], updateTick=0)
 
         # Initialise the display
-        pygame.display.set_mode((1024, 768), util.DISPLAY_FLAGS)
+        pygame.display.set_mode((1024, 768), util.getDisplayFlags())
         pygame.display.set_caption('M.A.T.A: Medieval Attack-Trade-Alliance')
         # pygame.display.set_icon(pygame.image.load('resources/textures/icon.png').convert_alpha())
 
@@ -72,7 +73,7 @@ class ClientMod(Mod):
 
     def load(self):
         # Initialise the packet pipeline
-        self.packetPipeline = network.PacketHandler(self.game, util.CLIENT, self.game.getOpenPort())
+        self.packetPipeline = network.PacketChannel(self.game, util.CLIENT, 'default')
 
         # Register the valid packet classes
         packets = [
@@ -80,7 +81,8 @@ class ClientMod(Mod):
                     FetchInventoryPacket, SendPlayerImagePacket,
                     FetchPickupItem, SendPickupItem,
                     StartTradePacket, ConfirmTradePacket,
-                    EndTradePacket, RespondTradePacket
+                    EndTradePacket, RespondTradePacket,
+                    InventoryDeltaPacket
                   ]
         for packet in packets:
             self.packetPipeline.registerPacket(packet)
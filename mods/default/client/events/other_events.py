@@ -1,7 +1,6 @@
 from threading import Thread
 from multiprocessing import Process, Queue
 import pygame
-from copy import deepcopy
 import random
 import time
 
@@ -16,6 +15,9 @@ from mods.default.client.events.tick_events import genWorld, handleProcess
 from mods.default.items import *
 from mods.default.packets import *
 
+# The number of main inventory slots shown on the inventory screen, before the equipped slots
+GUI_MAIN_SLOTS = 16
+
 def onGameMouseClick(game, mousePos, pressed, event):
     """
     Event Hook: onMouseClick
@@ -175,6 +177,7 @@ def onInvMouseClick(game, mousePos, pressed, event):
         # moveItem needs to store the section of inventory, index of inv.itemSlots it is from, and the itemstack itself
         for s, slot in enumerate(gui[1].itemSlots):
             if slot.button.isHovered(mousePos):
+                gui[1].changedSlots.add(getInventorySlot(game.player.inventory, s))
                 # If the player has clicked on a slot in the inventory
                 if pressed[0]:
                     # LMB click
@@ -182,7 +185,7 @@ def onInvMouseClick(game, mousePos, pressed, event):
                     if gui[1].moveItem:
                         stack1, stack2 = gui[1].moveItem[2].add(slot.item)
                         # Place the carried item into the clicked slot
-                        section = 'main' if s < 16 else ['left', 'right', 'armour'][s-16]
+                        section = 'main' if s < GUI_MAIN_SLOTS else ['left', 'right', 'armour'][s-GUI_MAIN_SLOTS]
                         if section == 'main':
                             game.player.inventory.items['main'][s] = stack1
                         else:
@@ -202,7 +205,7 @@ def onInvMouseClick(game, mousePos, pressed, event):
                     else:
                         # If clicking on a filled spot, pickup the item
                         if slot.item.getRegistryName() != 'null_item':
-                            section = 'main' if s < 16 else ['left', 'right', 'armour'][s-16]
+                            section = 'main' if s < GUI_MAIN_SLOTS else ['left', 'right', 'armour'][s-GUI_MAIN_SLOTS]
                             gui[1].moveItem = [section, s, slot.item]
                             if section == 'main':
                                 game.player.inventory.items['main'][s] = ItemStack(NullItem(), 0)
@@ -212,7 +215,7 @@ def onInvMouseClick(game, mousePos, pressed, event):
                 elif pressed[2]:
                     # RMB click
                     # If carrying an itemstack
-                    section = 'main' if s < 16 else ['left', 'right', 'armour'][s-16]
+                    section = 'main' if s < GUI_MAIN_SLOTS else ['left', 'right', 'armour'][s-GUI_MAIN_SLOTS]
                     if gui[1].moveItem:
                         if gui[1].moveItem[2].stackSize == 1 and slot.item.getRegistryName() == 'null_item':
                             # Place the carried item into the clicked slot
@@ -267,6 +270,31 @@ def onInvMouseClick(game, mousePos, pressed, event):
                         if stack2 and stack2.getRegistryName() != 'null_item':
                             gui[1].moveItem = [section, s, stack2]
 
+        # Once the carried item has been put down, send the changed slots to the server
+        if not gui[1].moveItem and gui[1].changedSlots:
+            sendInventoryDelta(game, gui[1].changedSlots)
+            gui[1].changedSlots = set()
+
+def getInventorySlot(inventory, guiSlot):
+    """
+    Convert the index of a slot on the inventory screen to the numbered slot of the inventory
+    The screen numbers the equipped slots from GUI_MAIN_SLOTS, but the inventory numbers them from maxSize
+    """
+    if guiSlot < GUI_MAIN_SLOTS:
+        return guiSlot
+    return inventory.maxSize + guiSlot - GUI_MAIN_SLOTS
+
+
+def sendInventoryDelta(game, slots):
+    """
+    Send the contents of some changed inventory slots to the server
+    """
+    inventory = game.player.inventory
+    changes = [(s, inventory.getSlot(s)) for s in sorted(slots)]
+    game.getModInstance('ClientMod').packetPipeline.sendToServer(InventoryDeltaPacket(inventory.version, changes))
+    # The server moves its version on when it accepts the changes, so follow it
+    inventory.version += 1
+
 
 def onGameKeyPress(game, event):
     """
@@ -454,7 +482,7 @@ def onPlayerSync(game, player, oldPlayers):
 
             return
 
-    prop = deepcopy(game.getModInstance('ClientMod').worldUpdateProperty)
+    prop = game.getModInstance('ClientMod').worldUpdateProperty.copy()
     prop.newPos = player.pos
     player.setProperty('worldUpdate', prop)
     oldPlayers.append(player)
@@ -478,7 +506,7 @@ def onEntitySync(game, entity, entities):
 
             return
 
-    prop = deepcopy(game.getModInstance('ClientMod').worldUpdateProperty)
+    prop = game.getModInstance('ClientMod').worldUpdateProperty.copy()
     prop.newPos = entity.pos
     entity.setProperty('worldUpdate', prop)
     if isinstance(entity, Pickup):
@@ -515,7 +543,7 @@ def onVehicleSync(game, vehicle, vehicles):
 
             return
 
-    prop = deepcopy(game.getModInstance('ClientMod').worldUpdateProperty)
+    prop = game.getModInstance('ClientMod').worldUpdateProperty.copy()
     prop.newPos = vehicle.pos
     vehicle.setProperty('worldUpdate', prop)
     vehicles.append(vehicle)
@@ -162,18 +162,21 @@ def onTickSyncPlayer(game, deltaTime, tick):
     if game.getModInstance('ClientMod').packetPipeline.connections:
         # Sync player data back to the server periodically
         if tick%(util.FPS//20) == 0:
-            # Check if the player has moved
-            if game.player.pos != game.getModInstance('ClientMod').oldPlayerPos:
+            modInstance = game.getModInstance('ClientMod')
+            # Check if the player has moved, has just stopped moving, or has moves the server hasn't acknowledged
+            moved = game.player.sentPos is None or game.player.pos != game.player.sentPos
+            if moved or modInstance.playerVelocity != [0, 0] or game.player.pendingMoves:
                 game.player.synced = False
-                # Duplicate the player and set the position
-                image = game.player.smallImg
-                game.player.smallImg = None
-                playerCopy = deepcopy(game.player)
-                game.player.smallImg = image
-                # Store the current relative position in the mod instance for later comparison
-                game.getModInstance('ClientMod').oldPlayerPos = list(game.player.pos)
-                # Send the copy of the player object in the packet
-                game.packetPipeline.sendToServer(SyncPlayerPacket(playerCopy))
+                modInstance.playerVelocity = [0, 0]
+                if moved:
+                    # Take the move, keeping it to send again until the server acknowledges it
+                    sequence, displacement = game.player.takeMove()
+                    # Work out the velocity since the last check
+                    interval = deltaTime*(util.FPS//20) or 1
+                    modInstance.playerVelocity = [a/interval for a in displacement]
+                # Send just the unacknowledged moves, which are written out as they are sent
+                packet = SyncPlayerPacket(game.player.pendingMoves, modInstance.playerVelocity, game.player.dimension)
+                game.packetPipeline.sendToServer(packet, True)
 
                 game.player.synced = True
 
@@ -94,8 +94,7 @@ class PlayButton(Button):
         """
         Connect to the server, and handle errors as required in the background
         """
-        game.establishConnection(address)
-        error = game.getModInstance('ClientMod').packetPipeline.connectToServer(address)
+        error = game.establishConnection(address)
 
         # Display an error if it fails for any reason
         if error:
@@ -153,8 +152,10 @@ class BackButton(Button):
 
 class InvBackButton(BackButton):
     def onClick(self, game):
-        # Send the inv to the server to record rearrangements etc
-        game.getModInstance('ClientMod').packetPipeline.sendToServer(SendInventoryPacket(game.player.name, game.player.inventory))
+        # Rearrangements are sent as they are made, but an item still being carried has left the inventory,
+        # so fetch the server copy to put it back
+        if game.getGui()[1].moveItem:
+            game.getModInstance('ClientMod').packetPipeline.sendToServer(FetchInventoryPacket(game.player.name))
         super().onClick(game)
 
 class ResumeButton(Button):
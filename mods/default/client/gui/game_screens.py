@@ -227,6 +227,8 @@ class PlayerInventoryScreen(Gui):
 
         # Store the item being moved around the inventory
         self.moveItem = None
+        # Store the slots changed since the last delta was sent to the server
+        self.changedSlots = set()
 
         self.itemSlots = []
         # Make the slotsize accessible in the middle and foreground methods
@@ -57,3 +57,20 @@ class DefaultChunkProvider(ChunkProvider):
         print('Time taken: '+str(time.time()-start)+' seconds')
 
         return biomeMap
+
+    def getTileAt(self, pos, gameRegistry, centre=None):
+        # Find the noise position generate uses for this tile, in a TileMap centred on the given centre
+        # A tile is drawn at the map index int(pos-centre) + (75, 45), which samples the noise at
+        # round(centre) - (150, 105) plus that index. Without a centre, the tile's own position is used
+        if centre is None:
+            centre = pos
+        x, y = [round(centre[a]) + int(pos[a] - centre[a]) + (75, 45)[a] - (150, 105)[a] for a in (0, 1)]
+
+        # Use the same noise values as generate, but for a single position
+        tileNoise = noise.snoise2(x, y, 8, 1.4, 0.45, base=gameRegistry.seed)/2 + 0.5
+        biomeNoise = noise.snoise2(x, y, 7, 3, 0.6 - (self.biomeSize * 0.1), base=gameRegistry.seed/2)/2 + 0.5
+        detailNoise = (noise.snoise2(x, y, 2, 3, 0.02)**3)/2 + 0.5
+
+        tile = self.biomes[round(biomeNoise*(len(self.biomes)-1))]()
+        tile.setTileType(tileNoise, detailNoise, gameRegistry.resources)
+        return tile
@@ -6,6 +6,8 @@ from api.item import *
 from api import combat
 
 class Dirt(Item):
+    stateless = True
+
     def __init__(self):
         super().__init__()
         self.setRegistryName('Dirt')
@@ -15,6 +17,8 @@ class Dirt(Item):
         return 0.1
 
 class Gold(Item):
+    stateless = True
+
     def __init__(self):
         super().__init__()
         self.setRegistryName('Gold')
@@ -4,7 +4,23 @@ from api.entity import Player, Pickup
 
 import util
 
-from copy import deepcopy
+# The longest an inventory delta waits for the deltas sent before it to be applied, in seconds
+DELTA_ORDER_TIMEOUT = 0.5
+
+
+def writeInventories(buf, inv1, inv2):
+    """
+    Write the two inventories of a trade, with the length of the first in front so they can be split again
+    """
+    inv1 = inv1.toBytes()
+    buf.write(len(inv1).to_bytes(4, 'big') + inv1 + inv2.toBytes())
+
+def readInventories(data):
+    """
+    Split the encoded inventories of a trade
+    """
+    inv1Len = int.from_bytes(data[:4], 'big')
+    return data[4:4+inv1Len], data[4+inv1Len:]
 
 class ConfirmTradePacket(Packet):
     # Sent when the initiator is asking for confirmation
@@ -13,12 +29,10 @@ class ConfirmTradePacket(Packet):
         self.inv2 = inv2
 
     def toBytes(self, buf):
-        buf.write(self.inv1.toBytes())
-        buf.write(b'|||')
-        buf.write(self.inv2.toBytes())
+        writeInventories(buf, self.inv1, self.inv2)
 
     def fromBytes(self, data):
-        self.inv1, self.inv2 = data.split(b'|||')[:2]
+        self.inv1, self.inv2 = readInventories(data)
 
     def onReceive(self, connection, side, game):
         self.inv1 = Inventory.fromBytes(game, self.inv1)
@@ -57,13 +71,12 @@ class EndTradePacket(Packet):
         if not player:
             return
 
-        cleanProps = deepcopy(game.getModInstance('ServerMod').tradeStateProperty)
+        cleanProps = game.getModInstance('ServerMod').tradeStateProperty
 
         # Clear out the main player (keeping pending trade requests)
         props = player.getProperty('tradeState')
         otherPlayername = props.tradingWith
-        newProps = deepcopy(cleanProps)
-        newProps.requests = props.requests
+        newProps = cleanProps.copy(requests=props.requests)
         player.setProperty('tradeState', newProps)
 
         # Then clear out the other trading player
@@ -72,8 +85,7 @@ class EndTradePacket(Packet):
             return
 
         props = player.getProperty('tradeState')
-        newProps = deepcopy(cleanProps)
-        newProps.requests = props.requests
+        newProps = cleanProps.copy(requests=props.requests)
         player.setProperty('tradeState', newProps)
 
 class RespondTradePacket(Packet):
@@ -85,13 +97,11 @@ class RespondTradePacket(Packet):
 
     def toBytes(self, buf):
         buf.write(self.response.to_bytes(1, 'big'))
-        buf.write(self.inv1.toBytes())
-        buf.write(b'|||')
-        buf.write(self.inv2.toBytes())
+        writeInventories(buf, self.inv1, self.inv2)
 
     def fromBytes(self, data):
         self.response = bool(data[0])
-        self.inv1, self.inv2 = data[1:].split(b'|||')[:2]
+        self.inv1, self.inv2 = readInventories(data[1:])
 
     def onReceive(self, connection, side, game):
         self.inv1 = Inventory.fromBytes(game, self.inv1)
@@ -119,14 +129,17 @@ class RespondTradePacket(Packet):
             # If they accepted the trade, verify the inventories, then send them to the client
             if self.response:
                 # Hash and confirm the trading
-                givenInvsHash = Inventory.addInventory(self.inv1, self.inv2, True)[0].hashInv()
-                serverInvsHash = Inventory.addInventory(serverInv1, serverInv2, True)[0].hashInv()
+                givenInvsHash = Inventory.hashInventories(self.inv1, self.inv2)
+                serverInvsHash = Inventory.hashInventories(serverInv1, serverInv2)
 
                 if givenInvsHash == serverInvsHash:
                     # Get the other player in the trade and send the following packet to them
                     packet = RespondTradePacket(True, self.inv1, self.inv2)
                     game.getModInstance('ServerMod').packetPipeline.sendToPlayer(packet, player2.name)
 
+                    # Move the versions on, so the clients fetch the traded inventories before changing them
+                    self.inv1.version = serverInv1.version + 1
+                    self.inv2.version = serverInv2.version + 1
                     player.setInventory(self.inv1)
                     player2.setInventory(self.inv2)
 
@@ -250,16 +263,19 @@ class SendInventoryPacket(Packet):
 
     def toBytes(self, buf):
         buf.write(len(self.playername).to_bytes(1, 'big') + self.playername.encode())
+        buf.write(self.inventory.version.to_bytes(4, 'big'))
         buf.write(self.inventory.toBytes())
 
     def fromBytes(self, data):
         nameLen = data[0]
         self.playername = data[1:1 + nameLen].decode()
-        self.inventory = data[1 + nameLen:]
+        self.version = int.from_bytes(data[1 + nameLen:5 + nameLen], 'big')
+        self.inventory = data[5 + nameLen:]
 
     def onReceive(self, connection, side, game):
         # Decode and store the inventory in the client side player
         self.inventory = Inventory.fromBytes(game, self.inventory)
+        self.inventory.version = self.version
         if side != util.SERVER:
             # If the player has requested their own inventory, just set it and let them use it from there
             if game.player.name == self.playername:
@@ -286,8 +302,48 @@ class SendInventoryPacket(Packet):
                 return SendInventoryPacket(self.playername, serverPlayer.inventory)
             # Otherwise, accept it
             else:
+                self.inventory.version = serverPlayer.inventory.version + 1
                 serverPlayer.inventory = self.inventory
 
+class InventoryDeltaPacket(Packet):
+    # Sent by the client when items have been moved between the slots of its inventory
+    def __init__(self, version=0, changes=None):
+        self.version = version
+        self.changes = list(changes or [])
+
+    def toBytes(self, buf):
+        buf.write(self.version.to_bytes(4, 'big') + len(self.changes).to_bytes(1, 'big'))
+        for slot, stack in self.changes:
+            buf.write(slot.to_bytes(2, 'big') + stack.toBytes())
+
+    def fromBytes(self, data):
+        self.version = int.from_bytes(data[:4], 'big')
+        count = data[4]
+        data = data[5:]
+        # Leave the stacks encoded until the game is available to decode them
+        self.changes = []
+        for a in range(count):
+            stackLen = int.from_bytes(data[2:4], 'big')
+            self.changes.append((int.from_bytes(data[:2], 'big'), data[2:stackLen+6]))
+            data = data[stackLen+6:]
+
+    def onReceive(self, connection, side, game):
+        player = game.getPlayer(connection.username)
+        if not player:
+            return
+        changes = [(slot, ItemStack.fromBytes(game, stack)) for slot, stack in self.changes]
+
+        # Packets are handled on separate threads, so a delta may be handled before the ones sent just before it
+        # Wait for those to be applied first, so quick moves don't look out of date
+        with player.inventoryChanged:
+            player.inventoryChanged.wait_for(lambda: self.version <= player.getInventory().version, DELTA_ORDER_TIMEOUT)
+            inventory = player.getInventory()
+
+            # Resend the whole inventory if the client had an old copy, or tried to make an invalid change
+            if self.version != inventory.version or not inventory.applyDelta(changes):
+                return SendInventoryPacket(player.name, inventory)
+            player.inventoryChanged.notify_all()
+
 class FetchPlayerImagePacket(Packet):
     def __init__(self, player=None):
         self.player = player
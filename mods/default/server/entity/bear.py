@@ -6,6 +6,7 @@ from mods.default.items import Teeth
 import util
 
 from random import randint
+from math import floor
 
 class Bear(Entity):
     def __init__(self):
@@ -21,6 +22,8 @@ class AttackAITask(AITask):
     def __init__(self, entity):
         super().__init__(entity)
         self.cooldown = 0
+        self.path = None
+        self.pathGoal = None
 
     def shouldStartExecute(self, game):
         """
@@ -63,21 +66,33 @@ class AttackAITask(AITask):
         targetPos = target.pos
         distance = ((target.pos[0] - self.entity.pos[0])**2 + (target.pos[1] - self.entity.pos[1])**2)**0.5
 
-        # TODO Implement a proper path finding algorithm
-        # For now, just run in a straight line towards the player
-        velocity = self.entity.speed
-        try:
-            ratio = (velocity*deltaTime)/distance
-        except ZeroDivisionError:
-            ratio = 0
-
-        pos = [self.entity.pos[a] * (1 - ratio) + ratio * targetPos[a] for a in (0, 1)]
-        self.entity.pos = pos
+        # Run along a path around any obstacles to the player
+        self.entity.pursue(self.getWaypoint(game, targetPos), deltaTime)
 
         # If the entity is really close, ATTACK!
         if self.cooldown < 0 and distance <= 0.5:
             Teeth().calcDamage(game, self.entity.uuid, [target])
             self.cooldown = 3
 
+    def getWaypoint(self, game, targetPos):
+        """
+        Get the next position to run towards on the way to the target
+        """
+        # Find a new path when the target moves to another tile
+        goal = [floor(a) for a in targetPos]
+        if self.path is None or goal != self.pathGoal:
+            self.path = self.findPath(game, targetPos)
+            # Try again next tick if there wasn't a path (or time to search for one)
+            self.pathGoal = goal if self.path is not None else None
+
+        # Drop the waypoints that have been reached
+        while self.path and ((self.path[0][0]-self.entity.pos[0])**2 + (self.path[0][1]-self.entity.pos[1])**2) < 0.01:
+            self.path.pop(0)
+
+        # Run straight at the target on the last stretch, or if there is no path
+        if not self.path or len(self.path) == 1:
+            return targetPos
+        return self.path[0]
+
     def skipExecution(self, game, deltaTime):
         self.cooldown -= deltaTime
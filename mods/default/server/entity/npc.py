@@ -30,6 +30,7 @@ class WanderAITask(AITask):
         self.idleTime = 0
         self.range = wanderRange
         self.wanderTarget = entity.pos
+        self.path = None
 
     def shouldStartExecute(self, game):
         """
@@ -43,13 +44,19 @@ class WanderAITask(AITask):
         """
         return CONTINUE if self.walkTime >= 0 else END
 
-    def getWanderTarget(self):
-        displacement = [random.randint(-self.range, self.range) for a in (0, 1)]
-        self.wanderTarget = [self.entity.pos[a]+displacement[a] for a in (0, 1)]
+    def getWanderTarget(self, game):
+        pathFinder = game.getDimension(self.entity.dimension).getPathFinder(game.modLoader.gameRegistry)
+        # Try a few times to find a target that isn't in water or a tree
+        for attempt in range(5):
+            displacement = [random.randint(-self.range, self.range) for a in (0, 1)]
+            self.wanderTarget = [self.entity.pos[a]+displacement[a] for a in (0, 1)]
+            if pathFinder.isWalkable(self.wanderTarget):
+                break
 
     def startExecution(self, game):
         self.walkTime = random.randint(1, 5)
-        self.getWanderTarget()
+        self.getWanderTarget(game)
+        self.path = self.findPath(game, self.wanderTarget)
 
     def continueExecution(self, game, deltaTime):
         """
@@ -57,9 +64,14 @@ class WanderAITask(AITask):
         """
         self.walkTime -= deltaTime
 
-        # Calculate the walking velocity and apply the displacement to the entity position
-        velocity = [min((self.wanderTarget[a]-self.entity.pos[a])/self.walkTime, self.entity.speed) for a in (0, 1)]
-        self.entity.pos = [self.entity.pos[a]+velocity[a]*deltaTime for a in (0, 1)]
+        # Drop the waypoints that have been reached
+        while self.path and len(self.path) > 1 and sum([(self.path[0][a]-self.entity.pos[a])**2 for a in (0, 1)]) < 0.01:
+            self.path.pop(0)
+
+        # Walk along the path to the target (or straight at it, if there is no path),
+        # sharing the walk time between the waypoints left
+        waypoint = self.path[0] if self.path else self.wanderTarget
+        self.entity.wanderTo(waypoint, self.walkTime/len(self.path or [waypoint]), deltaTime)
 
     def endExecution(self, game):
         self.idleTime = random.randint(3, 20)
@@ -71,7 +83,6 @@ class GroupAITask(AITask):
     def __init__(self, entity):
         super().__init__(entity)
         self.time = 0
-        self.startThreshold = 30
 
     def shouldStartExecute(self, game):
         """
@@ -85,81 +96,14 @@ class GroupAITask(AITask):
         """
         return CONTINUE if random.randint(0, 10) != 7 else END
 
-    def getGroup(self, game):
-        nearEntities = game.getWorld(self.entity.dimension).getEntitiesNear(self.entity.pos, self.startThreshold+1)
-        return [a for a in nearEntities if isinstance(a, self.entity.__class__)]
-
-    def getDistance(self, game, entity, vec=None):
-        """
-        Get the distance to the closest player and name of that player
-        """
-        # Calculate the distance
-        if vec is None:
-            x, y = self.getVector(game, entity)
-        else:
-            x, y = vec
-        return (x**2 + y**2)**0.5
-
-    def getVector(self, game, entity):
-        """
-        Get the 2D vector from this entity to the given one
-        """
-        if isinstance(entity, int):
-            # Evading an entity
-            target = game.getEntity(entity)
-        elif isinstance(entity, str):
-            # Evading a player
-            target = game.getPlayer(entity)
-        else:
-            target = None
-
-        # Return an out-of-range value if the entity couldn't be found
-        if target is None:
-            return [400, 400]
-
-        # Calulate the vector
-        x, y = self.entity.pos
-        return [(target.pos[0]-x), (target.pos[1]-y)]
-
-    def getWeightVector(self, game, entity):
-        """
-        Get a weighting vector used to calculate the direction to move to evade enemies
-        """
-        # Get the actual vector to the target
-        defaultVec = self.getVector(game, entity)
-        # If the vector is out-of-bounds, nullify it so as not to skew results
-        if defaultVec == [400, 400]:
-            return None
-        # Get the distance
-        dist = self.getDistance(game, entity, defaultVec)
-        # Multiply, invert and return
-        multiplier = self.safeThreshold/dist - 1
-        return [a*multiplier for a in defaultVec]
-
     def continueExecution(self, game, deltaTime):
         """
         Execute a continuous task for a tick
         """
         self.time += deltaTime
 
-        # Get the direction weights
-        weights = []
-        for e in self.getGroup(game):
-            # Get the weight vector
-            weight = self.getWeightVector(game, e)
-            if weight:
-                weights.append(weight)
-
-        # Get the average of the vectors
-        if weights:
-            direction = [sum([b[a] for b in weights])/len(weights) for a in (0, 1)]
-            # Normalise, then calculate and apply the appropriate displacement
-            mag = (direction[0]**2 + direction[1]**2)**-0.5
-            displacement = [a * mag * deltaTime * self.entity.speed for a in direction]
-        else:
-            displacement = [0, 0]
-
-        self.entity.pos = [self.entity.pos[a]+displacement[a] for a in (0, 1)]
+        # Steer with the rest of the group, which is done for every grouping entity at once
+        game.getWorld(self.entity.dimension).groupSteering.queueEntity(self.entity, deltaTime)
 
 class EvadeAITask(AITask):
     def __init__(self, entity):
@@ -248,13 +192,7 @@ class EvadeAITask(AITask):
                 if weight:
                     weights.append(weight)
 
-        # Get the average of the vectors
+        # Get the average of the vectors, and move at full speed in that direction
         if weights:
             direction = [sum([b[a] for b in weights])/len(weights) for a in (0, 1)]
-            # Normalise, then calculate and apply the appropriate displacement
-            mag = (direction[0]**2 + direction[1]**2)**-0.5
-            displacement = [a * mag * deltaTime * self.entity.speed for a in direction]
-        else:
-            displacement = [0, 0]
-
-        self.entity.pos = [self.entity.pos[a]+displacement[a] for a in (0, 1)]
+            self.entity.steer(direction, deltaTime)
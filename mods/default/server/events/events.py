@@ -1,5 +1,4 @@
 import random
-from copy import deepcopy
 import time
 
 from api.item import *
@@ -43,8 +42,9 @@ def onTick(game, deltaTime, tick):
             if conn.username:
                 player = game.getPlayer(conn.username)
                 # Customise the packet for each player
-                packet = WorldUpdatePacket(game.getWorld(player.dimension), player)
-                pp.sendToPlayer(packet, conn.username)
+                relevance = game.modLoader.gameRegistry.updateRelevance
+                packet = WorldUpdatePacket(game.getWorld(player.dimension), player, relevance)
+                pp.sendToPlayer(packet, conn.username, True)
 
 def onPlayerMount(game, player, entity, success, mode):
     """
@@ -152,7 +152,15 @@ def onPlayerCreated(game, player):
     player.inventory.items['left'] = ItemStack(Sword(), 1)
 
     # Give the player a tradestate to handle trading
-    props = deepcopy(game.getModInstance('ServerMod').tradeStateProperty)
+    props = game.getModInstance('ServerMod').tradeStateProperty.copy()
+    player.setProperty('tradeState', props)
+
+def onPlayerLoaded(game, player):
+    """
+    Event Hook: onPlayerLoaded
+    Set up a player loaded from the saved world, as trades don't survive a restart
+    """
+    props = game.getModInstance('ServerMod').tradeStateProperty.copy()
     player.setProperty('tradeState', props)
 
 def onDisconnect(game, username):
@@ -171,7 +179,7 @@ def onDisconnect(game, username):
         player.ridingEntity = None
 
     # Give the player a tradestate to handle trading
-    props = deepcopy(game.getModInstance('ServerMod').tradeStateProperty)
+    props = game.getModInstance('ServerMod').tradeStateProperty.copy()
     player.setProperty('tradeState', props)
 
     # TODO Move the player out of danger. Somehow...
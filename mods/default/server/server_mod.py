@@ -11,7 +11,7 @@ from mods.default.items import *
 from mods.default.dimension import DefaultChunkProvider
 from mods.default.server.entity import bear, npc
 from mods.default.server.vehicle import horse
-from mods.default.server.events import *
+from mods.default.server.events import events
 
 import util
 import random
@@ -26,14 +26,15 @@ class ServerMod(Mod):
 
     def load(self):
         # Initialise the packet pipeline
-        self.packetPipeline = network.PacketHandler(self.game, util.SERVER, self.game.getOpenPort())
+        self.packetPipeline = network.PacketChannel(self.game, util.SERVER, 'default')
         # Register the valid packet classes
         packets = [
                     FetchPlayerImagePacket, SendInventoryPacket,
                     FetchInventoryPacket, SendPlayerImagePacket,
                     FetchPickupItem, SendPickupItem,
                     StartTradePacket, ConfirmTradePacket,
-                    EndTradePacket, RespondTradePacket
+                    EndTradePacket, RespondTradePacket,
+                    InventoryDeltaPacket
                   ]
         for packet in packets:
             self.packetPipeline.registerPacket(packet)
@@ -55,7 +56,8 @@ class ServerMod(Mod):
     def postLoad(self):
         # Register the commands
         self.commands = [('/kick', KickPlayerCommand), ('/spawn', SpawnEntityCommand),
-                         ('/create', ConstructVehicleCommand), ('/trade', TradeRequestCommand)
+                         ('/create', ConstructVehicleCommand), ('/trade', TradeRequestCommand),
+                         ('/save', SaveWorldCommand)
                         ]
         for comm in self.commands:
             self.gameRegistry.registerCommand(*comm)
@@ -75,6 +77,7 @@ class ServerMod(Mod):
         self.gameRegistry.registerEventHandler(events.onEntityDeath, 'onEntityDeath')
         self.gameRegistry.registerEventHandler(events.onPlayerLogin, 'onPlayerLogin')
         self.gameRegistry.registerEventHandler(events.onPlayerCreated, 'onPlayerCreated')
+        self.gameRegistry.registerEventHandler(events.onPlayerLoaded, 'onPlayerLoaded')
         self.gameRegistry.registerEventHandler(events.onPlayerMount, 'onPlayerMount')
         self.gameRegistry.registerEventHandler(events.onEntityDamage, 'onEntityDamage')
         self.gameRegistry.registerEventHandler(events.onEntityDamage, 'onPlayerDamage')
@@ -96,6 +99,21 @@ class KickPlayerCommand(cmd.Command):
             self.game.fireEvent('onDisconnect', player.name)
             break
 
+class SaveWorldCommand(cmd.Command):
+    def run(self, username, *args):
+        pp = self.game.packetPipeline
+        # Send a failure message if the user doesn't have elevated privileges
+        if username not in open('mods/default/server/elevated_users').read().split('\n')[:-1]:
+            pp.sendToPlayer(SendCommandPacket('/message You do not have permission to use that command'), username)
+            return
+
+        if not self.game.persistence:
+            pp.sendToPlayer(SendCommandPacket('/message global World saving is disabled on this server.'), username)
+        elif self.game.persistence.startSnapshot():
+            pp.sendToPlayer(SendCommandPacket('/message global Saving the world...'), username)
+        else:
+            pp.sendToPlayer(SendCommandPacket('/message global The world is already being saved.'), username)
+
 class TradeRequestCommand(cmd.Command):
     def run(self, username, *args):
         requestingPlayer = self.game.getPlayer(username)
@@ -13,6 +13,9 @@ class Water(Tile):
     def __init__(self):
         self.setTileName('water')
 
+    def isWalkable(self):
+        return False
+
 class Sand(Tile):
     def __init__(self):
         self.setTileName('sand')
@@ -33,3 +36,6 @@ class GrassPlant(Plant):
 class TreePlant(Plant):
     def __init__(self):
         self.setTileName('bear')
+
+    def isWalkable(self):
+        return False
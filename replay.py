@@ -0,0 +1,214 @@
+"""
+replay.py
+A tool to replay a packet capture into a headless server, without any sockets
+Reports the tick time and packet handler time, so performance regressions can be found using real traffic
+
+Capture traffic by running a server with:
+python3 main.py --mode SERVER --capture <file>
+
+Usage:
+python3 replay.py <file> [--speed 1|<N>|max] [--seed <seed>] [--disableMods]
+"""
+# Import the Python standard libraries
+import sys
+import time
+import random
+import io
+
+# Import the game's modules
+import util
+import game
+from api import network
+
+class ReplayConnection(network.Connection):
+    """
+    A connection that encodes the packets sent to it, but never sends them anywhere
+    """
+    def __init__(self):
+        super().__init__(None, 'replay')
+
+    def __repr__(self):
+        return 'ReplayConnection(username={})'.format(self.username)
+
+    def close(self):
+        pass
+
+    def sendPacket(self, packet, unreliable=False, channel=0):
+        buf = io.BytesIO()
+        packet.toBytes(buf)
+        self.bytesSent += len(buf.getvalue())
+
+class ReplayStats:
+    """
+    Collect the time taken by ticks and by each type of packet
+    """
+    def __init__(self):
+        self.tickTimes = []
+        self.handlerTimes = {}
+        self.errors = {}
+
+    def addHandlerTime(self, packetType, handlerTime):
+        self.handlerTimes[packetType] = self.handlerTimes.get(packetType, [])+[handlerTime]
+
+    def addError(self, packetType):
+        self.errors[packetType] = self.errors.get(packetType, 0)+1
+
+    def printReport(self):
+        """
+        Print the tick and handler time tables
+        """
+        times = sorted(self.tickTimes)
+        print('Ticks: {}'.format(len(times)))
+        if times:
+            print('Tick time (ms): p50 {:.3f}  p95 {:.3f}  p99 {:.3f}  max {:.3f}  total {:.1f}'.format(
+                  *[percentile(times, p)*1000 for p in (50, 95, 99)], times[-1]*1000, sum(times)*1000))
+
+        print()
+        print('{:<32} {:>8} {:>10} {:>10} {:>10} {:>7}'.format('packet', 'count', 'total ms', 'mean ms', 'max ms', 'errors'))
+        for packetType in sorted(self.handlerTimes, key=lambda a: -sum(self.handlerTimes[a])):
+            times = self.handlerTimes[packetType]
+            print('{:<32} {:>8} {:>10.2f} {:>10.4f} {:>10.4f} {:>7}'.format(packetType, len(times),
+                  sum(times)*1000, sum(times)*1000/len(times), max(times)*1000, self.errors.get(packetType, 0)))
+
+def percentile(values, p):
+    """
+    Return the pth percentile of a sorted list of values
+    """
+    return values[min(len(values)-1, int(len(values)*p/100))]
+
+def replayRecord(server, stats, kind, connIndex, data):
+    """
+    Feed a single capture record into the server, timing the packet handler
+    """
+    pp = server.packetPipeline
+
+    if kind == network.CAPTURE_OPEN:
+        pp.connections[connIndex] = ReplayConnection()
+        return
+
+    connection = pp.connections.get(connIndex)
+    if connection is None:
+        return
+
+    if kind == network.CAPTURE_CLOSE:
+        if connection.username:
+            server.fireEvent('onDisconnect', connection.username)
+        pp.connections.pop(connIndex, None)
+        return
+
+    # Find the handler and packet to run
+    if kind == network.CAPTURE_FRAME:
+        try:
+            dataDictionary = pp.parsePacket(data)
+        except Exception:
+            return
+        handler = pp.channels.get(dataDictionary.get('channel'))
+        packetType = dataDictionary.get('type')
+        run = lambda: handler.handlePacket(dataDictionary, connIndex)
+
+    elif kind == network.CAPTURE_DATAGRAM:
+        header = pp.parseDatagram(data)
+        if not header or header[0] != network.DATAGRAM_DATA:
+            return
+        dataKind, sessionKey, sequence, channel, packetType, packetData = header
+        if not connection.acceptDatagram(packetType, sequence):
+            return
+        handler = pp.channels.get(channel)
+        packetClass = None
+        for packet in (handler.safePackets if handler else []):
+            if packet.__name__ == packetType:
+                packetClass = packet
+        if packetClass is None:
+            return
+        run = lambda: handler.processPacket(packetClass, packetData, connIndex)
+
+    else:
+        return
+
+    if handler is None:
+        return
+
+    # Run the handler synchronously, so the replay is repeatable
+    start = time.perf_counter()
+    try:
+        run()
+    except Exception:
+        stats.addError(packetType)
+    stats.addHandlerTime(packetType, time.perf_counter()-start)
+
+def replay(path, speed, server, stats):
+    """
+    Replay a capture into a server, interleaving the records with ticks at the capture times
+    A speed of 0 runs as fast as possible
+    """
+    tickLength = 1/util.FPS
+    records = network.readCapture(path)
+    record = next(records, None)
+    if record is None:
+        print('[WARNING] Capture is empty')
+        return
+
+    captureStart = record[1]
+    replayStart = time.time()
+    nextTick = captureStart
+
+    # Keep ticking for a second after the last record, so its effects are included
+    lastTick = None
+    while lastTick is None or nextTick <= lastTick:
+        # Feed in every record received before this tick
+        while record and record[1] < nextTick:
+            kind, timestamp, connIndex, data = record
+            replayRecord(server, stats, kind, connIndex, data)
+            record = next(records, None)
+            if record is None:
+                lastTick = nextTick + 1
+
+        # Wait until the tick is due, scaled by the speed
+        if speed:
+            delay = replayStart + (nextTick-captureStart)/speed - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+        start = time.perf_counter()
+        server.tickGame()
+        stats.tickTimes.append(time.perf_counter()-start)
+        nextTick += tickLength
+
+def main(args):
+    if not args or args[0].startswith('--'):
+        print(__doc__)
+        return
+    path = args[0]
+
+    # Handle the command line arguments
+    speed = 1
+    seed = 0
+    gameArgs = ['--mode', 'SERVER', '--disableNetwork', '--disablePersistence']
+    i = 1
+    while i < len(args):
+        if args[i] == '--speed' and i != len(args)-1:
+            speed = 0 if args[i+1] == 'max' else float(args[i+1])
+            i += 1
+        elif args[i] == '--seed' and i != len(args)-1:
+            seed = args[i+1]
+            gameArgs += ['--seed', seed]
+            i += 1
+        elif args[i] == '--disableMods':
+            gameArgs.append(args[i])
+        else:
+            print('[WARNING] Unknown argument: {}'.format(args[i]))
+        i += 1
+
+    # Start a headless server with no sockets, which doesn't load or save the worlds
+    server = game.Game(util.ArgumentHandler(gameArgs))
+    random.seed(seed)
+    server.fireEvent('onGameLaunch')
+    server.tick = 0
+    server.deltaTime = 1/util.FPS
+
+    stats = ReplayStats()
+    replay(path, speed, server, stats)
+    stats.printReport()
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -2,7 +2,6 @@
 Util module
 This module contains miscellaneous classes and constants that are used by the game engine
 """
-import pygame
 import math
 
 SERVER = 0
@@ -15,6 +14,17 @@ with open('config') as f:
         DEFAULT_PORT = int(configuration.get('defaultport', 6658))
         MAX_PLAYERS = int(configuration.get('maxplayers', 100))
         FPS = int(configuration.get('maxfps', 60))
+        ENABLE_UDP = bool(int(configuration.get('enableudp', 1)))
+        UPDATE_BUDGET = int(configuration.get('updatebudget', 4096))
+        ENTITY_STORE = bool(int(configuration.get('entitystore', 1)))
+        AI_BUDGET = float(configuration.get('aibudget', 10))/1000
+        SIMULATION_TIERS = [tuple([int(b) for b in a.split(':')]) for a in configuration.get('simulationtiers', '32:1,64:4,128:16').split(',')]
+        SAVE_DIR = configuration.get('savedir', 'saves')
+        SNAPSHOT_INTERVAL = float(configuration.get('snapshotinterval', 300))
+        SNAPSHOT_BUDGET = float(configuration.get('snapshotbudget', 2))/1000
+        FSYNC_POLICY = configuration.get('fsyncpolicy', 'snapshot')
+        if FSYNC_POLICY not in ('always', 'snapshot', 'never'):
+            raise ValueError
     except IndexError:
         raise SyntaxError('[ERROR] Invalid config file. Configuration cannot be loaded.')
     except ValueError:
@@ -23,8 +33,23 @@ with open('config') as f:
 #DEFAULT_PORT = 6658
 #MAX_PLAYERS = 100
 #FPS = 60
-
-DISPLAY_FLAGS = pygame.DOUBLEBUF | pygame.HWSURFACE | pygame.RESIZABLE
+#ENABLE_UDP = True
+#UPDATE_BUDGET = 4096
+#ENTITY_STORE = True
+#AI_BUDGET = 0.01
+#SIMULATION_TIERS = [(32, 1), (64, 4), (128, 16)]
+#SAVE_DIR = 'saves'
+#SNAPSHOT_INTERVAL = 300
+#SNAPSHOT_BUDGET = 0.002
+#FSYNC_POLICY = 'snapshot'
+
+def getDisplayFlags():
+    """
+    Return the pygame display flags
+    pygame is only imported here, so that headless runtimes don't need it
+    """
+    import pygame
+    return pygame.DOUBLEBUF | pygame.HWSURFACE | pygame.RESIZABLE
 
 def calcChecksum(data):
     """
@@ -73,6 +98,10 @@ class ArgumentHandler:
             if arg == '--disableMods':
                 self.results['loadCustomMods'] = False
 
+            # Handle the network toggle argument
+            elif arg == '--disableNetwork':
+                self.results['network'] = False
+
             # Handle the runtime type argument, defaulting to server if invalid
             elif arg == '--mode' and i != len(self.args)-1:
                 self.results['runtimeType'] = {'SERVER' : SERVER,
@@ -98,6 +127,20 @@ class ArgumentHandler:
             elif arg == '--enableSpecialAI':
                 self.results['specialAI'] = True
 
+            # Handle the tick time logging argument
+            elif arg == '--tickLog' and i != len(self.args)-1:
+                self.results['tickLog'] = self.args[i+1]
+                del self.args[i+1]
+
+            # Handle the packet capture argument
+            elif arg == '--capture' and i != len(self.args)-1:
+                self.results['capture'] = self.args[i+1]
+                del self.args[i+1]
+
+            # Handle the world saving toggle argument
+            elif arg == '--disablePersistence':
+                self.results['persistence'] = False
+
             # Print a warning message if an unknown argument is given
             else:
                 print('[WARNING] Unknown argument: {}'.format(arg))
@@ -127,6 +170,30 @@ class ArgumentHandler:
         """
         return self.results.get('seed', 0)
 
+    def getTickLog(self):
+        """
+        Return the file to log the time taken by each tick to, if any
+        """
+        return self.results.get('tickLog')
+
+    def getCaptureFile(self):
+        """
+        Return the file to capture inbound packets to, if any
+        """
+        return self.results.get('capture')
+
+    def getNetworkEnabled(self):
+        """
+        Return whether to listen for network connections
+        """
+        return self.results.get('network', True)
+
+    def getPersistenceEnabled(self):
+        """
+        Return whether to load and save the server's worlds
+        """
+        return self.results.get('persistence', True)
+
     def getConnectingAddress(self):
         """
         Return the address that this client is going to connect to